@@ -0,0 +1,313 @@
+# -----------------------------------------------------------
+# AnnIndex Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import numpy as np
+import argparse
+import time
+
+# Find the nearest centroid of every row
+#
+# Parameters:
+# data:      the (rows x dimension) float32 matrix
+# centroids: the (centroids x dimension) float32 matrix
+# chunk:     the number of rows compared at once (Default: 65536)
+def assign(data, centroids, chunk = 65536):
+    cNorms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        block = np.asarray(data[start:start + chunk], dtype=np.float32)
+        d2 = block @ centroids.T                # |c|^2 - 2 x.c has the same argmin of |x - c|^2
+        d2 *= -2
+        d2 += cNorms[None, :]
+        labels[start:start + len(block)] = np.argmin(d2, axis=1)
+    return labels
+
+# Cluster some rows with k-means (Lloyd's iterations)
+#
+# Parameters:
+# data:       the (rows x dimension) float32 matrix
+# k:          the number of clusters
+# iterations: the number of iterations (Default: 10)
+# seed:       the seed of the random initialization (Default: 0)
+#
+# Return: the (k x dimension) float32 centroids
+def kmeans(data, k, iterations = 10, seed = 0):
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():             # restart the empty clusters from random rows
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+# AnnIndex class
+#
+# This class is an approximate nearest neighbor index (IVF, inverted file)
+# for large galleries of face encodings:
+# - the encodings are clustered with k-means in nlist lists
+# - a query is compared only with the encodings of the nprobe lists
+#   with the nearest centroids
+# - the encodings are stored compressed: float16 (half the memory of float32)
+#   or int8 (a quarter), with a per-dimension scale
+# The encodings added after the build are kept in a small exact tail,
+# until the index is built again.
+#
+# How to use it?
+# 1) Create an instance of the class:       a = AnnIndex(storage = "int8")
+# 2) Build it on the gallery matrix:        a.build(matrix)
+# 3) Search the k nearest rows:             distances, rows = a.search(encodings, k = 1)
+class AnnIndex:
+
+    # Constructor
+    #
+    # Parameters:
+    # nlist:      the number of lists (Default: None, 4 * sqrt(rows))
+    # nprobe:     the number of lists searched for every query (Default: 32, recall@1 >= 0.99
+    #             on 200000 random encodings with the default nlist)
+    # storage:    the compressed type of the encodings: "float16" or "int8" (Default: "float16")
+    # iterations: the k-means iterations (Default: 10)
+    # sample:     the max number of rows used to train the k-means (Default: 100000)
+    def __init__(self, nlist = None, nprobe = 32, storage = "float16", iterations = 10, sample = 100000):
+        if storage not in ("float16", "int8"):
+            raise ValueError("AnnIndex: unknown storage " + storage)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.storage = storage
+        self.iterations = iterations
+        self.sample = sample
+        self.centroids = None
+        self.codes = None           # compressed encodings, sorted by list
+        self.rows = None            # gallery row of every code
+        self.offsets = None         # codes of list l: codes[offsets[l]:offsets[l + 1]]
+        self.sqNorms = None         # squared norm of every decoded code
+        self.scale = None           # int8 storage: x = (code + 128) * scale + low
+        self.low = None
+        self.tail = []              # (row, encoding) added after the build
+        self.size = 0               # number of rows in the lists
+        return
+
+    # Number of indexed encodings
+    def __len__(self):
+        return self.size + len(self.tail)
+
+    # Compress some encodings
+    def encode(self, data):
+        if self.storage == "float16":
+            return data.astype(np.float16)
+        codes = np.rint((data - self.low) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    # Decompress some encodings
+    def decode(self, codes):
+        if self.storage == "float16":
+            return codes.astype(np.float32)
+        return (codes.astype(np.float32) + 128) * self.scale + self.low
+
+    # Dot products of some queries with some codes, without decoding them:
+    # with int8 storage q.x = (q * scale).(code + 128) + q.low
+    #
+    # Return: the (queries x codes) float32 matrix
+    def dot(self, queries, codes):
+        if self.storage == "float16":
+            return queries @ codes.astype(np.float32).T
+        scaled = queries * self.scale
+        dots = scaled @ codes.astype(np.float32).T
+        dots += (128 * scaled.sum(axis=1) + queries @ self.low)[:, None]
+        return dots
+
+    # Build the index
+    #
+    # Parameters:
+    # matrix: the (rows x dimension) float32 matrix of the encodings (e.g. memory-mapped)
+    def build(self, matrix):
+        n = len(matrix)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(0)
+        train = matrix if n <= self.sample else matrix[np.sort(rng.choice(n, self.sample, replace=False))]
+        train = np.asarray(train, dtype=np.float32)
+        self.centroids = kmeans(train, nlist, self.iterations)
+        if self.storage == "int8":
+            self.low = train.min(axis=0)
+            self.scale = np.maximum(train.max(axis=0) - self.low, 1e-6) / 255.0
+
+        labels = assign(matrix, self.centroids)
+        order = np.argsort(labels, kind="stable")
+        self.rows = order.astype(np.int64)
+        self.codes = np.empty((n, matrix.shape[1]), dtype=np.float16 if self.storage == "float16" else np.int8)
+        self.sqNorms = np.empty(n, dtype=np.float32)
+        for start in range(0, n, 65536):                # compress a chunk at a time: no full float32 copy
+            chunk = order[start:start + 65536]
+            ascending = np.sort(chunk)                  # read the (memory-mapped) matrix in order
+            data = np.asarray(matrix[ascending], dtype=np.float32)[np.searchsorted(ascending, chunk)]
+            codes = self.encode(data)
+            self.codes[start:start + len(chunk)] = codes
+            decoded = self.decode(codes)                # the distances are computed on what is stored
+            self.sqNorms[start:start + len(chunk)] = np.einsum('ij,ij->i', decoded, decoded)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))])
+        self.size = n
+        self.tail = []
+        return
+
+    # Add some encodings after the build (searched exactly until the next build)
+    #
+    # Parameters:
+    # encodings: the new encodings
+    # firstRow:  the gallery row of the first new encoding
+    def add(self, encodings, firstRow):
+        for i, encoding in enumerate(np.asarray(encodings, dtype=np.float32)):
+            self.tail.append((firstRow + i, encoding))
+        return
+
+    # Search the k nearest encodings of every query. The lists probed by any
+    # query are decoded once and compared with all the queries with a single
+    # matrix product (as the exact search); a candidate counts only for the
+    # queries that probed its list.
+    #
+    # Parameters:
+    # queries: the (faces x dimension) encodings
+    # k:       the number of neighbors (Default: 1)
+    #
+    # Return: the (distances, rows) couple of (faces x k) arrays, sorted from the nearest;
+    #         if fewer than k candidates are found, the missing rows are -1 (distance inf)
+    def search(self, queries, k = 1):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        nprobe = min(self.nprobe, len(self.centroids))
+        d2c = np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :] - 2 * queries @ self.centroids.T
+        probes = np.argpartition(d2c, nprobe - 1, axis=1)[:, :nprobe]
+
+        # Candidates: the codes of the probed lists, each one with the position of its list
+        lists = np.unique(probes)
+        starts = self.offsets[lists]
+        lengths = self.offsets[lists + 1] - starts
+        total = int(lengths.sum())
+        listOf = np.repeat(np.arange(len(lists)), lengths)
+        positions = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        candidateRows = self.rows[positions]
+        candidateNorms = self.sqNorms[positions]
+        dots = self.dot(queries, self.codes[positions])
+        probed = np.zeros((len(queries), len(lists)), dtype=bool)
+        probed[np.arange(len(queries))[:, None], np.searchsorted(lists, probes)] = True
+        mask = probed[:, listOf]
+        if len(self.tail) > 0:          # the tail is compared with every query
+            tailData = np.array([encoding for _, encoding in self.tail], dtype=np.float32)
+            dots = np.hstack([dots, queries @ tailData.T])
+            candidateRows = np.concatenate([candidateRows, np.array([row for row, _ in self.tail], dtype=np.int64)])
+            candidateNorms = np.concatenate([candidateNorms, np.einsum('ij,ij->i', tailData, tailData)])
+            mask = np.hstack([mask, np.ones((len(queries), len(tailData)), dtype=bool)])
+
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(candidateRows) == 0:
+            return distances, rows
+        d2 = dots
+        d2 *= -2
+        d2 += np.einsum('ij,ij->i', queries, queries)[:, None]
+        d2 += candidateNorms[None, :]
+        np.maximum(d2, 0, out=d2)
+        d2[~mask] = np.inf
+        kk = min(k, len(candidateRows))
+        best = np.argpartition(d2, kk - 1, axis=1)[:, :kk] if kk < len(candidateRows) else np.broadcast_to(np.arange(kk), (len(queries), kk))
+        bestD2 = np.take_along_axis(d2, best, axis=1)
+        order = np.argsort(bestD2, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        bestD2 = np.take_along_axis(bestD2, order, axis=1)
+        found = np.isfinite(bestD2)
+        distances[:, :kk] = np.where(found, np.sqrt(bestD2), np.inf)
+        rows[:, :kk] = np.where(found, candidateRows[best], -1)
+        return distances, rows
+
+    # Memory used by the index, in bytes
+    def nbytes(self):
+        arrays = [self.centroids, self.codes, self.rows, self.offsets, self.sqNorms, self.scale, self.low]
+        return sum(a.nbytes for a in arrays if a is not None) + len(self.tail) * 4 * self.centroids.shape[1]
+
+# Create a synthetic gallery and its queries: every query is a gallery row plus
+# some noise, as a second photo of the same individual
+#
+# Parameters:
+# size:    the number of enrolled individuals
+# queries: the number of queries
+# seed:    the random seed (Default: 0)
+def syntheticGallery(size, queries, seed = 0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(0, 1 / 16.0, (size, 128)).astype(np.float32)      # ~1.0 between individuals
+    truth = rng.choice(size, queries, replace=size < queries)
+    noise = rng.normal(0, 0.35 / np.sqrt(128), (queries, 128)).astype(np.float32)  # ~0.35 for the same individual
+    return matrix, matrix[truth] + noise
+
+# Measure the recall@1 (agreement with the exact search) and the latency of some index settings.
+# The queries are searched a frame at a time, as the recognition does.
+#
+# Parameters:
+# matrix:   the gallery encodings
+# queries:  the query encodings
+# storages: the storage types to measure
+# nprobes:  the nprobe values to measure
+# nlist:    the number of lists (Default: None, automatic)
+# faces:    the number of queries searched together, the faces of a frame (Default: 4)
+# log:      the function printing the results (Default: print)
+#
+# Return: a list with a dictionary for every setting (the first one is the exact search)
+def evaluate(matrix, queries, storages, nprobes, nlist = None, faces = 4, log = print):
+    from src.FaceGallery import FaceGallery
+    gallery = FaceGallery()
+    gallery.load(matrix, [str(i) for i in range(len(matrix))])
+    gallery.norms()
+    frames = range(0, len(queries), faces)
+    start = time.perf_counter()
+    exact = np.concatenate([np.argmin(gallery.distances(queries[i:i + faces]), axis=1) for i in frames])
+    exactMs = 1000 * (time.perf_counter() - start) / len(queries)
+    results = [{"index": "exact float32", "recall@1": 1.0, "ms_per_query": exactMs, "mb": matrix.nbytes / 2**20}]
+    log("%-26s recall@1 %.3f  %8.3f ms/query  %8.1f MB" % ("exact float32", 1.0, exactMs, matrix.nbytes / 2**20))
+    for storage in storages:
+        index = AnnIndex(nlist, storage=storage)
+        start = time.perf_counter()
+        index.build(matrix)
+        buildTime = time.perf_counter() - start
+        for nprobe in nprobes:
+            index.nprobe = nprobe
+            start = time.perf_counter()
+            rows = np.concatenate([index.search(queries[i:i + faces], 1)[1] for i in frames])
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            recall = float(np.mean(rows[:, 0] == exact))
+            name = "ivf%d %s nprobe=%d" % (len(index.centroids), storage, nprobe)
+            results.append({"index": name, "recall@1": recall, "ms_per_query": ms,
+                            "mb": index.nbytes() / 2**20, "build_s": buildTime})
+            log("%-26s recall@1 %.3f  %8.3f ms/query  %8.1f MB" % (name, recall, ms, index.nbytes() / 2**20))
+    return results
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Compare the approximate index with the exact gallery search")
+    parser.add_argument("--db", default=None, help="use the gallery of this EncodingStore folder (default: synthetic)")
+    parser.add_argument("--size", type=int, default=200000, help="synthetic gallery size (default: 200000)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--storage", nargs="+", default=["float16", "int8"], choices=["float16", "int8"])
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[8, 16, 32, 64])
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--faces", type=int, default=4, help="queries searched together, as the faces of a frame (default: 4)")
+    args = parser.parse_args()
+
+    if args.db:
+        from src.EncodingStore import EncodingStore
+        matrix = EncodingStore(args.db).encodings
+        rng = np.random.default_rng(0)
+        queries = matrix[rng.choice(len(matrix), args.queries)] + rng.normal(0, 0.03, (args.queries, matrix.shape[1])).astype(np.float32)
+    else:
+        matrix, queries = syntheticGallery(args.size, args.queries)
+    evaluate(matrix, queries, args.storage, args.nprobe, args.nlist, args.faces)
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -----------------------------------------------------------
+# AutoRateController Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import os
+import time
+
+# AutoRateController class
+#
+# This class sets the capture FPS of the video stream and the analysis interval
+# of the inference worker from what it measures, instead of fixed values:
+# - the analysis time of the frames (from the FrameMetrics "analysis" stage)
+# - the CPU load of the process (CPU time over wall time, on all the cores)
+# The end-to-end latency of a result is about the age of the analyzed frame
+# (at most 1/FPS, as the worker takes the most recent one) plus its analysis
+# time, so the FPS is the lowest one meeting the target latency: capturing
+# faster only burns CPU on frames dropped before the analysis.
+# The analysis runs back to back (interval 0) while the cores have room, and
+# is spaced out when the CPU load goes over its target, so the capture and the
+# GUI are not starved. Both settings are smoothed to avoid oscillations.
+#
+# How to use it?
+# 1) Create an instance of the class:       c = AutoRateController(metrics, targetLatency = 0.25)
+# 2) Call it periodically (e.g. every 1s):  c.step(videoStream, worker)
+# 3) Read its state:                        c.summary()
+class AutoRateController:
+
+    # Constructor
+    #
+    # Parameters:
+    # metrics:       the FrameMetrics where the analysis time is recorded
+    # targetLatency: the target end-to-end latency of a result, in seconds (Default: 0.25)
+    # cpuTarget:     the max fraction of all the cores used by the process (Default: 0.85)
+    # fps:           the initial capture FPS (Default: 5)
+    # interval:      the initial analysis interval, in ms (Default: 200)
+    # minFps:        the lowest FPS (Default: 5)
+    # maxFps:        the highest FPS (Default: 60)
+    # maxInterval:   the longest analysis interval, in ms (Default: 2000)
+    # smoothing:     the weight of the last measure in the moving averages (Default: 0.5)
+    def __init__(self, metrics, targetLatency = 0.25, cpuTarget = 0.85, fps = 5, interval = 200,
+                 minFps = 5, maxFps = 60, maxInterval = 2000, smoothing = 0.5):
+        self.metrics = metrics
+        self.targetLatency = targetLatency
+        self.cpuTarget = cpuTarget
+        self.minFps = minFps
+        self.maxFps = maxFps
+        self.maxInterval = maxInterval
+        self.smoothing = smoothing
+        self.fps = float(fps)
+        self.interval = float(interval)
+        self.cores = os.cpu_count() or 1
+        self.latency = None                 # moving average of the analysis time (seconds)
+        self.cpu = None                     # moving average of the CPU load (fraction of all the cores)
+        self.analyzed = 0                   # analysis measures already read from the metrics
+        self.lastWall = time.time()
+        self.lastCpu = time.process_time()
+        return
+
+    # Update a moving average with a new measure
+    def average(self, current, value):
+        if current is None:
+            return value
+        return current + self.smoothing * (value - current)
+
+    # Measure the analysis time and the CPU load since the last call
+    def measure(self):
+        durations, self.analyzed = self.metrics.since("analysis", self.analyzed)
+        if len(durations) > 0:
+            self.latency = self.average(self.latency, sum(durations) / len(durations))
+        wall, cpu = time.time(), time.process_time()
+        if wall - self.lastWall > 0:
+            load = (cpu - self.lastCpu) / (wall - self.lastWall) / self.cores
+            self.cpu = self.average(self.cpu, min(1.0, max(0.0, load)))
+        self.lastWall, self.lastCpu = wall, cpu
+        return
+
+    # Compute the new settings from the measures
+    def adjust(self):
+        if self.latency is None or self.cpu is None:
+            return
+        # FPS: a frame must not be older than the latency left after the analysis
+        # (if the analysis alone misses the target, the frames are kept at most 1/4 of it old)
+        left = max(self.targetLatency - self.latency, self.targetLatency / 4)
+        fps = 1 / left
+        if self.cpu > self.cpuTarget:
+            fps = min(fps, self.fps * self.cpuTarget / self.cpu)    # the capture gives CPU back too
+        self.fps = min(self.maxFps, max(self.minFps, self.average(self.fps, fps)))
+        # Interval: space the analysis out only when the CPU is saturated
+        if self.cpu > self.cpuTarget:
+            interval = max(self.interval, self.latency * 1000) * self.cpu / self.cpuTarget
+        elif self.cpu < 0.8 * self.cpuTarget:
+            interval = self.interval * 0.5 if self.interval > 10 else 0
+        else:
+            interval = self.interval
+        self.interval = min(self.maxInterval, max(0.0, self.average(self.interval, interval)))
+        return
+
+    # Measure, adjust and apply the settings
+    #
+    # Parameters:
+    # video:  the VideoStreamWidget whose fps is set (or None)
+    # worker: the InferenceWorker whose interval is set (or None)
+    def step(self, video, worker):
+        self.measure()
+        self.adjust()
+        if video is not None and not video.close:
+            video.fps = int(round(self.fps))
+        if worker is not None:
+            worker.interval = int(round(self.interval))
+        return
+
+    # Human readable state of the controller
+    def summary(self):
+        if self.latency is None or self.cpu is None:
+            return "Auto rate: measuring..."
+        return "Auto rate: %d fps, analysis every %d ms (analysis %.0f ms, CPU %.0f%%, target %.0f ms)" % (
+            round(self.fps), round(self.interval), self.latency * 1000, self.cpu * 100, self.targetLatency * 1000)
@@ -0,0 +1,258 @@
+# -----------------------------------------------------------
+# Benchmark script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# OpenFader
+from src.OpenFader import OpenFader
+# Face Gallery
+from src.FaceGallery import FaceGallery
+import numpy as np
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+
+# This code aim to measure, without any GUI, how fast every algorithm of
+# OpenFader.algorithmMap is, in a reproducible way:
+# - the frames are made from the bundled image (or synthetic, if it's missing),
+#   tiled to get more faces and resized to several resolutions
+# - Recognition is measured against galleries of several sizes (random encodings)
+# - for every scenario it reports the latency distribution, the throughput and the memory
+#   (peak of the Python allocations, peak and growth of the resident memory)
+# - the results can be saved as a baseline and compared with a later run
+#
+# How to use it?
+# python -m src.Benchmark --output bench.json                       -> run and save
+# python -m src.Benchmark --baseline bench.json --threshold 0.15    -> run and flag regressions > 15%
+
+ALGORITHMS = ["Detection", "Expression", "Recognition"]
+BUNDLED_IMAGES = ["media/_1040009.jpg", "Media/_1040009.JPG", "Media/_1040009.jpg"]
+
+# Load the bundled image, or create a synthetic frame if it's missing
+def loadBaseFrame():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in BUNDLED_IMAGES:
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame, name
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), "synthetic"
+
+# Create a benchmark frame: the base frame tiled in a grid (to multiply its faces)
+# and resized to the wanted resolution
+#
+# Parameters:
+# base:   the base frame
+# tiles:  the number of copies of the base frame (rounded up to a square grid)
+# width:  the width of the frame
+# height: the height of the frame
+def makeFrame(base, tiles, width, height):
+    side = int(math.ceil(math.sqrt(tiles)))
+    rows = [np.hstack([base] * side) for _ in range(side)]
+    grid = np.vstack(rows)
+    return cv2.resize(grid, (width, height), interpolation=cv2.INTER_AREA)
+
+# Fill a gallery with random (reproducible) encodings
+#
+# Parameters:
+# size: the number of enrolled individuals
+def makeGallery(size):
+    rng = np.random.default_rng(size)
+    gallery = FaceGallery()
+    encodings = rng.normal(0, 0.1, (size, 128)).astype(np.float32)
+    gallery.addMany(encodings, ["person_%d" % i for i in range(size)])
+    return gallery
+
+# Read a memory field (in kB) of /proc/self/status, in MB (None if not available, e.g. not on Linux)
+def procStatus(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+# Current resident memory of the process, in MB (None if not available)
+def currentRss():
+    return procStatus("VmRSS")
+
+# Peak resident memory of the process since the last resetPeakRss, in MB (None if not available)
+def peakRss():
+    return procStatus("VmHWM")
+
+# Reset the peak resident memory, so it's measured for one scenario only
+# (the getrusage peak can't be reset: it's the peak of the whole process life)
+#
+# Return: True if the peak was reset (Linux only)
+def resetPeakRss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# Measure one scenario
+#
+# Parameters:
+# fader:      the OpenFader instance
+# algorithm:  the analysis to execute
+# frame:      the frame to analyze
+# iterations: the number of measured runs
+# warmup:     the number of runs before measuring
+#
+# Return: the statistics of the scenario
+def measure(fader, algorithm, frame, iterations, warmup):
+    analyze = fader.algorithmMap[algorithm]["target_analysis_function"]
+    rssBefore = currentRss()
+    reset = resetPeakRss()
+    for _ in range(warmup):
+        fader.initAgain()
+        analyze(frame)
+
+    times = []
+    for _ in range(iterations):
+        fader.initAgain()           # no tracking between runs: every run does the whole work
+        start = time.perf_counter()
+        analyze(frame)
+        times.append(time.perf_counter() - start)
+    faces = len(fader.result)
+    peak_rss = peakRss() if reset else None
+    rssAfter = currentRss()
+
+    # Peak memory in a separate pass (tracing slows the code down)
+    tracemalloc.start()
+    for _ in range(min(3, iterations)):
+        fader.initAgain()
+        analyze(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "mean_ms": float(times.mean()),
+        "fps": float(1000 / times.mean()),
+        "faces_found": faces,
+        "peak_python_mb": peak / 2**20,
+        "peak_rss_mb": peak_rss,
+        "rss_growth_mb": rssAfter - rssBefore if rssBefore is not None and rssAfter is not None else None
+    }
+
+# Run the whole benchmark
+#
+# Parameters:
+# algorithms:  the algorithms to measure
+# resolutions: the (width, height) of the frames
+# faces:       the numbers of copies of the bundled image in a frame
+# galleries:   the gallery sizes for Recognition
+# iterations:  the number of measured runs of every scenario
+# warmup:      the number of runs before measuring
+# log:         the function printing the progress (Default: print)
+#
+# Return: the results dictionary
+def runBenchmark(algorithms, resolutions, faces, galleries, iterations = 20, warmup = 3, log = print):
+    base, baseName = loadBaseFrame()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="openfader-bench-") as db_path:
+        fader = OpenFader(db_path)
+        fader.resolution.adaptive = False       # the same work at every run
+        for algorithm in algorithms:
+            sizes = galleries if algorithm == "Recognition" else [None]
+            for size in sizes:
+                if size is not None:
+                    fader.gallery = makeGallery(size)
+                for width, height in resolutions:
+                    for tiles in faces:
+                        key = "%s|%dx%d|faces=%d" % (algorithm, width, height, tiles)
+                        if size is not None:
+                            key += "|gallery=%d" % size
+                        frame = makeFrame(base, tiles, width, height)
+                        results[key] = measure(fader, algorithm, frame, iterations, warmup)
+                        log("%-50s p50 %8.2f ms  p95 %8.2f ms  %6.1f fps" %
+                            (key, results[key]["p50_ms"], results[key]["p95_ms"], results[key]["fps"]))
+    return {
+        "meta": {
+            "time": time.time(),
+            "frame_source": baseName,
+            "iterations": iterations,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__
+        },
+        "results": results
+    }
+
+# Compare the results with a baseline
+#
+# Parameters:
+# results:   the new results
+# baseline:  the baseline results
+# threshold: the allowed relative slowdown of the p50 latency (Default: 0.1, i.e. 10%)
+#
+# Return: the list of the regressions (key, baseline p50, new p50, relative change)
+def compare(results, baseline, threshold = 0.1):
+    regressions = []
+    for key, new in results["results"].items():
+        old = baseline["results"].get(key)
+        if old is None or old["p50_ms"] <= 0:
+            continue
+        change = new["p50_ms"] / old["p50_ms"] - 1
+        if change > threshold:
+            regressions.append((key, old["p50_ms"], new["p50_ms"], change))
+    return regressions
+
+# Parse a WIDTHxHEIGHT resolution
+def parseResolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OpenFader algorithms without GUI")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=ALGORITHMS)
+    parser.add_argument("--resolutions", nargs="+", type=parseResolution, default=[(320, 240), (640, 480), (1280, 720)],
+                        help="frame resolutions as WIDTHxHEIGHT (default: 320x240 640x480 1280x720)")
+    parser.add_argument("--faces", nargs="+", type=int, default=[1, 4], help="copies of the bundled image in a frame (default: 1 4)")
+    parser.add_argument("--gallery", nargs="+", type=int, default=[100, 1000, 10000], help="gallery sizes for Recognition")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default=None, help="save the results (e.g. as a new baseline) in this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown before flagging a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    results = runBenchmark(args.algorithms, args.resolutions, args.faces, args.gallery, args.iterations, args.warmup)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Results saved in " + args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for key, old, new, change in regressions:
+            print("REGRESSION %s: p50 %.2f ms -> %.2f ms (+%.0f%%)" % (key, old, new, 100 * change))
+        if regressions:
+            sys.exit(1)
+        print("No regression above %.0f%%" % (100 * args.threshold))
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# -----------------------------------------------------------
+# BulkEnrollment script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Encoding Store
+from src.EncodingStore import EncodingStore, encodeImage
+# File Hash
+from src.FileHash import hashFile
+from multiprocessing import Pool
+from functools import partial
+import argparse
+import csv
+import os
+import time
+
+# This code aim to enroll many training images at once in the Face Recognition
+# training dataset, spreading the face encoding across a pool of processes
+#
+# How to use it?
+# - from Python:            enroll("path/to/folder", EncodingStore("Media/db"))
+# - from the command line:  python -m src.BulkEnrollment path/to/folder --db Media/db
+#
+# The source can be:
+# - a folder: the images directly inside it are named after the file (john_smith.png),
+#   the images inside a subfolder are named after the subfolder (john_smith/1.png)
+# - a manifest: a .csv file with "path,name" rows (relative paths start from the manifest folder)
+
+IMAGE_EXTENSIONS = ["PNG", "JPG", "JPEG"]
+
+# Find all the images to enroll in a folder
+#
+# Parameters:
+# directory:  the folder to scan
+# extensions: the allowed image extensions (Default: IMAGE_EXTENSIONS)
+#
+# Return: a list of (path, name) couples
+def collectImages(directory, extensions = IMAGE_EXTENSIONS):
+    items = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            stem, ex = os.path.splitext(f)
+            if ex[1:].upper() not in extensions or stem.startswith("Resized_"):
+                continue
+            if os.path.normpath(root) == os.path.normpath(directory):
+                name = stem                                 # john_smith.png
+            else:
+                name = os.path.relpath(root, directory).split(os.sep)[0]     # john_smith/1.png
+            items.append((os.path.join(root, f), name))
+    return items
+
+# Read the images to enroll from a manifest
+#
+# Parameters:
+# manifest: the path to a .csv file with "path,name" rows
+#
+# Return: a list of (path, name) couples
+def readManifest(manifest):
+    items = []
+    base = os.path.dirname(manifest)
+    with open(manifest, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].strip() == "" or row[0].strip().lower() == "path":
+                continue
+            path_image = row[0].strip()
+            if not os.path.isabs(path_image):
+                path_image = os.path.join(base, path_image)
+            items.append((path_image, row[1].strip()))
+    return items
+
+# Encode one image (executed in a worker process)
+#
+# Parameters:
+# item:    the (path, name) couple of the image
+# encoder: the function computing the encoding of an image path (Default: encodeImage)
+#
+# Return: (path, name, content hash, encoding or None, error message or None)
+def encodeJob(item, encoder = encodeImage):
+    path_image, name = item
+    try:
+        content_hash = hashFile(path_image)
+        return (path_image, name, content_hash, encoder(path_image), None)
+    except Exception as e:          # an unreadable image must not stop the whole enrollment
+        return (path_image, name, None, None, str(e))
+
+# Print the enrollment progress on the standard output
+#
+# Parameters:
+# done:  the number of processed images
+# total: the number of images to process
+# rate:  the throughput (images per second)
+def printProgress(done, total, rate):
+    print("\rEnrolled %d/%d images (%.1f img/s)" % (done, total, rate), end="", flush=True)
+    if done == total:
+        print()
+    return
+
+# Enroll all the images of a folder or a manifest
+#
+# Parameters:
+# source:      a folder or a .csv manifest
+# store:       the EncodingStore where the encodings are saved
+# workers:     the number of worker processes (Default: None, one for each core)
+# progress:    the function called as progress(done, total, rate) (Default: printProgress)
+# chunksize:   the number of images sent to a worker at a time (Default: 4)
+# flush_every: the number of encodings after which the store is written on disk (Default: 1000)
+#
+# Return: a summary dictionary (counts, skipped images, elapsed time and throughput)
+def enroll(source, store, workers = None, progress = printProgress, chunksize = 4, flush_every = 1000):
+    start = time.time()
+    items = readManifest(source) if os.path.isfile(source) else collectImages(source)
+    todo = [item for item in items if not store.isUnchanged(*item)]     # already enrolled images are not encoded again
+    summary = {
+        "total": len(items),
+        "unchanged": len(items) - len(todo),
+        "enrolled": 0,
+        "no_face": [],
+        "failed": []
+    }
+
+    done = 0
+    if len(todo) > 0:
+        with Pool(workers) as pool:
+            # the images are encoded as the store does (e.g. by an InferenceServer)
+            job = partial(encodeJob, encoder=store.encoder)
+            for path_image, name, content_hash, encoding, error in pool.imap_unordered(job, todo, chunksize):
+                done += 1
+                if error is not None:
+                    summary["failed"].append((path_image, error))
+                elif encoding is None:
+                    summary["no_face"].append(path_image)       # skip the images without any face
+                else:
+                    store.add(path_image, name, encoding, flush=False, content_hash=content_hash)
+                    summary["enrolled"] += 1
+                    if summary["enrolled"] % flush_every == 0:
+                        store.flush()
+                if progress:
+                    progress(done, len(todo), done / max(time.time() - start, 1e-9))
+    store.flush()
+
+    summary["seconds"] = time.time() - start
+    summary["images_per_second"] = done / max(summary["seconds"], 1e-9)
+    return summary
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Enroll a folder or a manifest of training images in the OpenFader dataset")
+    parser.add_argument("source", help="a folder of images or a .csv manifest with path,name rows")
+    parser.add_argument("--db", default="Media/db", help="the folder of the encoding store (default: Media/db)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    summary = enroll(args.source, EncodingStore(args.db), args.workers)
+    print("Enrolled: %d, unchanged: %d, without faces: %d, failed: %d" %
+          (summary["enrolled"], summary["unchanged"], len(summary["no_face"]), len(summary["failed"])))
+    print("Elapsed: %.1fs (%.1f img/s)" % (summary["seconds"], summary["images_per_second"]))
+    for path_image in summary["no_face"]:
+        print("No face found: " + path_image)
+    for path_image, error in summary["failed"]:
+        print("Failed: " + path_image + " (" + error + ")")
+    return
+
+if __name__ == "__main__":
+    main()
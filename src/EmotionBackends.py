@@ -0,0 +1,379 @@
+# -----------------------------------------------------------
+# EmotionBackends script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Emotion Batcher
+from src.EmotionBatcher import getEmotionClassifier, extractFaceCrops
+# File Hash
+from src.FileHash import hashBytes
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+
+# This code aim to run the FER emotion classifier on lighter CPU runtimes than
+# full TensorFlow. Every backend has a predict(crops) method taking a batch of
+# prepared face crops (see extractFaceCrops) and returning the (faces x emotions)
+# scores, so it can replace the Keras model behind the EmotionBatcher:
+# - Keras:          the FER model itself (the reference)
+# - TFLite-float16: TensorFlow Lite, float16 weights (half the size)
+# - TFLite-int8:    TensorFlow Lite, int8 weights and activations (a quarter of the size),
+#                   calibrated on sample face crops (computed only when the model is exported)
+# - OpenCV:         OpenCV DNN, on the model exported to ONNX (needs tf2onnx once)
+# The exported models are saved in Media/models, named after the FER weights
+# (and the calibration set, for int8), so the export runs only once for every
+# FER version.
+# parity compares a backend with the reference on the same faces, which must
+# not be the faces the int8 quantization was calibrated on.
+#
+# How to use it?
+# 1) Create a backend:                      b = createEmotionBackend("TFLite-int8", classifier, samples=crops)
+#    (samples can be a function returning the crops, called only if the model must be exported)
+# 2) Classify a batch of crops:             scores = b.predict(crops)
+# python -m src.EmotionBackends media/_1040009.jpg  -> print the label agreement and the speedup of every backend
+
+MODELS_PATH = "Media/models"
+
+# Identify the weights of a Keras model (to name its exported files)
+def modelId(classifier):
+    return hashBytes(b"".join(np.ascontiguousarray(w).tobytes() for w in classifier.get_weights()))[:12]
+
+# Random crops, used to calibrate the int8 quantization when no face is available
+# (always the same ones, so they are a calibration set like the others)
+def randomCrops(targetSize, count = 32):
+    return np.random.default_rng(0).uniform(-1, 1, (count, targetSize[1], targetSize[0], 1)).astype(np.float32)
+
+# Identify a calibration set (to name the int8 exported files)
+def calibrationId(samples):
+    return hashBytes(np.ascontiguousarray(samples, dtype=np.float32).tobytes())[:12]
+
+# KerasBackend class
+#
+# The FER model, executed by TensorFlow in float32
+class KerasBackend:
+
+    # Constructor
+    #
+    # Parameters:
+    # classifier: the Keras emotion classifier of FER
+    def __init__(self, classifier, **options):
+        self.classifier = classifier
+        self.targetSize = tuple(classifier.input_shape[1:3][::-1])
+        return
+
+    # Nothing to load: the model is already in memory
+    def load(self):
+        return
+
+    # Classify a batch of face crops
+    def predict(self, crops):
+        return np.asarray(self.classifier.predict_on_batch(crops))
+
+    # Size of the model weights, in bytes
+    def nbytes(self):
+        return int(sum(np.asarray(w).nbytes for w in self.classifier.get_weights()))
+
+# TFLiteBackend class
+#
+# The FER model converted to TensorFlow Lite, with float16 or int8 quantization.
+# The tflite_runtime package is used if installed, else TensorFlow's interpreter.
+class TFLiteBackend:
+
+    # Constructor
+    #
+    # Parameters:
+    # classifier:   the Keras emotion classifier of FER
+    # quantization: float16 or int8 (Default: int8)
+    # samples:      the face crops calibrating the int8 quantization, or a function returning
+    #               them, called only if the model must be exported (Default: None, random crops)
+    # calibration:  the identifier of the calibration set, naming the int8 file (Default: None,
+    #               computed from the samples, so a function is called anyway)
+    # path:         the .tflite file (Default: None, in MODELS_PATH, named after the weights)
+    # threads:      the number of CPU threads of the interpreter (Default: None, all the cores)
+    def __init__(self, classifier, quantization = "int8", samples = None, calibration = None, path = None, threads = None, **options):
+        if quantization not in ("float16", "int8"):
+            raise ValueError("TFLiteBackend: unknown quantization %s (allowed: float16, int8)" % quantization)
+        self.classifier = classifier
+        self.quantization = quantization
+        self.samples = samples
+        self.targetSize = tuple(classifier.input_shape[1:3][::-1])
+        if path is None:
+            name = "emotion_%s_%s" % (modelId(classifier), quantization)
+            if quantization == "int8":
+                # a model calibrated on other faces is another model
+                if calibration is None:
+                    calibration = calibrationId(self.calibrationSamples())
+                name += "_" + calibration
+            path = os.path.join(MODELS_PATH, name + ".tflite")
+        self.path = path
+        self.threads = threads if threads is not None else os.cpu_count()
+        self.interpreter = None
+        self.batch = 0              # batch size the interpreter is allocated for
+        return
+
+    # The face crops calibrating the int8 quantization (computed once, if given as a function)
+    def calibrationSamples(self):
+        if callable(self.samples):
+            self.samples = self.samples()
+        if self.samples is None or len(self.samples) == 0:
+            self.samples = randomCrops(self.targetSize)
+        return self.samples
+
+    # Convert the Keras model and save it
+    def export(self):
+        import tensorflow as tf
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.classifier)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if self.quantization == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        else:
+            samples = self.calibrationSamples()
+            def representative():
+                for crop in samples:
+                    yield [np.asarray(crop, dtype=np.float32)[np.newaxis]]
+            converter.representative_dataset = representative      # the input and the output stay float32
+        model = converter.convert()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(model)
+        os.replace(temp, self.path)
+        return
+
+    # Load the interpreter (exporting the model if needed)
+    def load(self):
+        if self.interpreter is not None:
+            return
+        if not os.path.isfile(self.path):
+            self.export()
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=self.path, num_threads=self.threads)
+        self.input = self.interpreter.get_input_details()[0]["index"]
+        self.output = self.interpreter.get_output_details()[0]["index"]
+        return
+
+    # Classify a batch of face crops (the interpreter is resized to the batch)
+    def predict(self, crops):
+        self.load()
+        crops = np.ascontiguousarray(crops, dtype=np.float32)
+        if len(crops) != self.batch:
+            self.interpreter.resize_tensor_input(self.input, list(crops.shape))
+            self.interpreter.allocate_tensors()
+            self.batch = len(crops)
+        self.interpreter.set_tensor(self.input, crops)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output).copy()
+
+    # Size of the exported model, in bytes
+    def nbytes(self):
+        self.load()
+        return os.path.getsize(self.path)
+
+# OpenCvBackend class
+#
+# The FER model exported to ONNX, executed by OpenCV DNN (no TensorFlow at
+# inference time). The export needs the tf2onnx package, only once.
+class OpenCvBackend:
+
+    # Constructor
+    #
+    # Parameters:
+    # classifier: the Keras emotion classifier of FER
+    # path:       the .onnx file (Default: None, in MODELS_PATH, named after the weights)
+    def __init__(self, classifier, path = None, **options):
+        self.classifier = classifier
+        self.targetSize = tuple(classifier.input_shape[1:3][::-1])
+        if path is None:
+            path = os.path.join(MODELS_PATH, "emotion_%s.onnx" % modelId(classifier))
+        self.path = path
+        self.net = None
+        return
+
+    # Convert the Keras model to ONNX and save it
+    def export(self):
+        import tensorflow as tf
+        import tf2onnx
+        spec = (tf.TensorSpec((None,) + tuple(self.classifier.input_shape[1:]), tf.float32, name="input"),)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp = self.path + ".tmp"
+        tf2onnx.convert.from_keras(self.classifier, input_signature=spec, output_path=temp)
+        os.replace(temp, self.path)
+        return
+
+    # Load the network (exporting the model if needed)
+    def load(self):
+        if self.net is None:
+            if not os.path.isfile(self.path):
+                self.export()
+            self.net = cv2.dnn.readNetFromONNX(self.path)
+        return
+
+    # Classify a batch of face crops
+    def predict(self, crops):
+        self.load()
+        self.net.setInput(np.ascontiguousarray(crops, dtype=np.float32))
+        return self.net.forward().reshape(len(crops), -1)
+
+    # Size of the exported model, in bytes
+    def nbytes(self):
+        self.load()
+        return os.path.getsize(self.path)
+
+# The available backends: name -> function creating it
+EMOTION_BACKENDS = {
+    "Keras": KerasBackend,
+    "TFLite-float16": lambda classifier, **options: TFLiteBackend(classifier, "float16", **options),
+    "TFLite-int8": lambda classifier, **options: TFLiteBackend(classifier, "int8", **options),
+    "OpenCV": OpenCvBackend
+}
+
+# Create a backend of the registry
+#
+# Parameters:
+# name:       the name of the backend
+# classifier: the Keras emotion classifier of FER
+# options:    the parameters of the backend constructor (e.g. samples)
+def createEmotionBackend(name, classifier, **options):
+    if name not in EMOTION_BACKENDS:
+        raise ValueError("Unknown emotion backend %s (available: %s)" % (name, ", ".join(EMOTION_BACKENDS)))
+    return EMOTION_BACKENDS[name](classifier, **options)
+
+# Cut the faces found in every frame, ready for the classifier
+#
+# Parameters:
+# detector:   the FER instance finding the faces
+# frames:     the BGR frames
+# targetSize: the (width, height) of the classifier input
+#
+# Return: the (faces x height x width x 1) float32 array of every frame with faces
+def frameCrops(detector, frames, targetSize):
+    crops = [extractFaceCrops(frame, [tuple(box) for box in detector.find_faces(frame)], targetSize)[0] for frame in frames]
+    return [c for c in crops if len(c) > 0]
+
+# Join some face crops, adding the mirrored faces
+#
+# Parameters:
+# crops:      a list of (faces x height x width x 1) arrays
+# targetSize: the (width, height) of the classifier input
+def mirroredCrops(crops, targetSize):
+    if len(crops) == 0:
+        return np.empty((0, targetSize[1], targetSize[0], 1), dtype=np.float32)
+    crops = np.concatenate(crops)
+    return np.concatenate([crops, crops[:, :, ::-1]])
+
+# Cut the faces found in some frames, ready for the classifier
+#
+# Parameters:
+# detector:   the FER instance finding the faces
+# frames:     the BGR frames
+# targetSize: the (width, height) of the classifier input
+#
+# Return: a (faces x height x width x 1) float32 array, the mirrored faces too
+def sampleCrops(detector, frames, targetSize):
+    return mirroredCrops(frameCrops(detector, frames, targetSize), targetSize)
+
+# Split the face crops of some frames in a calibration and an evaluation set,
+# with no face in both: by frame if there are several frames with faces
+# (the faces of a frame are alike), else by face
+#
+# Parameters:
+# crops:      the crops of every frame (see frameCrops)
+# targetSize: the (width, height) of the classifier input
+#
+# Return: the (calibration, evaluation) couple, the mirrored faces too
+def splitCrops(crops, targetSize):
+    if len(crops) == 1:
+        crops = [face[np.newaxis] for face in crops[0]]
+    if len(crops) < 2:
+        raise RuntimeError("At least 2 faces are needed, to calibrate and to evaluate on different faces")
+    return mirroredCrops(crops[1::2], targetSize), mirroredCrops(crops[0::2], targetSize)
+
+# Compare a backend with the reference on the same face crops
+#
+# Parameters:
+# reference: the reference backend (e.g. Keras)
+# candidate: the compared backend
+# crops:     the face crops
+# batchSize: the number of crops of a forward pass (Default: 32)
+# repeat:    the number of timed runs, the best one is kept (Default: 3)
+#
+# Return: a dictionary with the label agreement, the max score difference,
+#         the ms per face of both backends, the speedup and the model sizes
+def parity(reference, candidate, crops, batchSize = 32, repeat = 3):
+    def run(backend):
+        backend.load()
+        backend.predict(crops[:batchSize])                  # warm-up
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            scores = np.concatenate([backend.predict(crops[i:i + batchSize]) for i in range(0, len(crops), batchSize)])
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return scores, best
+    referenceScores, referenceTime = run(reference)
+    candidateScores, candidateTime = run(candidate)
+    return {
+        "faces": len(crops),
+        "agreement": float(np.mean(referenceScores.argmax(axis=1) == candidateScores.argmax(axis=1))),
+        "max_score_diff": float(np.abs(referenceScores - candidateScores).max()),
+        "reference_ms": referenceTime * 1000 / len(crops),
+        "ms": candidateTime * 1000 / len(crops),
+        "speedup": referenceTime / candidateTime if candidateTime > 0 else float("inf"),
+        "reference_bytes": reference.nbytes(),
+        "bytes": candidate.nbytes()
+    }
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Compare the emotion classifier backends with the FER Keras model")
+    parser.add_argument("media", nargs="+", help="the sample images or videos (their faces are classified)")
+    parser.add_argument("--backends", nargs="+", default=[name for name in EMOTION_BACKENDS if name != "Keras"], help="the backends to compare")
+    parser.add_argument("--frames", type=int, default=50, help="max frames read from every video (default: 50)")
+    parser.add_argument("--batch", type=int, default=32, help="the number of faces of a forward pass (default: 32)")
+    args = parser.parse_args()
+
+    from fer import FER     # imported here: it loads TensorFlow
+    detector = FER(mtcnn=True)
+    classifier = getEmotionClassifier(detector)
+    if classifier is None:
+        raise RuntimeError("This FER version doesn't expose its emotion classifier")
+    reference = KerasBackend(classifier)
+
+    frames = []
+    for path in args.media:
+        capture = cv2.VideoCapture(path)
+        read = 0
+        while read < args.frames:
+            status, frame = capture.read()
+            if not status:
+                break
+            frames.append(frame)
+            read += 1
+            if capture.get(cv2.CAP_PROP_FRAME_COUNT) <= 1:
+                break       # an image
+        capture.release()
+    samples, crops = splitCrops(frameCrops(detector, frames, reference.targetSize), reference.targetSize)
+    print("%d faces (calibration on other %d faces)" % (len(crops), len(samples)))
+
+    for name in args.backends:
+        try:
+            backend = createEmotionBackend(name, classifier, samples=samples, calibration=calibrationId(samples))
+            r = parity(reference, backend, crops, args.batch)
+        except Exception as e:      # e.g. missing tf2onnx
+            print("%-15s failed: %s" % (name, e))
+            continue
+        print("%-15s agreement %.3f  max diff %.3f  %.3f ms/face (Keras %.3f)  speedup x%.2f  %d KB (Keras %d KB)" % (
+            name, r["agreement"], r["max_score_diff"], r["ms"], r["reference_ms"], r["speedup"],
+            r["bytes"] // 1024, r["reference_bytes"] // 1024))
+    return
+
+if __name__ == "__main__":
+    main()
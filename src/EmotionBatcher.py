@@ -0,0 +1,212 @@
+# -----------------------------------------------------------
+# EmotionBatcher Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Thread library
+from threading import Thread, Lock
+from concurrent.futures import Future
+import queue
+import time
+import numpy as np
+import cv2
+
+# Labels of the FER emotion classifier outputs
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+# Get the emotion classifier (a Keras model) loaded inside a FER instance
+#
+# Parameters:
+# detector: the FER instance
+#
+# Return: the classifier, or None if this FER version hides it differently
+def getEmotionClassifier(detector):
+    return getattr(detector, "_FER__emotion_classifier", None)
+
+# Get the labels of the classifier outputs from a FER instance
+def getEmotionLabels(detector):
+    getLabels = getattr(detector, "_get_labels", None)
+    if getLabels is None:
+        return EMOTION_LABELS
+    labels = getLabels()
+    return [labels[i] for i in sorted(labels)]
+
+# Cut the faces out of a frame and prepare them for the emotion classifier,
+# in the same way FER does it (squared box plus offsets, gray, scaled in [-1, 1])
+#
+# Parameters:
+# frame:      the BGR frame
+# boxes:      the (x, y, w, h) boxes of the faces
+# targetSize: the (width, height) of the classifier input
+# offsets:    the margin added around every face (Default: (10, 10), as FER)
+#
+# Return: the (crops, indices) couple: a (faces x height x width x 1) float32 array
+#         and, for every crop, the index of its box
+def extractFaceCrops(frame, boxes, targetSize, offsets = (10, 10)):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    crops = []
+    indices = []
+    for i, (x, y, w, h) in enumerate(boxes):
+        # make the box square
+        if h > w:
+            x -= (h - w) // 2
+            w = h
+        elif w > h:
+            y -= (w - h) // 2
+            h = w
+        x1, x2 = x - offsets[0], x + w + offsets[0]
+        y1, y2 = y - offsets[1], y + h + offsets[1]
+        # the out of frame part is black, as the FER padding
+        face = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        cx1, cy1, cx2, cy2 = max(x1, 0), max(y1, 0), min(x2, width), min(y2, height)
+        if cx2 <= cx1 or cy2 <= cy1:
+            continue
+        face[cy1 - y1:cy2 - y1, cx1 - x1:cx2 - x1] = gray[cy1:cy2, cx1:cx2]
+        face = cv2.resize(face, tuple(targetSize))
+        crops.append(face)
+        indices.append(i)
+    if len(crops) == 0:
+        return np.empty((0, targetSize[1], targetSize[0], 1), dtype=np.float32), indices
+    crops = np.asarray(crops, dtype=np.float32)
+    crops = (crops / 255.0 - 0.5) * 2.0
+    return crops[..., np.newaxis], indices
+
+# EmotionBatcher class
+#
+# This class runs the emotion classifier on batches of faces: the face crops
+# submitted by one or more callers (faces of a frame, of several frames, of
+# several streams) are collected for at most maxWait seconds, or until
+# batchSize crops are ready, and classified with a single forward pass
+#
+# How to use it?
+# 1) Create an instance of the class:       b = EmotionBatcher(predict, (64, 64))
+# 2) Analyze the faces of a frame:          result = b.analyze(frame, boxes)
+class EmotionBatcher:
+
+    # Constructor
+    #
+    # Parameters:
+    # predict:    the function running the classifier on a batch, returning the scores
+    # targetSize: the (width, height) of the classifier input
+    # labels:     the emotion of every output of the classifier (Default: EMOTION_LABELS)
+    # batchSize:  the max number of faces of a forward pass (Default: 32)
+    # maxWait:    the max time a face waits for other faces, in seconds (Default: 0.005)
+    def __init__(self, predict, targetSize, labels = EMOTION_LABELS, batchSize = 32, maxWait = 0.005):
+        self.predict = predict
+        self.targetSize = tuple(targetSize)
+        self.labels = list(labels)
+        self.batchSize = batchSize
+        self.maxWait = maxWait
+        self.requests = queue.Queue()
+        self.lock = Lock()
+        self.batches = 0            # number of forward passes
+        self.faces = 0              # number of classified faces
+        self.thread = Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    # Create a batcher for the classifier of a FER instance
+    #
+    # Parameters:
+    # detector:  the FER instance
+    # batchSize: the max number of faces of a forward pass (Default: 32)
+    # maxWait:   the max time a face waits for other faces, in seconds (Default: 0.005)
+    # predict:   the function running the classifier (Default: None, the Keras model of FER),
+    #            e.g. the predict of an EmotionBackends backend
+    #
+    # Return: the batcher, or None if the classifier is not reachable
+    @staticmethod
+    def fromFER(detector, batchSize = 32, maxWait = 0.005, predict = None):
+        classifier = getEmotionClassifier(detector)
+        if classifier is None:
+            return None
+        targetSize = classifier.input_shape[1:3][::-1]
+        if predict is None:
+            predict = classifier.predict_on_batch
+        return EmotionBatcher(predict, targetSize, getEmotionLabels(detector), batchSize, maxWait)
+
+    # Submit some face crops to be classified
+    #
+    # Parameters:
+    # crops: the prepared face crops (see extractFaceCrops)
+    #
+    # Return: a Future, whose result is the (faces x emotions) scores array
+    def submit(self, crops):
+        future = Future()
+        if len(crops) == 0:
+            future.set_result(np.empty((0, len(self.labels)), dtype=np.float32))
+        else:
+            self.requests.put((crops, future))
+        return future
+
+    # Classify the emotions of the faces of a frame
+    #
+    # Parameters:
+    # frame: the BGR frame
+    # boxes: the (x, y, w, h) boxes of the faces
+    #
+    # Return: a list with a {'box', 'emotions'} dictionary for every face (as FER.detect_emotions)
+    def analyze(self, frame, boxes):
+        return self.analyzeMany([(frame, boxes)])[0]
+
+    # Classify the emotions of the faces of several frames, submitted together
+    # (so they share the forward passes)
+    #
+    # Parameters:
+    # items: a list of (frame, boxes) couples
+    #
+    # Return: the analyze result of every frame
+    def analyzeMany(self, items):
+        pending = []
+        for frame, boxes in items:
+            crops, indices = extractFaceCrops(frame, boxes, self.targetSize)
+            pending.append((boxes, indices, self.submit(crops)))
+        results = []
+        for boxes, indices, future in pending:
+            result = []
+            for i, faceScores in zip(indices, future.result()):
+                emotions = {label: round(float(score), 2) for label, score in zip(self.labels, faceScores)}
+                result.append({'box': tuple(int(v) for v in boxes[i]), 'emotions': emotions})
+            results.append(result)
+        return results
+
+    # Main loop: collect the submitted crops and classify them in batches
+    def run(self):
+        while True:
+            pending = [self.requests.get()]
+            count = len(pending[0][0])
+            deadline = time.time() + self.maxWait
+            while count < self.batchSize:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=wait)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                count += len(item[0])
+            self.classify(pending)
+
+    # Run one forward pass for the collected requests and hand back the scores
+    def classify(self, pending):
+        try:
+            batch = np.concatenate([crops for crops, _ in pending])
+            scores = np.concatenate([np.asarray(self.predict(batch[i:i + self.batchSize]))
+                                     for i in range(0, len(batch), self.batchSize)])
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        with self.lock:
+            self.batches += (len(batch) + self.batchSize - 1) // self.batchSize
+            self.faces += len(batch)
+        start = 0
+        for crops, future in pending:
+            future.set_result(scores[start:start + len(crops)])
+            start += len(crops)
+        return
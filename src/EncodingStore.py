@@ -0,0 +1,281 @@
+# -----------------------------------------------------------
+# EncodingStore Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# File Hash
+from src.FileHash import hashFile
+import numpy as np
+import json
+import os
+
+# Compute the face encoding of the first face found in an image
+#
+# Parameters:
+# path_image: the path to the image
+#
+# Return: the face encoding, or None if there is no face in the image
+def encodeImage(path_image):
+    import face_recognition         # imported here: loading its models is slow, and only needed to encode
+    image = face_recognition.load_image_file(path_image)
+    encodings = face_recognition.face_encodings(image)
+    if len(encodings) == 0:
+        return None
+    return encodings[0]
+
+# EncodingStore class
+#
+# This class keeps the Face Recognition training dataset on disk, so it
+# survives restarts and source changes:
+# - the encodings are saved in a .npy matrix, opened memory-mapped
+# - an index.json file keeps, for every row, the name of the individual
+#   and the path, size, modification time and content hash of its image
+# Only the new or changed images are encoded again.
+# The matrix file has spare rows: new encodings are written in place and only
+# the index is replaced, so enrolling one image doesn't rewrite the matrix.
+# The matrix is rewritten (in a new file) when it's full or when saved rows
+# change; `revision` counts the changes of the saved rows.
+#
+# How to use it?
+# 1) Create an instance of the class:       s = EncodingStore("Media/db")
+# 2) Re-encode the changed images:          s.refresh()
+# 3) Enroll a new image:                    s.add("Media/john_smith.png", "john_smith")
+# 4) Read the dataset:                      s.encodings, s.names
+class EncodingStore:
+
+    INDEX_FILE = "index.json"
+
+    # Constructor
+    #
+    # Parameters:
+    # directory: the folder of the store (created if it doesn't exist)
+    # dimension: the length of a face encoding (Default: 128)
+    # encoder:   the function computing the encoding of an image path (Default: encodeImage)
+    def __init__(self, directory, dimension = 128, encoder = encodeImage):
+        self.directory = directory
+        self.dimension = dimension
+        self.encoder = encoder
+        os.makedirs(directory, exist_ok=True)
+
+        self.generation = 0
+        self.revision = 0           # incremented when a saved row changes or is removed (not when rows are appended)
+        self.entries = []           # one entry (name, path, size, mtime, hash) for every row of the matrix
+        self.open()
+        return
+
+    # Open the store saved on disk (if any)
+    def open(self):
+        self.matrix = np.empty((0, self.dimension), dtype=np.float32)
+        self.matrixName = None
+        self.capacity = 0           # number of rows of the matrix file (the valid ones are len(self.entries))
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            self.generation = index["generation"]
+            self.revision = index.get("revision", 0)
+            self.entries = index["entries"]
+            if len(self.entries) > 0:
+                # no read here: the rows are loaded from disk on demand
+                self.matrixName = index["matrix"]
+                full = np.load(os.path.join(self.directory, self.matrixName), mmap_mode='r')
+                self.capacity = len(full)
+                self.matrix = full[:len(self.entries)]
+        self.pending = {}           # row -> encoding not yet written on disk
+        self.removed = set()        # rows to delete
+        self.dirty = False
+        self.rowByPath = {e["path"]: i for i, e in enumerate(self.entries)}
+        return
+
+    # Names of the individuals, one for every row of self.encodings
+    @property
+    def names(self):
+        return [e["name"] for e in self.entries]
+
+    # The (individuals x dimension) float32 matrix of the encodings
+    @property
+    def encodings(self):
+        return self.matrix
+
+    # Number of saved encodings
+    def __len__(self):
+        return len(self.entries)
+
+    # Describe the image currently found at a path
+    def describe(self, path, name, content_hash = None):
+        st = os.stat(path)
+        if content_hash is None:
+            content_hash = hashFile(path)
+        return {
+            "name": name,
+            "path": path,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "hash": content_hash
+        }
+
+    # Check if an image is already saved, with the same name, and unchanged on disk
+    # (only its size and modification time are compared, the file is not read)
+    #
+    # Parameters:
+    # path_image: the path to the image
+    # name:       the name of the individual in the image
+    def isUnchanged(self, path_image, name):
+        row = self.rowByPath.get(path_image)
+        if row is None or row in self.removed:
+            return False
+        entry = self.entries[row]
+        try:
+            st = os.stat(path_image)
+        except OSError:
+            return False
+        return entry["name"] == name and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime
+
+    # Return the current encoding of a row
+    def rowEncoding(self, row):
+        if row in self.pending:
+            return self.pending[row]
+        return np.array(self.matrix[row], dtype=np.float32)
+
+    # Add an image to the store, encoding it only if it's new or changed
+    #
+    # Parameters:
+    # path_image:   the path to the image
+    # name:         the name of the individual in the image
+    # encoding:     the encoding of the image, if already computed (Default: None)
+    # flush:        if True, the store is written on disk immediately (Default: True)
+    # content_hash: the content hash of the image, if already computed (Default: None)
+    #
+    # Return: the encoding of the image, or None if there is no face in it
+    def add(self, path_image, name, encoding = None, flush = True, content_hash = None):
+        entry = self.describe(path_image, name, content_hash)
+        row = self.rowByPath.get(path_image)
+        if row is not None and row not in self.removed and self.entries[row]["hash"] == entry["hash"]:
+            # same content: no need to encode it again
+            if self.entries[row] != entry:
+                self.entries[row] = entry
+                self.dirty = True
+            encoding = self.rowEncoding(row)
+        else:
+            if encoding is None:
+                encoding = self.encoder(path_image)
+            if encoding is None:
+                return None
+            if row is None or row in self.removed:
+                row = len(self.entries)
+                self.entries.append(entry)
+                self.rowByPath[path_image] = row
+            else:
+                self.entries[row] = entry       # the image changed: replace its row
+            self.pending[row] = np.asarray(encoding, dtype=np.float32)
+            self.dirty = True
+        if flush:
+            self.flush()
+        return encoding
+
+    # Check every saved image and encode again only the changed ones.
+    # Images that don't exist anymore are kept (the individual stays enrolled),
+    # changed images without any face are removed.
+    #
+    # Return: the number of re-encoded images
+    def refresh(self):
+        reencoded = 0
+        for row, entry in enumerate(self.entries):
+            path_image = entry["path"]
+            try:
+                st = os.stat(path_image)
+            except OSError:
+                continue
+            if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+                continue                            # unchanged: no need to read it
+            newEntry = self.describe(path_image, entry["name"])
+            if newEntry["hash"] != entry["hash"]:
+                encoding = self.encoder(path_image)
+                reencoded += 1
+                if encoding is None:
+                    self.removed.add(row)
+                    self.dirty = True
+                    continue
+                self.pending[row] = np.asarray(encoding, dtype=np.float32)
+            self.entries[row] = newEntry
+            self.dirty = True
+        self.flush()
+        return reencoded
+
+    # Write the changes on disk
+    # The rows are written first (in the spare rows of the matrix file, or in a
+    # new matrix file) and then the index is atomically replaced, so a crash
+    # never leaves a half-written store
+    def flush(self):
+        if not self.dirty:
+            return
+        saved = len(self.matrix)        # rows already in the index on disk
+        if (self.capacity > 0 and len(self.removed) == 0 and len(self.entries) <= self.capacity
+                and all(r >= saved for r in self.pending)):
+            self.append()
+            return
+        if len(self.removed) > 0 or any(r < saved for r in self.pending):
+            self.revision += 1
+        keep = [r for r in range(len(self.entries)) if r not in self.removed]
+        self.generation += 1
+        matrix_name = "encodings-%d.npy" % self.generation
+
+        if len(keep) > 0:
+            capacity = max(64, len(keep) + len(keep) // 2)      # room for the next enrollments
+            out = np.lib.format.open_memmap(os.path.join(self.directory, matrix_name), mode='w+',
+                                            dtype=np.float32, shape=(capacity, self.dimension))
+            saved = [i for i, r in enumerate(keep) if r not in self.pending]
+            if len(saved) > 0:
+                out[saved] = self.matrix[[keep[i] for i in saved]]
+            for i, r in enumerate(keep):
+                if r in self.pending:
+                    out[i] = self.pending[r]
+            out.flush()
+            del out
+
+        self.writeIndex(matrix_name, [self.entries[r] for r in keep])
+        self.open()
+        self.removeOldMatrices(matrix_name)
+        return
+
+    # Write the new rows in the spare rows of the current matrix file
+    def append(self):
+        if len(self.pending) > 0:
+            out = np.load(os.path.join(self.directory, self.matrixName), mmap_mode='r+')
+            for r, encoding in self.pending.items():
+                out[r] = encoding
+            out.flush()
+            del out
+        self.writeIndex(self.matrixName, self.entries)
+        self.open()
+        return
+
+    # Replace the index on disk (atomically)
+    #
+    # Parameters:
+    # matrix_name: the name of the matrix file
+    # entries:     the entries of the rows
+    def writeIndex(self, matrix_name, entries):
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({
+                "generation": self.generation,
+                "revision": self.revision,
+                "matrix": matrix_name,
+                "entries": entries
+            }, f)
+        os.replace(index_path + ".tmp", index_path)
+        return
+
+    # Delete the matrix files of the older generations
+    # (if one is still mapped somewhere, it will be deleted the next time)
+    def removeOldMatrices(self, current):
+        for f in os.listdir(self.directory):
+            if f.startswith("encodings-") and f.endswith(".npy") and f != current:
+                try:
+                    os.remove(os.path.join(self.directory, f))
+                except OSError:
+                    pass
+        return
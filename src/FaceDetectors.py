@@ -0,0 +1,290 @@
+# -----------------------------------------------------------
+# FaceDetectors script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Face Tracker
+from src.FaceTracker import iou
+from threading import Lock
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+
+# This code aim to make the face detector a choice of the deployment, not of the code.
+# Every backend has a detect(frame) method taking a BGR frame and returning
+# the (x, y, w, h) boxes of the faces, as FER.find_faces does:
+# - Haar:   OpenCV's Haar Cascade classifier (fast, less accurate)
+# - MTCNN:  the MTCNN network used by FER (accurate, slow on CPU)
+# - DNN:    OpenCV DNN with the ResNet SSD face model (needs the model files)
+# - HOG:    dlib's HOG detector, through the face_recognition library
+# The backends load their models the first time they are used.
+# calibrate measures them on some sample frames and picks the fastest one
+# finding enough of the faces found by a reference backend.
+#
+# How to use it?
+# 1) Create a backend:                      d = createDetector("Haar")
+# 2) Detect the faces:                      boxes = d.detect(frame)
+# 3) Or pick the best one for this machine: name, results = calibrate(["Haar", "DNN", "HOG"], frames)
+# python -m src.FaceDetectors media/_1040009.jpg     -> print the calibration of all the backends
+
+# HaarDetector class
+#
+# OpenCV's Haar Cascade classifier
+class HaarDetector:
+
+    # Constructor
+    #
+    # Parameters:
+    # cascade:      the path of the cascade file (Default: None, the frontal face cascade of OpenCV)
+    # scaleFactor:  the scale step between the detection windows (Default: 1.1)
+    # minNeighbors: the min number of overlapping detections of a face (Default: 5)
+    # minSize:      the min face size (Default: (30, 30))
+    def __init__(self, cascade = None, scaleFactor = 1.1, minNeighbors = 5, minSize = (30, 30)):
+        if cascade is None:
+            cascade = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        self.cascade = cascade
+        self.scaleFactor = scaleFactor
+        self.minNeighbors = minNeighbors
+        self.minSize = minSize
+        self.classifier = None
+        return
+
+    # Load the cascade
+    def load(self):
+        if self.classifier is None:
+            classifier = cv2.CascadeClassifier(self.cascade)
+            if classifier.empty():
+                raise IOError("Cannot load the Haar cascade " + self.cascade)
+            self.classifier = classifier
+        return
+
+    # Detect the faces in a BGR frame
+    def detect(self, frame):
+        self.load()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        boxes = self.classifier.detectMultiScale(gray, scaleFactor=self.scaleFactor,
+                                                 minNeighbors=self.minNeighbors, minSize=self.minSize)
+        return [tuple(int(v) for v in box) for box in boxes]
+
+# MtcnnDetector class
+#
+# The MTCNN network of the FER library
+class MtcnnDetector:
+
+    # Constructor
+    #
+    # Parameters:
+    # getFER: the function returning a FER instance created with mtcnn=True
+    #         (Default: None, a new instance is created)
+    def __init__(self, getFER = None):
+        self.getFER = getFER
+        self.fer = None
+        return
+
+    # Load the network
+    def load(self):
+        if self.fer is None:
+            if self.getFER is None:
+                from fer import FER     # imported here: it loads TensorFlow
+                self.fer = FER(mtcnn=True)
+            else:
+                self.fer = self.getFER()
+        return
+
+    # Detect the faces in a BGR frame
+    def detect(self, frame):
+        self.load()
+        return [tuple(int(v) for v in box) for box in self.fer.find_faces(frame)]
+
+# DnnDetector class
+#
+# OpenCV DNN with the ResNet-10 SSD face model (Caffe). The model files are not
+# shipped with OpenCV: download deploy.prototxt and res10_300x300_ssd_iter_140000.caffemodel
+# (e.g. from the OpenCV samples) in Media/models, or pass their paths.
+class DnnDetector:
+
+    # Constructor
+    #
+    # Parameters:
+    # prototxt:   the path of the network description (Default: Media/models/deploy.prototxt)
+    # model:      the path of the network weights (Default: Media/models/res10_300x300_ssd_iter_140000.caffemodel)
+    # confidence: the min confidence of a face (Default: 0.5)
+    # inputSize:  the size of the network input (Default: (300, 300))
+    def __init__(self, prototxt = "Media/models/deploy.prototxt",
+                 model = "Media/models/res10_300x300_ssd_iter_140000.caffemodel",
+                 confidence = 0.5, inputSize = (300, 300)):
+        self.prototxt = prototxt
+        self.model = model
+        self.confidence = confidence
+        self.inputSize = inputSize
+        self.net = None
+        self.lock = Lock()          # an OpenCV network must not run two forward passes at once
+        return
+
+    # Load the network
+    def load(self):
+        if self.net is None:
+            for path in (self.prototxt, self.model):
+                if not os.path.isfile(path):
+                    raise IOError("Missing DNN face model file " + path)
+            self.net = cv2.dnn.readNetFromCaffe(self.prototxt, self.model)
+        return
+
+    # Detect the faces in a BGR frame
+    def detect(self, frame):
+        self.load()
+        height, width = frame.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(frame, self.inputSize), 1.0, self.inputSize, (104.0, 177.0, 123.0))
+        with self.lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+        boxes = []
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            x1, y1, x2, y2 = (detection[3:7] * [width, height, width, height]).astype(int)
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            if x2 > x1 and y2 > y1:
+                boxes.append((int(x1), int(y1), int(x2 - x1), int(y2 - y1)))
+        return boxes
+
+# HogDetector class
+#
+# dlib's HOG detector, through the face_recognition library
+class HogDetector:
+
+    # Constructor
+    #
+    # Parameters:
+    # upsample: how many times the frame is upsampled to find smaller faces (Default: 0)
+    def __init__(self, upsample = 0):
+        self.upsample = upsample
+        self.face_recognition = None
+        return
+
+    # Load the library
+    def load(self):
+        if self.face_recognition is None:
+            import face_recognition     # imported here: it loads the dlib models
+            self.face_recognition = face_recognition
+        return
+
+    # Detect the faces in a BGR frame
+    def detect(self, frame):
+        self.load()
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = self.face_recognition.face_locations(rgb, self.upsample, "hog")
+        return [(int(left), int(top), int(right - left), int(bottom - top)) for (top, right, bottom, left) in locations]
+
+# The available backends: name -> class (or function) creating it
+DETECTORS = {
+    "Haar": HaarDetector,
+    "MTCNN": MtcnnDetector,
+    "DNN": DnnDetector,
+    "HOG": HogDetector
+}
+
+# Add a backend to the registry
+#
+# Parameters:
+# name:    the name of the backend
+# factory: the class (or function) creating it, whose instances have a detect(frame) method
+def registerDetector(name, factory):
+    DETECTORS[name] = factory
+    return
+
+# Create a backend of the registry
+#
+# Parameters:
+# name:    the name of the backend
+# options: the parameters of the backend constructor
+def createDetector(name, **options):
+    if name not in DETECTORS:
+        raise ValueError("Unknown face detector %s (available: %s)" % (name, ", ".join(DETECTORS)))
+    return DETECTORS[name](**options)
+
+# Fraction of the reference boxes found by a detection
+#
+# Parameters:
+# boxes:     the found boxes
+# reference: the reference boxes
+# threshold: the min IoU of two boxes of the same face (Default: 0.4)
+def recall(boxes, reference, threshold = 0.4):
+    if len(reference) == 0:
+        return 1.0
+    remaining = list(boxes)
+    found = 0
+    for ref in reference:
+        scores = [iou(ref, box) for box in remaining]
+        if len(scores) > 0 and max(scores) >= threshold:
+            remaining.pop(int(np.argmax(scores)))
+            found += 1
+    return found / float(len(reference))
+
+# Measure some backends on sample frames and pick the fastest one
+# finding enough of the faces found by the reference backend
+#
+# Parameters:
+# detectors:   the backends to measure: a dictionary name -> backend, or a list of names
+# frames:      the sample BGR frames
+# reference:   the name of the reference backend, the most accurate (Default: "MTCNN")
+# recallFloor: the min fraction of the reference faces to be found (Default: 0.9)
+# repeat:      the number of measured runs on every frame (Default: 3)
+#
+# Return: the (name, results) couple: the chosen backend and, for every backend,
+#         a dictionary with its mean time per frame (ms), recall and error (if it failed)
+def calibrate(detectors, frames, reference = "MTCNN", recallFloor = 0.9, repeat = 3):
+    if not isinstance(detectors, dict):
+        detectors = {name: createDetector(name) for name in detectors}
+    if reference not in detectors:
+        detectors[reference] = createDetector(reference)
+
+    results = {}
+    boxes = {}
+    for name, detector in detectors.items():
+        try:
+            boxes[name] = [detector.detect(frame) for frame in frames]     # first run: loads the model
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for frame in frames:
+                    detector.detect(frame)
+            results[name] = {"ms": 1000 * (time.perf_counter() - start) / max(1, repeat * len(frames))}
+        except Exception as e:      # e.g. missing model files or library
+            results[name] = {"ms": None, "recall": 0.0, "error": str(e)}
+
+    if "error" in results[reference]:
+        raise RuntimeError("The reference face detector %s failed: %s" % (reference, results[reference]["error"]))
+    for name in boxes:
+        found = [recall(b, r) for b, r in zip(boxes[name], boxes[reference])]
+        results[name]["recall"] = float(np.mean(found)) if len(found) > 0 else 1.0
+        results[name]["faces"] = int(sum(len(b) for b in boxes[name]))
+
+    good = [name for name in boxes if results[name]["recall"] >= recallFloor]
+    best = min(good, key=lambda name: results[name]["ms"])
+    return best, results
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Measure the face detector backends on some images")
+    parser.add_argument("images", nargs="+", help="the sample images")
+    parser.add_argument("--detectors", nargs="+", default=list(DETECTORS), help="the backends to measure")
+    parser.add_argument("--reference", default="MTCNN", help="the reference backend (default: MTCNN)")
+    parser.add_argument("--recall", type=float, default=0.9, help="the min recall against the reference (default: 0.9)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = [frame for frame in (cv2.imread(path) for path in args.images) if frame is not None]
+    best, results = calibrate(args.detectors, frames, args.reference, args.recall, args.repeat)
+    for name, r in results.items():
+        if "error" in r:
+            print("%-6s failed: %s" % (name, r["error"]))
+        else:
+            print("%-6s %8.2f ms/frame  recall %.2f  faces %d" % (name, r["ms"], r["recall"], r["faces"]))
+    print("Fastest backend with recall >= %.2f: %s" % (args.recall, best))
+    return
+
+if __name__ == "__main__":
+    main()
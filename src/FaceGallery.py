@@ -0,0 +1,258 @@
+# -----------------------------------------------------------
+# FaceGallery Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Approximate nearest neighbor index
+from src.AnnIndex import AnnIndex
+from threading import Thread, Lock
+import numpy as np
+
+# FaceGallery class
+#
+# This class stores all the enrolled face encodings in one contiguous
+# float32 matrix (one row per individual) and scores every face of a frame
+# against the whole gallery with a single batched operation.
+# Above annThreshold individuals (off by default), the faces are matched with
+# an approximate index (AnnIndex) instead. The index is built in a background
+# thread when the gallery grows over the threshold: until it's ready, the
+# faces are matched exactly.
+#
+# How to use it?
+# 1) Create an instance of the class:       g = FaceGallery()
+# 2) Enroll the individuals:                g.add(encoding, "john_smith")
+# 3) Match the faces of a frame:            g.match(face_encodings, k = 1)
+class FaceGallery:
+
+    # Constructor
+    #
+    # Parameters:
+    # dimension: the length of a face encoding (Default: 128, the face_recognition encoding)
+    # capacity:  the number of rows allocated at the start (Default: 64)
+    # annThreshold: the gallery size from which the approximate index is used (Default: None, never)
+    # annOptions:   the parameters of the approximate index, e.g. {"storage": "int8", "nprobe": 8} (Default: None)
+    def __init__(self, dimension = 128, capacity = 64, annThreshold = None, annOptions = None):
+        self.dimension = dimension
+        self.annThreshold = annThreshold
+        self.annOptions = annOptions or {}
+        self.ann = None                                                     # approximate index (built when needed)
+        self.annBuild = None                                                # thread building the approximate index
+        self.annToken = 0                                                   # changed when the rows given to the build are not valid anymore
+        self.annLock = Lock()
+        self.revision = None                                                # revision of the loaded rows (see load)
+        self.matrix = np.empty((capacity, dimension), dtype=np.float32)    # enrolled encodings (only the first self.size rows are valid)
+        self.sqNorms = np.empty(capacity, dtype=np.float32)                # squared norm of every enrolled encoding
+        self.names = []                                                     # name of the individual of every row
+        self.size = 0
+        return
+
+    # Number of enrolled encodings
+    def __len__(self):
+        return self.size
+
+    # Use an existing encoding matrix (e.g. memory-mapped from an EncodingStore)
+    # as the gallery, without copying it
+    #
+    # Parameters:
+    # matrix:   the (individuals x dimension) float32 matrix of the encodings
+    # names:    the names of the individuals, one for each row
+    # revision: the version of the rows already loaded, changed when any of them
+    #           changes (e.g. EncodingStore.revision) (Default: None, unknown)
+    def load(self, matrix, names, revision = None):
+        if len(matrix) != len(names):
+            raise ValueError("FaceGallery: got %d encodings but %d names" % (len(matrix), len(names)))
+        with self.annLock:
+            if (revision is not None and revision == self.revision
+                    and len(matrix) >= self.size and list(names[:self.size]) == self.names):
+                self.extendIndex(matrix[self.size:])    # only new rows: no need to build the index again
+            else:
+                self.dropIndex()                        # some encodings may have changed
+            self.revision = revision
+            self.matrix = matrix
+            self.sqNorms = None         # computed at the first match, so loading doesn't read the matrix
+            self.names = list(names)
+            self.size = len(matrix)
+        self.prepareIndex()
+        return
+
+    # Squared norm of every enrolled encoding
+    def norms(self):
+        if self.sqNorms is None:
+            gallery = self.matrix[:self.size]
+            self.sqNorms = np.einsum('ij,ij->i', gallery, gallery).astype(np.float32)
+        return self.sqNorms
+
+    # Make room for at least n more rows, doubling the capacity when it's full
+    def reserve(self, n):
+        needed = self.size + n
+        if needed <= len(self.matrix) and self.matrix.flags.writeable:
+            return
+        capacity = max(needed, 2 * len(self.matrix), 64)
+        matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+        sqNorms = np.empty(capacity, dtype=np.float32)
+        matrix[:self.size] = self.matrix[:self.size]
+        sqNorms[:self.size] = self.norms()[:self.size]
+        self.matrix = matrix
+        self.sqNorms = sqNorms
+        return
+
+    # Add an encoding to the gallery
+    #
+    # Parameters:
+    # encoding: the face encoding of the individual
+    # name:     the name of the individual
+    def add(self, encoding, name):
+        self.addMany([encoding], [name])
+        return
+
+    # Add several encodings to the gallery at once
+    #
+    # Parameters:
+    # encodings: the face encodings (a list of vectors or a 2D array)
+    # names:     the names of the individuals, one for each encoding
+    def addMany(self, encodings, names):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        if len(encodings) != len(names):
+            raise ValueError("FaceGallery: got %d encodings but %d names" % (len(encodings), len(names)))
+        with self.annLock:
+            self.reserve(len(encodings))
+            self.norms()
+            self.extendIndex(encodings)
+            end = self.size + len(encodings)
+            self.matrix[self.size:end] = encodings
+            self.sqNorms[self.size:end] = np.einsum('ij,ij->i', encodings, encodings)
+            self.names.extend(names)
+            self.size = end
+        self.prepareIndex()
+        return
+
+    # Remove every enrolled encoding
+    def clear(self):
+        with self.annLock:
+            self.dropIndex()
+            self.revision = None
+            self.names = []
+            self.size = 0
+        return
+
+    # Drop the approximate index, and the result of the running build
+    def dropIndex(self):
+        self.ann = None
+        self.annToken += 1
+        return
+
+    # Add the new encodings to the approximate index (if it's built), or drop
+    # the index if too many encodings were added since it was built.
+    # During a build nothing is needed: the new rows are added when it ends.
+    def extendIndex(self, encodings):
+        if self.ann is None:
+            return
+        if len(self.ann.tail) + len(encodings) > 0.1 * self.ann.size:
+            self.dropIndex()
+        else:
+            self.ann.add(encodings, self.size)
+        return
+
+    # Check if the faces are matched with the approximate index
+    def useIndex(self):
+        return self.annThreshold is not None and self.size >= self.annThreshold
+
+    # Start building the approximate index in a background thread, if it's needed
+    # and not built or being built
+    def prepareIndex(self):
+        with self.annLock:
+            if not self.useIndex() or self.ann is not None or (self.annBuild is not None and self.annBuild.is_alive()):
+                return
+            self.annBuild = Thread(target=self.buildIndex, args=(self.matrix, self.size, self.annToken))
+            self.annBuild.daemon = True
+            self.annBuild.start()
+        return
+
+    # Body of the build thread: build the index on the first size rows, then
+    # install it if they're still valid (adding the rows enrolled meanwhile)
+    def buildIndex(self, matrix, size, token):
+        ann = AnnIndex(**self.annOptions)
+        ann.build(matrix[:size])
+        with self.annLock:
+            self.annBuild = None
+            # rebuild if the rows changed, or too many rows were enrolled, during the build
+            rebuild = token != self.annToken or self.size - size > 0.1 * size
+            if not rebuild:
+                ann.add(self.matrix[size:self.size], size)
+                self.ann = ann
+        if rebuild:
+            self.prepareIndex()
+        return
+
+    # The approximate index of the gallery, or None while it's being built
+    def index(self):
+        if self.ann is None:
+            self.prepareIndex()
+        return self.ann
+
+    # Compute the euclidean distance between every face and every enrolled encoding
+    #
+    # Parameters:
+    # encodings: the face encodings found in a frame
+    #
+    # Return: a (faces x gallery) float32 matrix of distances
+    def distances(self, encodings):
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        gallery = self.matrix[:self.size]
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g  -> one matrix product for the whole frame
+        d2 = queries @ gallery.T
+        d2 *= -2
+        d2 += np.einsum('ij,ij->i', queries, queries)[:, None]
+        d2 += self.norms()[:self.size][None, :]
+        np.maximum(d2, 0, out=d2)       # clamp the rounding errors
+        return np.sqrt(d2, out=d2)
+
+    # Find the k best matches of every face in the gallery
+    #
+    # Parameters:
+    # encodings: the face encodings found in a frame
+    # k:         the number of matches to return for every face (Default: 1)
+    # threshold: if set, the matches farther than it are discarded (Default: None)
+    #
+    # Return: a list with, for every face, the list of its (name, distance) matches
+    #         sorted from the nearest to the farthest
+    def match(self, encodings, k = 1, threshold = None):
+        nFaces = len(encodings)
+        if nFaces == 0:
+            return []
+        if self.size == 0:
+            return [[] for _ in range(nFaces)]
+        k = min(k, self.size)
+        ann = self.index() if self.useIndex() else None
+        if ann is not None:
+            bestDistances, best = ann.search(encodings, k)
+            return self.toMatches(best, bestDistances, threshold)
+        d = self.distances(encodings)
+        if k < self.size:
+            best = np.argpartition(d, k - 1, axis=1)[:, :k]                 # k nearest, unordered
+        else:
+            best = np.broadcast_to(np.arange(self.size), d.shape)
+        bestDistances = np.take_along_axis(d, best, axis=1)
+        order = np.argsort(bestDistances, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        bestDistances = np.take_along_axis(bestDistances, order, axis=1)
+        return self.toMatches(best, bestDistances, threshold)
+
+    # Convert the sorted best rows of every face into (name, distance) matches
+    #
+    # Parameters:
+    # best:          the (faces x k) rows, sorted from the nearest (-1: no row)
+    # bestDistances: their distances
+    # threshold:     if set, the matches farther than it are discarded
+    def toMatches(self, best, bestDistances, threshold):
+        matches = []
+        for rows, dists in zip(best, bestDistances):
+            faceMatches = []
+            for row, dist in zip(rows, dists):
+                if row < 0 or (threshold is not None and dist >= threshold):
+                    break
+                faceMatches.append((self.names[row], float(dist)))
+            matches.append(faceMatches)
+        return matches
@@ -11,6 +11,11 @@ from src.GuiManager import *
 from src.OpenFader import *
 # SourceSelection
 from src.sourceSelection import SourceSelection
+# Result Store
+from src.ResultStore import ResultStore
+from threading import Thread
+import time
+import os
 
 # Face2face class 
 #
@@ -35,6 +40,11 @@ class Face2face:
             "image": ["PNG", "JPG", "JPEG"]
         }
         self.analysis = ["Detection", "Expression", "Recognition"]     # analysis can be computed
+        self.fader = None
+        self.offlineEvery = 1                   # offline mode: analyze one video frame every offlineEvery
+        self.resultsPath = "Media/results"      # offline mode: the results of a video are recorded in resultsPath/<video name>
+        self.offlineThread = None
+        self.inferenceServer = None             # socket path of a running InferenceServer, True for its default one (None: load the models in this process)
 
     # Analyze a the current media source (image, webcam, video)
     # according the selected algorithm
@@ -43,6 +53,8 @@ class Face2face:
     # n -> the algorithm you want to execute (Detection, Expression or Recognition)
     def analyze(self, n):
         
+        if self.stopOffline(lambda: self.analyze(n)):   # stop the offline analysis first (if running)
+            return
         self.GUI.cleanTerminal()                # clean the GUI terminal  
         self.selectedAlgorithm = n
         default_media = self.default_video if self.source == "video" else self.default_image
@@ -52,6 +64,8 @@ class Face2face:
 
     # Stop all running analysis and reset the GUI
     def stop(self):
+        if self.stopOffline(self.stop):         # stop the offline analysis first (if running)
+            return
         isImage = True if self.source == "image" else False
         self.GUI.cleanTerminal()                # clean the GUI terminal  
         self.GUI.printResult("Session stopped")
@@ -59,6 +73,85 @@ class Face2face:
         self.GUI.disableButtons(False)          # reset the GUI buttons
         return
 
+    # Analyze every frame of the video with the selected algorithm, as fast as
+    # possible and without displaying it, then report the frames per second.
+    # The analysis runs in its own thread, so the GUI stays responsive.
+    def offline(self):
+        if self.stopOffline(self.offline):
+            return
+        self.GUI.closeSource()                  # the live stream would compete for the CPU
+        self.GUI.cleanTerminal()
+        self.GUI.printMode("OFFLINE " + self.selectedAlgorithm.upper())
+        self.GUI.printResult("\nAnalyzing every frame of " + self.default_video)
+        self.offlineSummary = None
+        self.offlineFrames = 0
+        self.offlineThread = Thread(target=self.runOffline, args=(self.default_video, self.selectedAlgorithm))
+        self.offlineThread.daemon = True
+        self.offlineThread.start()
+        self.GUI.ROOT.after(1000, self.checkOffline)
+        return
+
+    # Body of the offline analysis thread
+    def runOffline(self, path, algorithm):
+        try:
+            # a new run of the same video replaces its results
+            store = ResultStore(os.path.join(self.resultsPath, os.path.splitext(os.path.basename(path))[0]), overwrite=True)
+            def record(index, timestamp, frame):
+                store.addResult(self.fader, algorithm, index, timestamp, path)
+                self.offlineFrames += 1
+            self.offlineSummary = self.fader.runOfflineAnalysis(path, algorithm, self.offlineEvery, record)
+            store.close()
+            self.offlineSummary["store"] = store.directory
+        except Exception as e:
+            self.offlineSummary = {"error": str(e)}
+        return
+
+    # Print the progress of the offline analysis (executed on the Tk thread)
+    def checkOffline(self):
+        if self.offlineThread is None:
+            return
+        if self.offlineThread.is_alive():
+            self.GUI.printResult("\n%d frames analyzed" % self.offlineFrames)
+            self.GUI.ROOT.after(1000, self.checkOffline)
+            return
+        summary = self.offlineSummary
+        self.offlineThread = None
+        if summary is None:
+            return
+        if "error" in summary:
+            self.GUI.printResult("\nError: " + summary["error"])
+        else:
+            self.GUI.printResult("\n%s: %d frames analyzed in %.1fs (%.1f fps)" % (
+                "Stopped" if summary["stopped"] else "Done", summary["analyzed"], summary["seconds"], summary["fps"]))
+            self.GUI.printResult("\nResults saved in " + summary["store"])
+        return
+
+    # Stop the offline analysis (if running). Its last frame is not waited on
+    # the Tk thread: the thread is polled, and next is called once it's over
+    #
+    # Parameters:
+    # next: the function to call once the analysis is over (Default: None)
+    #
+    # Return: True if the analysis was running (next will be called later), else False
+    def stopOffline(self, next = None):
+        if self.offlineThread is None or not self.offlineThread.is_alive():
+            self.offlineThread = None
+            return False
+        self.fader.stopAnalysis()
+        self.GUI.printResult("\nStopping the offline analysis...")
+        self.waitOffline(next)
+        return True
+
+    # Poll the stopped offline analysis until its thread ends, then call next
+    def waitOffline(self, next):
+        if self.offlineThread is not None and self.offlineThread.is_alive():
+            self.GUI.ROOT.after(50, self.waitOffline, next)
+            return
+        self.offlineThread = None
+        if next is not None:
+            next()
+        return
+
     # Add a image to the training dataset for Face Recognition
     # The user will be able to search the image in own pc 
     def train(self):
@@ -75,6 +168,8 @@ class Face2face:
     # Browse a media (image or video) to be displayed on the GUI
     def browse(self):
 
+        if self.stopOffline(self.browse):           # stop the offline analysis first (if running)
+            return
         self.GUI.cleanTerminal()                    # clean the GUI terminal
         filetypes = []
         for t in self.good_extension[self.source]:  # only the source selected type extensions allowed
@@ -96,15 +191,32 @@ class Face2face:
 
     # Change the selected source
     def changeSource(self):
+        if self.stopOffline(self.changeSource):
+            return
+        self.GUI.stopStream()       # the OpenFader instance is reused: stop the running analysis
         self.GUI.ROOT.destroy()     # destoy the current GUI
         self.run()                  # restart the process
         return
 
+    # Print the model load times on the GUI terminal, once the warm-up is over
+    def reportStartup(self):
+        if not self.fader.isWarm():
+            self.GUI.ROOT.after(500, self.reportStartup)     # check again later
+            return
+        self.GUI.printMode("STARTUP")
+        self.GUI.printResult("\nGUI ready in %.2fs" % self.guiReadyTime)
+        for line in self.fader.modelReport():
+            self.GUI.printResult("\n" + line)
+        return
+
     # Running function
     def run(self):
-        self.fader = OpenFader()            # Create an OpenFader instance
+        if self.fader is None:
+            self.fader = OpenFader(inferenceServer=self.inferenceServer)    # Create an OpenFader instance (the models are not loaded yet)
+            self.fader.warmUp(self.analysis)    # Load the models in background while the user selects the source
         s = SourceSelection()               # Create a SourceSelection instance
         self.source = s.start()             # Start the SourceSelection process and wait till the end
+        start = time.time()                 # the time spent by the user to choose is not startup time
         self.GUI = GuiManager()             # Create a GUIManager instance
         self.fader.connectGUI(self.GUI)     # Connect the current GUI with the OpenFader instance
 
@@ -117,12 +229,18 @@ class Face2face:
         self.GUI.addButton("Train", self.train, None, True, True)           # Train new image button
         if self.source != "image":
             self.GUI.addButton("FPS", self.GUI.updateFPS, None, True, allBoth)                   # Set FPS button
+            self.GUI.addButton("Auto FPS", self.GUI.toggleAutoRate, None, True, allBoth)         # Automatic FPS and analysis interval button
+        if self.source == "video":
+            self.GUI.addButton("Offline", self.offline, None, True, allBoth)                     # Analyze every frame button
         if self.source == "camera":
             self.GUI.addButton("Say cheese :)", self.GUI.sayCheese, self.fader.addTrainImage)    # Say Cheese button         
         else: 
             self.GUI.addButton("Browse", self.browse, None, True, True)                 # Browse new media button
+        self.GUI.addButton("Metrics", self.GUI.showMetrics, None, True, True)           # Per-stage timing button
         self.GUI.addButton("Source", self.changeSource, None, False, allBoth)           # Change source button
         self.analyze(self.analysis[0])              # Run the default analysis
         self.GUI.disableButtons(True)               # Disable useless buttons
+        self.guiReadyTime = time.time() - start
+        self.GUI.ROOT.after(500, self.reportStartup)    # Report the startup times
         self.GUI.startLoop()                        # Start the GUI process
         return
\ No newline at end of file
@@ -0,0 +1,177 @@
+# -----------------------------------------------------------
+# FaceTracker Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import cv2
+
+# Compute the Intersection over Union of two (x, y, w, h) boxes
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+# Create an OpenCV single-object tracker (the best one available in the installed OpenCV)
+def createOpenCvTracker():
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        for name in ("TrackerKCF_create", "TrackerMIL_create"):
+            if module is not None and hasattr(module, name):
+                return getattr(module, name)()
+    return None
+
+# Track class
+#
+# A face followed across the frames, with a persistent id
+class Track:
+
+    # Constructor
+    #
+    # Parameters:
+    # id:  the id of the track
+    # box: the (x, y, w, h) box of the face
+    def __init__(self, id, box):
+        self.id = id
+        self.box = tuple(int(v) for v in box)
+        self.name = None                # the name of the individual, None until identified
+        self.matches = []               # the top-k (name, distance) gallery matches
+        self.missed = 0                 # consecutive detections without this face
+        self.lastAttempt = None         # frame of the last identification attempt
+        self.cvTracker = None
+        return
+
+    # Save the result of an identification attempt
+    #
+    # Parameters:
+    # matches: the (name, distance) gallery matches of the face
+    # frame:   the number of the current frame
+    def identify(self, matches, frame):
+        self.matches = matches
+        self.lastAttempt = frame
+        if matches:
+            self.name = matches[0][0]
+        return
+
+# FaceTracker class
+#
+# This class associates the faces detected in a frame to the ones of the
+# previous frames (greedy Intersection over Union matching), so every face
+# keeps a persistent track id and its identity.
+# Between two detections, the tracks can optionally follow the faces with
+# a cheap OpenCV tracker.
+#
+# How to use it?
+# 1) Create an instance of the class:       t = FaceTracker()
+# 2) On a detection frame:                  t.update(boxes, frame)
+# 3) On the other frames:                   t.predict(frame)
+# 4) Identify the new faces:                t.toIdentify(n)
+# 5) Read the faces to show:                t.visibleTracks()
+class FaceTracker:
+
+    # Constructor
+    #
+    # Parameters:
+    # iouThreshold:     the min IoU to associate a detection to a track (Default: 0.3)
+    # maxMissed:        the detections a track survives without its face (Default: 2)
+    # retryEvery:       the frames between two identification attempts of an unknown face (Default: 10)
+    # useOpenCvTracker: if True, the faces are followed between detections (Default: False)
+    def __init__(self, iouThreshold = 0.3, maxMissed = 2, retryEvery = 10, useOpenCvTracker = False):
+        self.iouThreshold = iouThreshold
+        self.maxMissed = maxMissed
+        self.retryEvery = retryEvery
+        self.useOpenCvTracker = useOpenCvTracker
+        self.reset()
+        return
+
+    # Forget all the tracks
+    def reset(self):
+        self.tracks = []
+        self.nextId = 0
+        return
+
+    # Associate the faces detected in a frame to the tracks
+    #
+    # Parameters:
+    # boxes: the (x, y, w, h) boxes of the detected faces
+    # frame: the frame (needed only by the OpenCV tracker) (Default: None)
+    #
+    # Return: the current tracks
+    def update(self, boxes, frame = None):
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for b, box in enumerate(boxes):
+                score = iou(track.box, box)
+                if score >= self.iouThreshold:
+                    pairs.append((score, t, b))
+        pairs.sort(reverse=True)
+
+        usedTracks = set()
+        usedBoxes = set()
+        for score, t, b in pairs:          # greedy: best overlaps first
+            if t in usedTracks or b in usedBoxes:
+                continue
+            usedTracks.add(t)
+            usedBoxes.add(b)
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].missed = 0
+
+        tracks = []
+        for t, track in enumerate(self.tracks):
+            if t not in usedTracks:
+                track.missed += 1
+            if track.missed <= self.maxMissed:
+                tracks.append(track)
+        for b, box in enumerate(boxes):
+            if b not in usedBoxes:
+                tracks.append(Track(self.nextId, box))     # a new face
+                self.nextId += 1
+        self.tracks = tracks
+
+        if self.useOpenCvTracker and frame is not None:
+            for track in self.tracks:
+                track.cvTracker = createOpenCvTracker()
+                if track.cvTracker is not None:
+                    track.cvTracker.init(frame, track.box)
+        return self.tracks
+
+    # Move the tracks on a frame without detections (only with the OpenCV tracker)
+    #
+    # Parameters:
+    # frame: the frame
+    #
+    # Return: the current tracks
+    def predict(self, frame):
+        if not self.useOpenCvTracker:
+            return self.tracks
+        for track in self.tracks:
+            if track.cvTracker is None:
+                continue
+            ok, box = track.cvTracker.update(frame)
+            if ok:
+                track.box = tuple(int(v) for v in box)
+        return self.tracks
+
+    # Return the tracks whose face was found in the last detection
+    def visibleTracks(self):
+        return [track for track in self.tracks if track.missed == 0]
+
+    # Return the tracks that need an identification: the new ones and
+    # the unknown ones not tried in the last retryEvery frames
+    #
+    # Parameters:
+    # frame: the number of the current frame
+    def toIdentify(self, frame):
+        pending = []
+        for track in self.tracks:
+            if track.missed > 0 or track.name is not None:
+                continue
+            if track.lastAttempt is None or frame - track.lastAttempt >= self.retryEvery:
+                pending.append(track)
+        return pending
@@ -0,0 +1,33 @@
+# -----------------------------------------------------------
+# FileHash script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import hashlib
+
+# This code aim to identify a media file by its content
+
+# Compute the content hash of a file
+#
+# Parameters:
+# path:      the path to the file
+# blockSize: the number of bytes read at a time (Default: 1MB)
+#
+# Return: the hexadecimal SHA-1 digest of the file content
+def hashFile(path, blockSize = 1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        block = f.read(blockSize)
+        while block:
+            h.update(block)
+            block = f.read(blockSize)
+    return h.hexdigest()
+
+# Compute the content hash of some bytes already in memory
+#
+# Parameters:
+# data: the bytes to hash
+def hashBytes(data):
+    return hashlib.sha1(data).hexdigest()
@@ -0,0 +1,79 @@
+# -----------------------------------------------------------
+# FrameCache Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+from collections import OrderedDict
+from threading import Lock
+
+# FrameCache class
+#
+# This class keeps the most recently used decoded frames in memory
+# (Least Recently Used policy), up to a max amount of bytes
+#
+# How to use it?
+# 1) Create an instance of the class:       c = FrameCache(maxBytes = 256 * 2**20)
+# 2) Save a frame:                          c.put(key, frame)
+# 3) Get it back:                           frame = c.get(key)
+class FrameCache:
+
+    # Constructor
+    #
+    # Parameters:
+    # maxBytes: the memory cap of the cached frames (Default: 256MB)
+    def __init__(self, maxBytes = 256 * 2**20):
+        self.maxBytes = maxBytes
+        self.frames = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        return
+
+    # Get a frame
+    #
+    # Parameters:
+    # key: the key of the frame
+    #
+    # Return: the frame, or None if it isn't in the cache
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)        # most recently used
+            self.hits += 1
+            return frame
+
+    # Save a frame, removing the least recently used ones if the cache is full
+    #
+    # Parameters:
+    # key:   the key of the frame
+    # frame: the frame (a numpy array)
+    def put(self, key, frame):
+        if frame.nbytes > self.maxBytes:
+            return                              # it would empty the whole cache
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self.frames[key] = frame
+            self.bytes += frame.nbytes
+            while self.bytes > self.maxBytes:
+                _, removed = self.frames.popitem(last=False)
+                self.bytes -= removed.nbytes
+        return
+
+    # Remove all the frames
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+        return
+
+    # Number of cached frames
+    def __len__(self):
+        return len(self.frames)
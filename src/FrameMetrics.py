@@ -0,0 +1,203 @@
+# -----------------------------------------------------------
+# FrameMetrics Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+import json
+import time
+import numpy as np
+
+# LatencyStats class
+#
+# The last `window` durations of a stage, with their percentiles
+class LatencyStats:
+
+    # Constructor
+    #
+    # Parameters:
+    # window: the number of kept measures (Default: 300)
+    def __init__(self, window = 300):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        return
+
+    # Add a measure (in seconds)
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        return
+
+    # Percentiles of the kept measures, in milliseconds
+    def percentiles(self):
+        if len(self.samples) == 0:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "count": self.count}
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95, 99]) * 1000
+        return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "count": self.count}
+
+# RateCounter class
+#
+# The events of the last `window` seconds, to compute a rate (e.g. FPS)
+class RateCounter:
+
+    # Constructor
+    #
+    # Parameters:
+    # window: the time window in seconds (Default: 5)
+    def __init__(self, window = 5.0):
+        self.window = window
+        self.events = deque()
+        self.count = 0
+        return
+
+    # Count an event
+    def tick(self):
+        now = time.time()
+        self.events.append(now)
+        self.count += 1
+        while self.events and self.events[0] < now - self.window:
+            self.events.popleft()
+        return
+
+    # Events per second in the time window
+    def rate(self):
+        now = time.time()
+        while self.events and self.events[0] < now - self.window:
+            self.events.popleft()
+        if len(self.events) < 2:
+            return 0.0
+        return (len(self.events) - 1) / max(now - self.events[0], 1e-9)
+
+# FrameMetrics class
+#
+# This class measures where the frame time goes:
+# - the duration of every stage of the frame path, with rolling p50/p95/p99
+# - the achieved rates (e.g. capture and analysis FPS)
+# - the dropped frames of the pipeline queues
+#
+# How to use it?
+# 1) Create an instance of the class:       m = FrameMetrics()
+# 2) Time a stage:                          with m.measure("analysis"): ...
+# 3) Count a processed frame:               m.tick("capture")
+# 4) Read the report:                       m.summary() or m.dump("metrics.json")
+class FrameMetrics:
+
+    # Constructor
+    #
+    # Parameters:
+    # window: the number of measures kept for every stage (Default: 300)
+    def __init__(self, window = 300):
+        self.window = window
+        self.stages = {}            # name -> LatencyStats (in creation order)
+        self.rates = {}             # name -> RateCounter
+        self.dropSources = {}       # name -> function returning a dropped frames count
+        self.lock = Lock()
+        return
+
+    # Add the duration of a stage
+    #
+    # Parameters:
+    # stage:   the name of the stage
+    # seconds: the measured duration
+    def record(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = LatencyStats(self.window)
+            stats.add(seconds)
+        return
+
+    # Measure the duration of a block of code
+    #
+    # Parameters:
+    # stage: the name of the stage
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    # Count an event of a rate (e.g. a captured frame)
+    #
+    # Parameters:
+    # name: the name of the rate
+    def tick(self, name):
+        with self.lock:
+            counter = self.rates.get(name)
+            if counter is None:
+                counter = self.rates[name] = RateCounter()
+            counter.tick()
+        return
+
+    # Register a dropped frames counter
+    #
+    # Parameters:
+    # name:   the name of the counter
+    # source: the function returning the current count
+    def addDropSource(self, name, source):
+        self.dropSources[name] = source
+        return
+
+    # The durations of a stage recorded after its first `count` measures
+    #
+    # Parameters:
+    # stage: the name of the stage
+    # count: the number of measures already read
+    #
+    # Return: the (durations in seconds, total number of measures) couple
+    def since(self, stage, count):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                return [], 0
+            if stats.count < count:
+                count = 0           # the metrics were reset
+            new = min(stats.count - count, len(stats.samples))
+            return list(stats.samples)[len(stats.samples) - new:], stats.count
+
+    # Forget all the measures
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.rates = {}
+        return
+
+    # Current state of all the metrics
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "stages_ms": {name: stats.percentiles() for name, stats in self.stages.items()},
+                "fps": {name: counter.rate() for name, counter in self.rates.items()},
+                "frames": {name: counter.count for name, counter in self.rates.items()},
+                "dropped": {name: int(source()) for name, source in self.dropSources.items()}
+            }
+
+    # Human readable report of all the metrics
+    #
+    # Return: a list of text lines
+    def summary(self):
+        snap = self.snapshot()
+        lines = []
+        for name, fps in snap["fps"].items():
+            lines.append("%s: %.1f fps (%d frames)" % (name, fps, snap["frames"][name]))
+        for name, count in snap["dropped"].items():
+            lines.append("dropped %s: %d" % (name, count))
+        for name, p in snap["stages_ms"].items():
+            lines.append("%-12s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms" % (name, p["p50"], p["p95"], p["p99"]))
+        return lines
+
+    # Save all the metrics in a JSON file
+    #
+    # Parameters:
+    # path: the path of the JSON file
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return
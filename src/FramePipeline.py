@@ -0,0 +1,123 @@
+# -----------------------------------------------------------
+# FramePipeline script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Thread library
+from threading import Thread, Condition
+import time
+import traceback
+
+# This code aim to decouple the stages of the video stream:
+# - the capture thread reads the frames from the source
+# - the inference worker analyzes the most recent frame
+# - the GUI (Tk thread) displays the most recent frame
+# Stages exchange frames through single-slot queues: a new frame replaces the
+# one not yet taken (latest frame wins), so a slow stage never builds a backlog
+# and the end-to-end latency stays bounded.
+
+# LatestFrameSlot class
+#
+# A bounded queue of size 1: put never blocks and overwrites the stale item
+class LatestFrameSlot:
+
+    # Constructor
+    def __init__(self):
+        self.condition = Condition()
+        self.item = None
+        self.dropped = 0            # number of items overwritten before being taken
+        self.closed = False
+        return
+
+    # Put a new item, dropping the previous one if it was not taken yet
+    #
+    # Parameters:
+    # item: the item (e.g. a frame)
+    def put(self, item):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify()
+        return
+
+    # Take the most recent item, waiting for it
+    #
+    # Parameters:
+    # timeout: the max waiting time in seconds (Default: None, wait forever)
+    #
+    # Return: the item, or None if the timeout expired or the slot was closed
+    def get(self, timeout = None):
+        with self.condition:
+            if self.item is None and not self.closed:
+                self.condition.wait(timeout)
+            item = self.item
+            self.item = None
+        return item
+
+    # Take the most recent item without waiting
+    #
+    # Return: the item, or None if there is no new item
+    def poll(self):
+        with self.condition:
+            item = self.item
+            self.item = None
+        return item
+
+    # Close the slot, waking up who is waiting on it
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        return
+
+# InferenceWorker class
+#
+# This class creates a thread that continuously takes the most recent frame
+# from a LatestFrameSlot and analyzes it, outside the Tk thread
+class InferenceWorker(Thread):
+
+    # Constructor
+    #
+    # Parameters:
+    # slot:     the LatestFrameSlot to read the frames from
+    # target:   the analysis function, called as target(frame)
+    # interval: the min time between two analysis, in ms (Default: 0, as fast as possible)
+    # metrics:  the FrameMetrics where the analysis time is recorded (Default: None)
+    def __init__(self, slot, target, interval = 0, metrics = None):
+        Thread.__init__(self)
+        self.daemon = True
+        self.slot = slot
+        self.target = target
+        self.interval = interval
+        self.metrics = metrics
+        self.close = False
+        self.start()
+        return
+
+    # Main loop
+    def run(self):
+        while not self.close:
+            frame = self.slot.get(timeout=0.1)
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            try:
+                self.target(frame)
+            except Exception:
+                traceback.print_exc()   # an analysis error must not kill the worker
+            if self.metrics is not None:
+                self.metrics.record("analysis", time.perf_counter() - start)
+                self.metrics.tick("analysis")
+            wait = self.interval / 1000 - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+        return
+
+    # Stop the worker
+    def stop(self):
+        self.close = True
+        self.slot.close()
+        return
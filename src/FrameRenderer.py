@@ -0,0 +1,102 @@
+# -----------------------------------------------------------
+# FrameRenderer Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# PIL Library
+from PIL import Image, ImageTk
+import time
+import cv2
+
+# FrameRenderer class
+#
+# This class displays the frames on a Tk label with as little work as possible:
+# - the frame is scaled once to fit the label (keeping the aspect ratio)
+# - it is converted to RGB (not RGBA)
+# - it is pasted into the same PhotoImage, allocated again only when the size changes
+# - the redraws are capped at the display refresh rate
+# It must be used from the Tk thread.
+#
+# How to use it?
+# 1) Create an instance of the class:       r = FrameRenderer(label, 700, 444)
+# 2) Check if a redraw is due:              r.due()
+# 3) Display a frame:                       r.render(frame)
+class FrameRenderer:
+
+    # Constructor
+    #
+    # Parameters:
+    # label:   the Tk label where the frames are displayed
+    # width:   the width of the display area
+    # height:  the height of the display area
+    # maxFps:  the max number of redraws per second (Default: 60)
+    # metrics: the FrameMetrics where the render time is recorded (Default: None)
+    def __init__(self, label, width, height, maxFps = 60, metrics = None):
+        self.label = label
+        self.width = width
+        self.height = height
+        self.maxFps = maxFps
+        self.metrics = metrics
+        self.photo = None           # the reused PhotoImage
+        self.lastRender = 0
+        self.shape = None           # shape of the last source frame
+        self.size = None            # (width, height) of the displayed image
+        return
+
+    # Check if enough time passed since the last redraw
+    def due(self):
+        return time.time() - self.lastRender >= 1.0 / self.maxFps
+
+    # Forget the displayed image (e.g. after the label has been cleared)
+    def reset(self):
+        self.photo = None
+        return
+
+    # Compute the size of the displayed image for a frame shape
+    def fitSize(self, shape):
+        height, width = shape[:2]
+        scale = min(self.width / float(width), self.height / float(height))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    # Time a stage (if there are metrics)
+    def record(self, stage, start):
+        if self.metrics is not None:
+            self.metrics.record(stage, time.perf_counter() - start)
+        return
+
+    # Display a BGR frame on the label
+    #
+    # Parameters:
+    # frame: the BGR frame
+    # force: if True, the frame is displayed even if the redraw is not due (Default: False)
+    #
+    # Return: True if the frame has been displayed
+    def render(self, frame, force = False):
+        if not force and not self.due():
+            return False
+        self.lastRender = time.time()
+
+        start = time.perf_counter()
+        if frame.shape != self.shape:
+            self.shape = frame.shape
+            self.size = self.fitSize(frame.shape)
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.record("convert", start)
+
+        start = time.perf_counter()
+        img = Image.fromarray(rgb)
+        if self.photo is None or (self.photo.width(), self.photo.height()) != self.size:
+            self.photo = ImageTk.PhotoImage(image=img)
+        else:
+            self.photo.paste(img)                   # reuse the Tk image buffer
+        if str(self.label.cget("image")) != str(self.photo):
+            self.label.imgtk = self.photo           # keep a reference, or Tk drops the image
+            self.label.configure(image=self.photo)
+        self.record("photoimage", start)
+        if self.metrics is not None:
+            self.metrics.tick("display")
+        return True
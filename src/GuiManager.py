@@ -13,11 +13,20 @@ from tkinter import scrolledtext
 from tkinter import filedialog
 from tkinter import simpledialog
 from os import path
-from PIL import Image, ImageTk
 import cv2
 import shutil
 # Video Stream Widget Class
 from src.VideoStreamWidget import VideoStreamWidget
+# Frame Pipeline
+from src.FramePipeline import InferenceWorker
+# Frame Metrics
+from src.FrameMetrics import FrameMetrics
+# Frame Renderer
+from src.FrameRenderer import FrameRenderer
+# Terminal Writer
+from src.TerminalWriter import TerminalWriter
+# Auto Rate Controller
+from src.AutoRateController import AutoRateController
 
 # General GUI params
 TITLE = "Face2face - GUI"
@@ -39,7 +48,7 @@ FRAME_HEIGHT = BODY_HEIGHT
 # 4) Browse a media file in the own pc
 # 5) Train a new image in the Face Recognition Model
 # 6) Make a selfie (enable only if there is the opened webcam)
-# 7) Change the FPS value of the video stream
+# 7) Change the FPS value of the video stream (or let it adapt to the machine)
 class GuiManager:
 
     # Constructor
@@ -69,9 +78,11 @@ class GuiManager:
         OUTPUT_FRAME.pack(fill=tk.Y, side=tk.BOTTOM, expand=True)
         self.output = scrolledtext.ScrolledText(OUTPUT_FRAME, width=WIDTH, height=130, bg="gray16", fg='pale green')
         self.output.place(x=-1, y=-1)
+        # Every write is queued and applied by the Tk thread at most 10 times per second
+        self.terminal = TerminalWriter(self.ROOT, self.output, interval=100, maxLines=500)
 
-        self.output.insert(INSERT, "Ciao. \nOne moment...")
-        self.output.insert(INSERT, "\nWebCam's ready. Let's go!")
+        self.printResult("Ciao. \nOne moment...")
+        self.printResult("\nWebCam's ready. Let's go!")
 
         self.BUTTONS_FRAME = tk.Frame(master=BODY_FRAME, width=BUTTONS_WIDTH, bg="gray69")
         self.BUTTONS_FRAME.pack(fill=tk.Y, side=tk.RIGHT, expand=False)
@@ -81,6 +92,15 @@ class GuiManager:
         self.bothBtn = []                   # Buttons always activated
         self.fps = 5                        # Default FPS value
         self.open = False                   # At the start the video stream is closed
+        self.video = None                   # The active video stream
+        self.worker = None                  # The active analysis worker
+        self.metrics = FrameMetrics()       # Per-stage timing of the frame path
+        self.metricsPath = "Media/metrics.json"     # Where the metrics are saved
+        self.renderer = FrameRenderer(self.webcam, FRAME_WIDTH, FRAME_HEIGHT, metrics=self.metrics)
+        self.metricsWindow = None           # The window showing the metrics (if open)
+        self.autoRate = None                # The active automatic FPS and analysis interval controller
+        self.targetLatency = 0.25           # Target end-to-end latency of the automatic controller (seconds)
+        self.autoRatePeriod = 1000          # ms between two adjustments of the automatic controller
     
     # Add a button to the GUI
     #
@@ -130,39 +150,94 @@ class GuiManager:
         fps = simpledialog.askinteger("Video settings","Set Fps (default = 5)", parent=self.ROOT, initialvalue=self.fps, minvalue=5, maxvalue=300)
         if fps is None:
             messagebox.showerror("Error", "Please Try again. ( You have to insert a number )")
-            self.output.insert(INSERT, "\nError. Try Again")
+            self.printResult("\nError. Try Again")
             return
         fps = min(300, max(fps, 5))         # 300fps is the upper limit, 5fps is the lower limit
+        if self.autoRate is not None:
+            self.toggleAutoRate()           # a value set by hand wins over the automatic one
         if not self.video.close:
             self.fps = int(fps)
             self.video.fps = int(fps)
         return
 
+    # Turn the automatic FPS and analysis interval on or off
+    def toggleAutoRate(self):
+        if self.autoRate is not None:
+            self.autoRate = None
+            self.printResult("\nAuto rate: off (%d fps)" % self.fps)
+            return
+        interval = self.worker.interval if self.worker is not None else 200
+        self.autoRate = AutoRateController(self.metrics, self.targetLatency, fps=self.fps, interval=interval)
+        self.printResult("\nAuto rate: on (target latency %d ms)" % (self.targetLatency * 1000))
+        self.ROOT.after(self.autoRatePeriod, self.adjustRate, self.autoRate)
+        return
+
+    # Adjust the FPS and the analysis interval (executed on the Tk thread, every autoRatePeriod ms)
+    #
+    # Parameters:
+    # controller: the controller that scheduled this call (stopped if it's no longer the active one)
+    def adjustRate(self, controller):
+        if controller is not self.autoRate:
+            return
+        controller.step(self.video, self.worker)
+        if self.video is not None and not self.video.close:
+            self.fps = self.video.fps
+        self.ROOT.after(self.autoRatePeriod, self.adjustRate, controller)
+        return
+
     # Adapt the frame to the GUI Monitor 
     def analyzePhoto(self, frame):
-        cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
-        img = Image.fromarray(cv2image)
-        imgtk = ImageTk.PhotoImage(image=img)
-        self.webcam.imgtk = imgtk
-        self.webcam.configure(image=self.webcam.imgtk)
+        self.renderer.render(frame, True)
 
-    # Clean the GUI terminal
+    # Show the per-stage timing of the frame path in its own window (the
+    # per-frame results would overwrite it on the GUI terminal), refreshed
+    # every second while it's open, and save it in a JSON file (self.metricsPath)
+    def showMetrics(self):
+        if self.metricsWindow is not None and self.metricsWindow.winfo_exists():
+            self.metricsWindow.lift()
+        else:
+            self.metricsWindow = tk.Toplevel(self.ROOT)
+            self.metricsWindow.title("Face2face - Metrics")
+            self.metricsText = tk.Text(self.metricsWindow, width=70, height=20, bg="gray16", fg='pale green')
+            self.metricsText.pack(fill=tk.BOTH, expand=True)
+            self.updateMetrics()
+        try:
+            self.metrics.dump(self.metricsPath)
+            self.printResult("\nMetrics saved in " + self.metricsPath)
+        except OSError as e:
+            self.printResult("\nCannot save the metrics: " + str(e))
+        return
+
+    # Write the metrics in their window (executed on the Tk thread, every second while it's open)
+    def updateMetrics(self):
+        if self.metricsWindow is None or not self.metricsWindow.winfo_exists():
+            self.metricsWindow = None
+            return
+        lines = self.metrics.summary()
+        if self.autoRate is not None:
+            lines.append(self.autoRate.summary())
+        self.metricsText.delete("1.0", END)
+        self.metricsText.insert(END, "\n".join(lines))
+        self.ROOT.after(1000, self.updateMetrics)
+        return
+
+    # Clean the GUI terminal (it can be called by any thread)
     def cleanTerminal(self):
-        self.output.delete(0.0,END)
+        self.terminal.clean()
 
-    # Print the current mode on the GUI terminal
+    # Print the current mode on the GUI terminal (it can be called by any thread)
     #
     # Parameters:
     # mode: the current mode to be printed
     def printMode(self, mode):
-        self.output.insert(INSERT, "\n"+ mode +": ")
+        self.terminal.write("\n"+ mode +": ")
 
-    # Print a text on the GUI terminal
+    # Print a text on the GUI terminal (it can be called by any thread)
     #
     # Parameters:
     # text: the text to be printed
     def printResult(self, text):
-        self.output.insert(INSERT, text)
+        self.terminal.write(text)
 
     # Start the GUI process
     def startLoop(self):
@@ -174,9 +249,13 @@ class GuiManager:
     # Parameters:
     # source:           the type of the source to be activated (Default: 0, the webcam source)
     # target:           the main function to be executed during the video stream (Default: None)
-    def openSource(self, source = 0, target = None):
+    # height_limit:     the max height of the frames: bigger ones are resized while decoding (Default: None)
+    def openSource(self, source = 0, target = None, height_limit = None):
 
-        self.video = VideoStreamWidget(self.webcam, source, target, self.fps)
+        self.stopStream()                       # only one stream at a time
+        self.metrics.reset()
+        self.video = VideoStreamWidget(self.webcam, source, target, self.fps, height_limit=height_limit,
+                                       metrics=self.metrics, renderer=self.renderer)
         self.open = True
         return
 
@@ -190,23 +269,36 @@ class GuiManager:
         self.open = False
         if isImage:
             return
-        self.video.capture.release()            # Stop to read the video stream
-        self.video.close = True
+        self.stopStream()
         cv2.destroyAllWindows()                 # Destroy all active video stream
         self.webcam.config(image='')
         return
 
-    # Execute the selected analysis
+    # Stop the active video stream and its analysis worker (if any)
+    def stopStream(self):
+        if self.worker is not None:
+            self.worker.stop()                  # Stop to analyze the frames
+            self.worker = None
+        if self.video is not None and not self.video.close:
+            self.video.close = True
+            self.video.capture.release()        # Stop to read the video stream
+        return
+
+    # Execute the selected analysis on the frames of the active video stream.
+    # The analysis runs in its own worker thread, on the most recent frame,
+    # so the GUI stays responsive during the inference
     #
     # Parameters:
-    # target:       the analysis function to be executed
+    # target:       the analysis function to be executed, called as target(arg, frame)
     # arg:          the params of the analysis function
-    # interval:     the timeout time between each analysis (Default: 200ms)
+    # interval:     the min time between each analysis (Default: 200ms, ignored if the auto rate is on)
     def analyze(self, target, arg, interval = 200):
 
-        target(arg)
-        if self.open: 
-            self.webcam.after(interval, lambda : self.analyze(target, arg, interval))
+        if self.worker is not None:
+            self.worker.stop()
+        if self.autoRate is not None:
+            interval = int(round(self.autoRate.interval))   # keep the interval found by the controller
+        self.worker = InferenceWorker(self.video.analysisSlot, lambda frame: target(arg, frame), interval, self.metrics)
         return
 
     # Make a selfie (enable only if there is the opened webcam)
@@ -237,14 +329,14 @@ class GuiManager:
                 cv2.imwrite(path_to_image, photo)
             else:
                 shutil.copy(photo, path_to_image)
-            self.output.insert(INSERT, "\nCongrats. Your photo is now saved in our DB.")
-            self.output.insert(INSERT, "\nNow you can play with face2face")
+            self.printResult("\nCongrats. Your photo is now saved in our DB.")
+            self.printResult("\nNow you can play with face2face")
             if target:
                 target(path_to_image, name_surname)
             return path_to_image
         else:
             messagebox.showerror("Error", "Please Try again. ( You have to insert your name to save your photo in our DB )")
-            self.output.insert(INSERT, "\nError. Try Again")
+            self.printResult("\nError. Try Again")
         return
 
     # Browse a media file in the own pc
@@ -256,7 +348,7 @@ class GuiManager:
       
         selected_file = filedialog.askopenfilename(initialdir= path.dirname(__file__), filetypes = filetypes)
         if selected_file is not None and selected_file != "":
-            self.output.insert(INSERT, "\n"+selected_file)
+            self.printResult("\n"+selected_file)
             if target:  
                 ex = "." + selected_file.split(".")[-1]
                 return self.add2DB(selected_file, ex, target)
@@ -264,7 +356,7 @@ class GuiManager:
             shutil.copy(selected_file, newPath)
             return newPath
         else:
-            self.output.insert(INSERT, "\nNo file selected. Retry ")
+            self.printResult("\nNo file selected. Retry ")
         return
     
 
@@ -0,0 +1,181 @@
+# -----------------------------------------------------------
+# HeadlessRunner script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# OpenFader
+from src.OpenFader import OpenFader
+# Encoding Store
+from src.EncodingStore import EncodingStore, encodeImage
+# Inference Server
+from src.InferenceServer import InferenceClient
+# Result Store
+from src.ResultStore import ResultStore
+# Video Reader
+from src.VideoReader import VideoReader
+from multiprocessing import Pool
+import argparse
+import json
+import os
+import sys
+import cv2
+
+# This code aim to run the OpenFader analysis without any GUI (e.g. on a server):
+# the images and videos are analyzed by a pool of worker processes and the
+# results are streamed to a JSON Lines file, one line for every analyzed frame,
+# and/or recorded in a ResultStore (compact and indexed, for long videos)
+#
+# How to use it?
+# python -m src.HeadlessRunner --algorithm Recognition --output results.jsonl photo.jpg video.mp4
+# python -m src.HeadlessRunner --algorithm Recognition --store Media/results/day1 video.mp4
+
+ALGORITHMS = ["Detection", "Expression", "Recognition"]
+VIDEO_EXTENSIONS = ["MP4", "AVI", "MOV", "MKV"]
+
+# The OpenFader instance of the current worker process
+fader = None
+
+# Create the OpenFader instance of a worker process (the models are loaded once per process)
+#
+# Parameters:
+# db_path: the folder of the Face Recognition training dataset
+# server:  the socket path of an InferenceServer executing the models, True for its default one (None: loaded by every worker)
+def initWorker(db_path, server = None):
+    global fader
+    fader = OpenFader(db_path, inferenceServer=server)
+    return
+
+# Check if a media is a video (according to its extension)
+def isVideo(path):
+    return os.path.splitext(path)[1][1:].upper() in VIDEO_EXTENSIONS
+
+# Split the media in jobs: an image is one job, a video is split in segments
+# of frames, so a long video is spread across all the workers
+#
+# Parameters:
+# paths:   the images and videos to analyze
+# segment: the number of frames of a video segment
+#
+# Return: a list of (path, first frame, last frame) jobs (frames are None for images)
+def createJobs(paths, segment):
+    jobs = []
+    for path in paths:
+        if not isVideo(path):
+            jobs.append((path, None, None))
+            continue
+        capture = cv2.VideoCapture(path)
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        if count <= 0:
+            jobs.append((path, 0, None))            # unknown length: one job until the end
+            continue
+        for start in range(0, count, segment):
+            jobs.append((path, start, min(start + segment, count)))
+    return jobs
+
+# Analyze a frame and describe its result
+def analyzeFrame(path, algorithm, frame, index = None, timestamp = None):
+    fader.algorithmMap[algorithm]["target_analysis_function"](frame)
+    return {
+        "source": path,
+        "frame": index,
+        "timestamp": timestamp,
+        "algorithm": algorithm,
+        "faces": fader.describeResult(algorithm)
+    }
+
+# Analyze a job (executed in a worker process)
+#
+# Parameters:
+# job: the (path, algorithm, first frame, last frame, step) of the job
+#
+# Return: the (records, unknown name) couple: the list of the records of the analyzed
+#         frames and the name given by the worker to the faces not found in the gallery
+def runJob(job):
+    path, algorithm, start, end, step = job
+    fader.initAgain()           # the faces are tracked only inside a job
+    try:
+        if start is None:
+            frame = cv2.imread(path)
+            if frame is None:
+                raise IOError("cannot read the image")
+            return [analyzeFrame(path, algorithm, frame)], fader.unknownName
+
+        capture = VideoReader(path)
+        if not capture.isOpened():
+            raise IOError("cannot open the video")
+        records = [analyzeFrame(path, algorithm, frame, index, timestamp)
+                   for index, timestamp, frame in capture.frames(start, end, step)]
+        capture.release()
+        return records, fader.unknownName
+    except Exception as e:          # a broken media must not stop the other ones
+        return [{"source": path, "frame": start, "algorithm": algorithm, "error": str(e)}], fader.unknownName
+
+# Analyze images and videos with a pool of workers, streaming the results
+#
+# Parameters:
+# paths:     the images and videos to analyze
+# algorithm: the analysis to execute (Detection, Expression or Recognition)
+# output:    the file object where the JSON lines are written (None: no JSON lines)
+# workers:   the number of worker processes (Default: None, one for each core)
+# every:     analyze one video frame every `every` frames (Default: 1, all of them)
+# segment:   the number of frames of a video job (Default: 300)
+# db_path:   the folder of the Face Recognition training dataset (Default: Media/db)
+# store:     the ResultStore where the results are also recorded (Default: None)
+# server:    the socket path of an InferenceServer executing the models, True for its default one (Default: None, loaded by every worker)
+#
+# Return: the number of written records
+def run(paths, algorithm, output, workers = None, every = 1, segment = 300, db_path = "Media/db", store = None, server = None):
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown algorithm %s (allowed: %s)" % (algorithm, ", ".join(ALGORITHMS)))
+    # Bring the training dataset up to date once, before the workers read it
+    # (with an InferenceServer, the changed images are encoded by the server too)
+    encoder = InferenceClient(None if server is True else server).encodeImage if server is not None else encodeImage
+    EncodingStore(db_path, encoder=encoder).refresh()
+
+    segment = max(every, segment - segment % every)     # keep the step aligned across the segments
+    jobs = [(path, algorithm, start, end, every) for path, start, end in createJobs(paths, segment)]
+    written = 0
+    with Pool(workers, initializer=initWorker, initargs=(db_path, server)) as pool:
+        for records, unknownName in pool.imap_unordered(runJob, jobs):
+            for record in records:
+                if output is not None:
+                    output.write(json.dumps(record) + "\n")
+                if store is not None:
+                    store.addRecord(record, unknownName)
+                written += 1
+            if output is not None:
+                output.flush()
+    if store is not None:
+        store.close()
+    return written
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Run the OpenFader analysis without GUI and stream the results to JSON Lines")
+    parser.add_argument("media", nargs="+", help="the images and videos to analyze")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="Detection", help="the analysis to execute (default: Detection)")
+    parser.add_argument("--output", default=None, help="the JSON Lines output file, - for the standard output (default: standard output, if no --store)")
+    parser.add_argument("--store", default=None, help="also record the results in this ResultStore folder")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument("--every", type=int, default=1, help="analyze one video frame every N (default: 1)")
+    parser.add_argument("--db", default="Media/db", help="the folder of the encoding store (default: Media/db)")
+    parser.add_argument("--server", default=None, help="the socket of an InferenceServer executing the models, 'default' for its default one (default: none)")
+    args = parser.parse_args()
+    if args.server == "default":
+        args.server = True
+
+    store = ResultStore(args.store) if args.store else None
+    if args.output == "-" or (args.output is None and store is None):
+        run(args.media, args.algorithm, sys.stdout, args.workers, max(1, args.every), db_path=args.db, store=store, server=args.server)
+    elif args.output is None:
+        run(args.media, args.algorithm, None, args.workers, max(1, args.every), db_path=args.db, store=store, server=args.server)
+    else:
+        with open(args.output, "w") as output:
+            run(args.media, args.algorithm, output, args.workers, max(1, args.every), db_path=args.db, store=store, server=args.server)
+    return
+
+if __name__ == "__main__":
+    main()
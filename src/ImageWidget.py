@@ -5,65 +5,80 @@
 # Università di Genova, DIBRIS
 # -----------------------------------------------------------
 
-# PIL Library
-from PIL import Image
-import moviepy.editor as mp
-import os.path
+# Frame Cache
+from src.FrameCache import FrameCache
+# File Hash
+from src.FileHash import hashBytes
+import numpy as np
+import cv2
+import os
 
-# This code aim to manage the size of the media file (bot images and videos)
+# This code aim to manage the size of the image files
+# (videos are resized while decoding them, see VideoReader)
+#
+# Images are decoded and resized in memory only once: the result is kept in
+# a cache keyed by the content of the image and by the target size, so
+# running another analysis on the same image doesn't touch the disk, and a
+# changed image is never served stale.
+
+# Default cache of the decoded images
+imageCache = FrameCache()
 
-# Create a proper name for resized images/videos
-# Add "Resized_" at the start of the media name
-def createResizedName(path):
-    x = path.split("/")
-    string = ""
-    for i in range(0, len(x)-1):
-        string = string + x[i] + "/"
-    return string+'Resized_'+x[-1]
+# Content hash of the images, by (path, size, modification time):
+# an unchanged image is not read again to know its hash
+hashByStat = {}
 
-# Resize a video according a certain height
+# Compute the size of an image that fits in the limits, keeping the aspect ratio
 #
 # Parameters:
-# height_limit: the height limit of the video. If it's bigger it need to be resized (default: 444px) 
-def resizeVideo(path_to_video,  height_limit = 444):
-    clip = mp.VideoFileClip(path_to_video)
-    clip_resized = clip.resize(height=height_limit)
-    path_to_video = createResizedName(path_to_video)
-    if os.path.isfile(path_to_video):
-        # if it already exists, dont do anything
-        return path_to_video
-    # Save the new resized video in the same directory of the original one
-    clip_resized.write_videofile(path_to_video)
-    return path_to_video
+# width:        the width of the image
+# height:       the height of the image
+# width_limit:  the max width
+# height_limit: the max height
+def fitSize(width, height, width_limit, height_limit):
+    scale = min(1.0, width_limit / float(width), height_limit / float(height))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
 
-# Resize an image according a certain width and a certain height
+# Load an image in memory, resized to fit the limits (keeping the aspect ratio)
+# The returned frame is shared with the cache: copy it before drawing on it.
 #
 # Parameters:
-# width_limit: the width limit of the image. If it's bigger it need to be resized (default: 444px) 
-# height_limit: the height limit of the image. If it's bigger it need to be resized (default: 444px) 
-def checkImage(path_to_image, width_limit = 700, height_limit = 444):
-
-    image = Image.open(path_to_image)
-
-    sizeImage = image.size
-    needToResize = False
-
-    new_width_size = sizeImage[0]
-    new_height_size = sizeImage[1]
-
-    if new_width_size > width_limit:
-        needToResize = True
-        new_width_size = width_limit
-    if new_height_size > height_limit:
-        needToResize = True
-        new_height_size = height_limit
+# path_to_image: the path to the image
+# width_limit:   the width limit of the image. If it's bigger it need to be resized (default: 700px)
+# height_limit:  the height limit of the image. If it's bigger it need to be resized (default: 444px)
+# cache:         the FrameCache to use (default: imageCache)
+#
+# Return: the BGR frame of the image
+def loadImage(path_to_image, width_limit = 700, height_limit = 444, cache = None):
+    if cache is None:
+        cache = imageCache
+    st = os.stat(path_to_image)
+    statKey = (path_to_image, st.st_size, st.st_mtime)
+    data = None
+    content_hash = hashByStat.get(statKey)
+    if content_hash is None:
+        with open(path_to_image, "rb") as f:
+            data = f.read()
+        content_hash = hashBytes(data)
+        if len(hashByStat) > 4096:
+            hashByStat.clear()
+        hashByStat[statKey] = content_hash
 
-    if needToResize:            # Only if it doesn't exist yet
-        path_to_image = createResizedName(path_to_image)
-        if os.path.isfile(path_to_image):
-            return path_to_image
-        new_image = image.resize((width_limit, height_limit))
-        # Save the new resized image in the same directory of the original one
-        new_image.save(path_to_image)
+    key = (content_hash, width_limit, height_limit)
+    frame = cache.get(key)
+    if frame is not None:
+        return frame
 
-    return path_to_image
\ No newline at end of file
+    if data is None:
+        with open(path_to_image, "rb") as f:
+            data = f.read()
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise IOError("Cannot decode the image " + path_to_image)
+    height, width = frame.shape[:2]
+    size = fitSize(width, height, width_limit, height_limit)
+    if size != (width, height):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    frame.setflags(write=False)         # shared by the cache: nobody must draw on it
+    cache.put(key, frame)
+    return frame
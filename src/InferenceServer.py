@@ -0,0 +1,625 @@
+# -----------------------------------------------------------
+# InferenceServer script included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Lazy Model
+from src.LazyModel import LazyModel
+# Emotion Batcher
+from src.EmotionBatcher import EmotionBatcher
+# Face Detectors
+from src.FaceDetectors import createDetector
+from threading import Thread, Lock, local
+from concurrent.futures import Future
+from collections import deque
+import socketserver
+import argparse
+import socket
+import struct
+import queue
+import json
+import time
+import os
+import numpy as np
+
+# This code aim to load the models only once on a shared workstation: one
+# server process hosts FER, the face detectors and the dlib models, and the
+# OpenFader instances of several GUIs or headless runs send it their frames
+# over a Unix socket.
+# Every message is a 4 bytes (big endian) header length, a JSON header and
+# the raw bytes of the array described by the header (shape, dtype), if any.
+# The requests arriving together are executed as a batch by one inference
+# thread: the faces of all the Expression requests are classified with a
+# single forward pass.
+#
+# The socket is private to the user running the server: by default it's in
+# $XDG_RUNTIME_DIR (or in a /tmp/openfader-<uid> folder only the user can
+# open), it's readable and writable only by the user, and the clients refuse
+# a socket owned by someone else.
+#
+# How to use it?
+# python -m src.InferenceServer                     -> serve on the default socket (see defaultSocket)
+# python -m src.InferenceServer --stats             -> print the statistics of the running server
+# OpenFader(inferenceServer=True)                   -> use the server instead of loading the models
+
+SOCKET_NAME = "openfader.sock"
+
+# The default path of the socket, private to the current user
+#
+# Parameters:
+# create: if True, the private folder is created when needed (Default: False)
+def defaultSocket(create = False):
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isdir(runtime):
+        return os.path.join(runtime, SOCKET_NAME)
+    folder = os.path.join("/tmp", "openfader-%d" % os.getuid())
+    if create:
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        checkPrivate(folder)
+    return os.path.join(folder, SOCKET_NAME)
+
+# Check that a path belongs to the current user and nobody else can use it
+def checkPrivate(path):
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError("InferenceServer: %s must belong to the current user and not be accessible by others" % path)
+    return
+
+# Send a message
+#
+# Parameters:
+# sock:   the connected socket
+# header: the JSON serializable dictionary
+# array:  the numpy array sent after the header (Default: None)
+def sendMessage(sock, header, array = None):
+    header = dict(header)
+    payload = b""
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        header["shape"] = list(array.shape)
+        header["dtype"] = array.dtype.str
+        payload = memoryview(array).cast("B")
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack("!I", len(data)) + data)
+    if len(payload) > 0:
+        sock.sendall(payload)
+    return
+
+# Read exactly n bytes (None if the connection was closed before the first one)
+def receiveExactly(sock, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("InferenceServer: connection closed in the middle of a message")
+        received += count
+    return buffer
+
+# Receive a message
+#
+# Parameters:
+# sock: the connected socket
+#
+# Return: the (header, array) couple (array is None if the message has none),
+#         or None if the connection was closed
+def receiveMessage(sock):
+    size = receiveExactly(sock, 4)
+    if size is None:
+        return None
+    header = json.loads(bytes(receiveExactly(sock, struct.unpack("!I", size)[0])).decode("utf-8"))
+    array = None
+    if "shape" in header:
+        dtype = np.dtype(header["dtype"])
+        count = int(np.prod(header["shape"], dtype=np.int64))
+        data = receiveExactly(sock, count * dtype.itemsize) if count > 0 else bytearray()
+        array = np.frombuffer(data, dtype=dtype).reshape(header["shape"])
+    return header, array
+
+# InferenceHandler class
+#
+# One thread of the server for every connected client: it reads the
+# requests, queues them for the inference thread and sends back the results
+class InferenceHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.inference
+        server.connected(1)
+        try:
+            while True:
+                message = receiveMessage(self.request)
+                if message is None:
+                    break
+                header, array = message
+                try:
+                    response, result = server.submit(header, array).result()
+                except Exception as e:
+                    response, result = {"error": "%s: %s" % (type(e).__name__, e)}, None
+                sendMessage(self.request, response, result)
+        except (ConnectionError, OSError):
+            pass                    # the client went away
+        finally:
+            server.connected(-1)
+        return
+
+# InferenceServer class
+#
+# This class hosts the models and executes the requests of the clients
+#
+# How to use it?
+# 1) Create an instance of the class:       s = InferenceServer()
+# 2) Serve the clients:                     s.serve()      (or s.start() in background)
+# 3) Read the statistics:                   s.stats()
+class InferenceServer:
+
+    # Constructor
+    #
+    # Parameters:
+    # path:      the path of the Unix socket (Default: None, defaultSocket())
+    # batchSize: the max number of requests executed as a batch (Default: 16)
+    # maxWait:   the max time a request waits for other requests, in seconds (Default: 0.005)
+    # useCnn:    the FER face detector: MTCNN if True, else OpenCV's Haar Cascade (Default: True)
+    def __init__(self, path = None, batchSize = 16, maxWait = 0.005, useCnn = True):
+        self.path = path if path is not None else defaultSocket(create=True)
+        self.batchSize = batchSize
+        self.maxWait = maxWait
+        self.useCnn = useCnn
+        self.models = {
+            "FER": LazyModel("FER", self.loadFER, self.warmUpFER),
+            "face_recognition": LazyModel("face_recognition", self.loadFaceRecognition, self.warmUpFaceRecognition)
+        }
+        self.detectors = {}         # face detection backends, by name
+        self.requests = queue.Queue()
+        self.server = None
+        self.thread = None
+        self.lock = Lock()
+        self.clients = 0
+        self.maxQueueDepth = 0
+        self.batches = 0
+        self.batchedRequests = 0
+        self.latencies = {}         # op -> last (wait, total) times in seconds
+        self.counts = {}            # op -> number of requests
+        self.errors = {}            # op -> number of failed requests
+        self.ops = {
+            "detect": self.detect,
+            "encodings": self.encodings,
+            "warmup": self.warmUp,
+            "stats": lambda header, array: ({"stats": self.stats()}, None)
+        }
+        return
+
+    # Load the FER models: the face detector and the batched emotion classifier
+    def loadFER(self):
+        from fer import FER     # imported here: it loads TensorFlow
+        detector = FER(mtcnn=self.useCnn)
+        return detector, EmotionBatcher.fromFER(detector, 32, 0.001)     # the faces of a batch are submitted together
+
+    # Run a first detection and classification on a blank frame
+    def warmUpFER(self, models):
+        detector, emotionBatcher = models
+        blank = np.zeros((240, 320, 3), dtype=np.uint8)
+        detector.find_faces(blank)
+        if emotionBatcher is not None:
+            emotionBatcher.analyze(blank, [(120, 80, 80, 80)])
+        return
+
+    # Import the face recognition library
+    def loadFaceRecognition(self):
+        from src.OpenFader import loadFaceRecognition
+        return loadFaceRecognition()
+
+    # Run a first face encoding on a blank image
+    def warmUpFaceRecognition(self, face_recognition):
+        from src.OpenFader import warmUpFaceRecognition
+        warmUpFaceRecognition(face_recognition)
+        return
+
+    # Get a face detection backend (created the first time it's needed)
+    def getDetector(self, name):
+        if name not in self.detectors:
+            if name == "MTCNN" and self.useCnn:
+                self.detectors[name] = createDetector(name, getFER=lambda: self.models["FER"].get()[0])     # reuse the FER network
+            else:
+                self.detectors[name] = createDetector(name)
+        return self.detectors[name]
+
+    # Start serving in background
+    def start(self):
+        self.bind()
+        self.thread = Thread(target=self.server.serve_forever, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    # Serve the clients until stop is called (or Ctrl+C)
+    def serve(self):
+        self.bind()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+        return
+
+    # Create the socket and start the inference thread
+    def bind(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError("InferenceServer: a server is already running on " + self.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.path)        # left by a server that didn't stop cleanly
+            finally:
+                probe.close()
+        mask = os.umask(0o177)              # the socket is created readable and writable only by the user
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.path, InferenceHandler)
+        finally:
+            os.umask(mask)
+        os.chmod(self.path, 0o600)
+        self.server.daemon_threads = True
+        self.server.inference = self
+        worker = Thread(target=self.run, args=())
+        worker.daemon = True
+        worker.start()
+        return
+
+    # Stop serving (from another thread)
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            if self.thread is not None:
+                self.close()
+        return
+
+    # Close the socket
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        return
+
+    # Count the connected clients
+    def connected(self, delta):
+        with self.lock:
+            self.clients += delta
+        return
+
+    # Queue a request for the inference thread
+    #
+    # Parameters:
+    # header: the JSON header of the request ("op" plus its parameters)
+    # array:  the frame of the request (or None)
+    #
+    # Return: a Future, whose result is the (response header, response array) couple
+    def submit(self, header, array):
+        future = Future()
+        self.requests.put((header, array, future, time.time()))
+        with self.lock:
+            self.maxQueueDepth = max(self.maxQueueDepth, self.requests.qsize())
+        return future
+
+    # Main loop of the inference thread: collect the queued requests and execute them in batches
+    # (with a single client, there is nothing to wait for)
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + (self.maxWait if self.clients > 1 else 0)
+            while len(batch) < self.batchSize:
+                if not self.requests.empty():
+                    batch.append(self.requests.get())
+                    continue
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=wait))
+                except queue.Empty:
+                    break
+            self.execute(batch)
+
+    # Execute a batch of requests
+    def execute(self, batch):
+        started = time.time()
+        emotions = [item for item in batch if item[0].get("op") == "emotions"]
+        if len(emotions) > 0:
+            self.classify(emotions)                 # one forward pass for all the faces
+        for item in batch:
+            header, array, future, queued = item
+            op = header.get("op")
+            if op == "emotions":
+                continue
+            try:
+                if op not in self.ops:
+                    raise ValueError("unknown op %s" % op)
+                future.set_result(self.ops[op](header, array))
+                self.record(op, queued, started, True)
+            except Exception as e:
+                future.set_exception(e)
+                self.record(op, queued, started, False)
+        with self.lock:
+            self.batches += 1
+            self.batchedRequests += len(batch)
+        return
+
+    # Classify the emotions of the faces of several Expression requests
+    def classify(self, items):
+        started = time.time()
+        try:
+            detector, emotionBatcher = self.models["FER"].get()
+            frames = [(array, [tuple(box) for box in header["boxes"]]) for header, array, _, _ in items]
+            if emotionBatcher is not None:
+                results = emotionBatcher.analyzeMany(frames)
+            else:
+                results = [detector.detect_emotions(frame, face_rectangles=boxes) for frame, boxes in frames]
+        except Exception as e:
+            for header, array, future, queued in items:
+                future.set_exception(e)
+                self.record("emotions", queued, started, False)
+            return
+        for (header, array, future, queued), result in zip(items, results):
+            result = [{"box": [int(v) for v in face["box"]], "emotions": face["emotions"]} for face in result]
+            future.set_result(({"result": result}, None))
+            self.record("emotions", queued, started, True)
+        return
+
+    # Record the latency of a request
+    def record(self, op, queued, started, success):
+        now = time.time()
+        with self.lock:
+            if op not in self.latencies:
+                self.latencies[op] = deque(maxlen=1000)
+                self.counts[op] = 0
+                self.errors[op] = 0
+            self.latencies[op].append((started - queued, now - queued))
+            self.counts[op] += 1
+            if not success:
+                self.errors[op] += 1
+        return
+
+    # Detect the faces in a frame
+    def detect(self, header, frame):
+        boxes = self.getDetector(header.get("detector", "MTCNN")).detect(frame)
+        return {"boxes": [[int(v) for v in box] for box in boxes]}, None
+
+    # Compute the face encodings of the faces of an RGB image
+    def encodings(self, header, image):
+        locations = header.get("locations")
+        if locations is not None:
+            locations = [tuple(location) for location in locations]
+        encodings = self.models["face_recognition"].get().face_encodings(image, locations)
+        return {}, np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+
+    # Load and warm up some models
+    def warmUp(self, header, array):
+        for name in header.get("models", []):
+            if name in self.models:
+                self.models[name].warmUp()
+                if self.models[name].error is not None:
+                    raise self.models[name].error
+        if "detector" in header:
+            detector = self.getDetector(header["detector"])
+            detector.detect(np.zeros((240, 320, 3), dtype=np.uint8))
+        return {}, None
+
+    # Statistics of the server
+    #
+    # Return: a dictionary with the queue depth, the batches and, for every op,
+    #         the number of requests and their latencies (in ms)
+    def stats(self):
+        with self.lock:
+            ops = {}
+            for op, latencies in self.latencies.items():
+                waits = np.array([wait for wait, _ in latencies]) * 1000
+                totals = np.array([total for _, total in latencies]) * 1000
+                ops[op] = {
+                    "requests": self.counts[op],
+                    "errors": self.errors[op],
+                    "mean_wait_ms": float(waits.mean()),
+                    "mean_ms": float(totals.mean()),
+                    "p95_ms": float(np.percentile(totals, 95))
+                }
+            return {
+                "clients": self.clients,
+                "queue_depth": self.requests.qsize(),
+                "max_queue_depth": self.maxQueueDepth,
+                "batches": self.batches,
+                "mean_batch": self.batchedRequests / self.batches if self.batches > 0 else 0.0,
+                "models": [model.report() for model in self.models.values()],
+                "ops": ops
+            }
+
+# RemoteDetector class
+#
+# A face detection backend executed by the server (same interface as the
+# backends of FaceDetectors)
+class RemoteDetector:
+
+    # Constructor
+    #
+    # Parameters:
+    # client: the InferenceClient
+    # name:   the name of the backend on the server (Haar, MTCNN, DNN or HOG)
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        return
+
+    # Load the backend on the server
+    def load(self):
+        self.client.request({"op": "warmup", "detector": self.name})
+        return
+
+    # Detect the faces in a BGR frame
+    def detect(self, frame):
+        header, _ = self.client.request({"op": "detect", "detector": self.name}, frame)
+        return [tuple(box) for box in header["boxes"]]
+
+# InferenceClient class
+#
+# This class sends the frames to an InferenceServer. It can be used from
+# several threads (every thread has its own connection) and it replaces the
+# local models of OpenFader:
+# - analyze(frame, boxes) as the EmotionBatcher
+# - face_encodings(image, locations) as the face_recognition library
+# - detector(name) as the face detection backend
+#
+# How to use it?
+# 1) Create an instance of the class:       c = InferenceClient()
+# 2) Send the requests:                     boxes = c.detector("MTCNN").detect(frame)
+class InferenceClient:
+
+    # Constructor
+    #
+    # Parameters:
+    # path: the path of the Unix socket of the server (Default: None, defaultSocket())
+    def __init__(self, path = None):
+        self.path = path if path is not None else defaultSocket()
+        self.local = local()
+        return
+
+    # Only the path is pickled (e.g. to use the client in the worker processes of a Pool)
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.local = local()
+        return
+
+    # The connection of the current thread (opened if needed)
+    def connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                checkPrivate(self.path)     # never send the frames to a socket of another user
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                raise ConnectionError("InferenceServer: cannot connect to %s (%s)" % (self.path, e))
+            self.local.sock = sock
+        return sock
+
+    # Send a request and wait for its response
+    #
+    # Parameters:
+    # header: the request ("op" plus its parameters)
+    # array:  the frame of the request (Default: None)
+    #
+    # Return: the (response header, response array) couple
+    def request(self, header, array = None):
+        sock = self.connection()
+        try:
+            sendMessage(sock, header, array)
+            message = receiveMessage(sock)
+            if message is None:
+                raise ConnectionError("InferenceServer: the server closed the connection")
+        except OSError:
+            self.local.sock = None      # reconnect at the next request
+            sock.close()
+            raise
+        response, result = message
+        if "error" in response:
+            raise RuntimeError("InferenceServer: " + response["error"])
+        return response, result
+
+    # Close the connection of the current thread
+    def close(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self.local.sock = None
+        return
+
+    # The statistics of the server (see InferenceServer.stats)
+    def stats(self):
+        return self.request({"op": "stats"})[0]["stats"]
+
+    # Load and warm up some models on the server
+    def warmUp(self, models):
+        self.request({"op": "warmup", "models": list(models)})
+        return
+
+    # A face detection backend executed by the server
+    def detector(self, name):
+        return RemoteDetector(self, name)
+
+    # Classify the emotions of the faces of a frame (as EmotionBatcher.analyze)
+    def analyze(self, frame, boxes):
+        header, _ = self.request({"op": "emotions", "boxes": [[int(v) for v in box] for box in boxes]}, frame)
+        return [{'box': tuple(face["box"]), 'emotions': face["emotions"]} for face in header["result"]]
+
+    # Compute the face encodings of the faces of an RGB image (as face_recognition.face_encodings)
+    def face_encodings(self, image, known_face_locations = None):
+        header = {"op": "encodings"}
+        if known_face_locations is not None:
+            header["locations"] = [[int(v) for v in location] for location in known_face_locations]
+        _, encodings = self.request(header, image)
+        return list(encodings)
+
+    # Compute the encoding of the first face found in an image file (as EncodingStore.encodeImage)
+    #
+    # Return: the face encoding, or None if there is no face in the image
+    def encodeImage(self, path_image):
+        from PIL import Image
+        with Image.open(path_image) as image:
+            rgb = np.asarray(image.convert("RGB"))
+        encodings = self.face_encodings(rgb)
+        if len(encodings) == 0:
+            return None
+        return encodings[0]
+
+    # The models of the server, as the LazyModel dictionary of OpenFader
+    # (loading one checks that the server answers)
+    def models(self):
+        def connect():
+            self.request({"op": "stats"})
+            return self
+        return {
+            "FER": LazyModel("FER", lambda: (None, connect()), lambda models: self.warmUp(["FER"])),
+            "face_recognition": LazyModel("face_recognition", connect, lambda model: self.warmUp(["face_recognition"]))
+        }
+
+# Command line entry point
+def main():
+    parser = argparse.ArgumentParser(description="Host the OpenFader models for several clients on a Unix socket")
+    parser.add_argument("--socket", default=None, help="the path of the socket (default: %s)" % defaultSocket())
+    parser.add_argument("--batch", type=int, default=16, help="max number of requests executed as a batch (default: 16)")
+    parser.add_argument("--wait", type=float, default=5, help="max time a request waits for a batch, in ms (default: 5)")
+    parser.add_argument("--warmup", nargs="*", default=["FER", "face_recognition"], help="models loaded at startup (default: all)")
+    parser.add_argument("--report", type=float, default=0, help="print the statistics every N seconds (default: never)")
+    parser.add_argument("--stats", action="store_true", help="print the statistics of the running server and exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(json.dumps(InferenceClient(args.socket).stats(), indent=2))
+        return
+
+    server = InferenceServer(args.socket, args.batch, args.wait / 1000)
+    for name in args.warmup:
+        server.models[name].startWarmUp()
+    print("Serving on " + server.path)
+    if args.report > 0:
+        def report():
+            while True:
+                time.sleep(args.report)
+                print(json.dumps(server.stats()))
+        reporter = Thread(target=report, args=())
+        reporter.daemon = True
+        reporter.start()
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -----------------------------------------------------------
+# LazyModel Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Thread library
+from threading import Thread, Lock
+import time
+import traceback
+
+# LazyModel class
+#
+# This class loads a model (or a heavy library) only the first time it's
+# needed, and can warm it up on a background thread in advance.
+# It measures the cold-start (load) time and the first inference time.
+#
+# How to use it?
+# 1) Create an instance of the class:       m = LazyModel("FER", loadFunction, warmUpFunction)
+# 2) Optionally, warm it up in background:  m.startWarmUp()
+# 3) Get the model (loaded if needed):      model = m.get()
+class LazyModel:
+
+    # Constructor
+    #
+    # Parameters:
+    # name:   the name of the model
+    # load:   the function loading and returning the model
+    # warmUp: the function running a first inference, called as warmUp(model) (Default: None)
+    def __init__(self, name, load, warmUp = None):
+        self.name = name
+        self.load = load
+        self.warmUpFunction = warmUp
+        self.model = None
+        self.lock = Lock()
+        self.loadTime = None                # seconds spent to load the model
+        self.firstInferenceTime = None      # seconds spent by the warm-up inference
+        self.error = None
+        self.thread = None
+        return
+
+    # Check if the model is already loaded
+    def isLoaded(self):
+        return self.model is not None
+
+    # Get the model, loading it if needed (waits if it's being loaded by the warm-up)
+    def get(self):
+        if self.model is not None:
+            return self.model
+        with self.lock:
+            if self.model is None:
+                start = time.time()
+                self.model = self.load()
+                self.loadTime = time.time() - start
+        return self.model
+
+    # Load the model and run a first inference
+    def warmUp(self):
+        try:
+            model = self.get()
+            with self.lock:
+                if self.warmUpFunction is not None and self.firstInferenceTime is None:
+                    start = time.time()
+                    self.warmUpFunction(model)
+                    self.firstInferenceTime = time.time() - start
+        except Exception as e:      # the model will be loaded (and the error raised) when needed
+            self.error = e
+            traceback.print_exc()
+        return
+
+    # Warm the model up on a background thread
+    def startWarmUp(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.warmUp, args=())
+            self.thread.daemon = True
+            self.thread.start()
+        return
+
+    # Check if the warm-up is over (or has never been started)
+    def isReady(self):
+        return self.thread is None or not self.thread.is_alive()
+
+    # Human readable timing report
+    def report(self):
+        if self.error is not None:
+            return "%s: failed to load (%s)" % (self.name, self.error)
+        if self.loadTime is None:
+            return "%s: not loaded" % self.name
+        text = "%s: loaded in %.2fs" % (self.name, self.loadTime)
+        if self.firstInferenceTime is not None:
+            text += ", first inference %.2fs" % self.firstInferenceTime
+        return text
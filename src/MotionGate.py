@@ -0,0 +1,146 @@
+# -----------------------------------------------------------
+# MotionGate Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import cv2
+import numpy as np
+
+# MotionGate class
+#
+# This class is a cheap change detector placed in front of the analysis:
+# every frame is shrunk, blurred and compared with the last analyzed one.
+# - if nothing moved, the analysis can be skipped and its previous result reused
+# - if only a part of the frame moved, it returns the changed regions
+#   (in full resolution), so the detection can be limited to them
+# The reference frame is updated only when a change is reported, so a slow
+# change (e.g. a face turning slowly) adds up until it's detected.
+#
+# How to use it?
+# 1) Create an instance of the class:       g = MotionGate()
+# 2) Check every frame:                     changed, regions = g.check(frame)
+# 3) Analyze only if changed, only in regions (or everywhere if regions is None)
+class MotionGate:
+
+    # Constructor
+    #
+    # Parameters:
+    # width:        the width of the shrunk frame compared (Default: 160)
+    # threshold:    the min gray level difference of a changed pixel (Default: 25)
+    # minChanged:   the min fraction of changed pixels to report a change (Default: 0.002)
+    # maxRegions:   the max fraction of the frame covered by the regions: above it,
+    #               the whole frame is analyzed (Default: 0.5)
+    # margin:       the margin added around every region, as a fraction of its size (Default: 0.5)
+    # refreshEvery: the max number of skipped frames in a row (Default: 50)
+    def __init__(self, width = 160, threshold = 25, minChanged = 0.002, maxRegions = 0.5, margin = 0.5, refreshEvery = 50):
+        self.width = width
+        self.threshold = threshold
+        self.minChanged = minChanged
+        self.maxRegions = maxRegions
+        self.margin = margin
+        self.refreshEvery = refreshEvery
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+        self.skipped = 0            # number of frames reported as unchanged
+        self.checked = 0            # number of checked frames
+        self.reset()
+        return
+
+    # Forget the reference frame (the next frame is reported as changed)
+    def reset(self):
+        self.reference = None
+        self.shape = None
+        self.skippedInRow = 0
+        return
+
+    # Shrink and blur a frame
+    def shrink(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, int(round(height * self.width / float(width)))))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    # Check if a frame changed since the last analyzed one
+    #
+    # Parameters:
+    # frame: the BGR frame
+    #
+    # Return: the (changed, regions) couple: regions is the list of the (x, y, w, h)
+    #         changed regions, or None if the whole frame must be analyzed
+    def check(self, frame):
+        self.checked += 1
+        small = self.shrink(frame)
+        if self.reference is None or frame.shape != self.shape or self.skippedInRow >= self.refreshEvery:
+            self.reference, self.shape = small, frame.shape
+            self.skippedInRow = 0
+            return True, None
+
+        mask = cv2.absdiff(small, self.reference) > self.threshold
+        if mask.mean() < self.minChanged:
+            self.skipped += 1
+            self.skippedInRow += 1
+            return False, []
+        self.reference = small
+        self.skippedInRow = 0
+
+        # Bounding boxes of the changed areas, with a margin, in full resolution
+        mask = cv2.dilate(mask.astype(np.uint8), self.kernel, iterations=2)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        scale = frame.shape[1] / float(small.shape[1])
+        height, width = frame.shape[:2]
+        regions = []
+        for x, y, w, h, _ in stats[1:count]:
+            mx, my = int(w * self.margin * scale), int(h * self.margin * scale)
+            x1, y1 = max(0, int(x * scale) - mx), max(0, int(y * scale) - my)
+            x2, y2 = min(width, int((x + w) * scale) + mx), min(height, int((y + h) * scale) + my)
+            regions.append((x1, y1, x2 - x1, y2 - y1))
+        regions = mergeRegions(regions)
+        if sum(w * h for _, _, w, h in regions) > self.maxRegions * width * height:
+            return True, None
+        return True, regions
+
+# Check if two (x, y, w, h) boxes overlap
+def overlap(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+# Merge the overlapping regions until none overlaps
+#
+# Parameters:
+# regions: the (x, y, w, h) regions
+def mergeRegions(regions):
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                if overlap(regions[i], regions[j]):
+                    a, b = regions[i], regions.pop(j)
+                    x1, y1 = min(a[0], b[0]), min(a[1], b[1])
+                    x2, y2 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+                    regions[i] = (x1, y1, x2 - x1, y2 - y1)
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+# Grow the regions to include the boxes (e.g. the faces found before) they touch,
+# so a face that moved only in part is searched for as a whole
+#
+# Parameters:
+# regions: the (x, y, w, h) changed regions
+# boxes:   the (x, y, w, h) boxes
+# shape:   the shape of the frame
+# margin:  the margin added around every box, as a fraction of its size (Default: 0.25)
+def growRegions(regions, boxes, shape, margin = 0.25):
+    height, width = shape[:2]
+    grown = list(regions)
+    for (x, y, w, h) in boxes:
+        mx, my = int(w * margin), int(h * margin)
+        box = (max(0, x - mx), max(0, y - my), min(width, x + w + mx) - max(0, x - mx), min(height, y + h + my) - max(0, y - my))
+        if any(overlap(box, region) for region in regions):
+            grown.append(box)
+    return mergeRegions(grown)
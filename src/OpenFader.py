@@ -5,14 +5,52 @@
 # Università di Genova, DIBRIS
 # -----------------------------------------------------------
 
-# Face recognition library
-import face_recognition
-# Facial expression recognition library
-from fer import FER
 # Image Widget
 from src.ImageWidget import *
+# Frame Cache
+from src.FrameCache import FrameCache
+# Face Gallery
+from src.FaceGallery import FaceGallery
+# Encoding Store
+from src.EncodingStore import EncodingStore, encodeImage
+# Face Tracker
+from src.FaceTracker import FaceTracker
+# Resolution Controller
+from src.ResolutionController import ResolutionController
+# Emotion Batcher
+from src.EmotionBatcher import EmotionBatcher, getEmotionClassifier
+# Emotion Backends
+from src.EmotionBackends import createEmotionBackend, sampleCrops
+# File Hash
+from src.FileHash import hashFile, hashBytes
+# Bulk Enrollment
+from src.BulkEnrollment import enroll
+# Lazy Model
+from src.LazyModel import LazyModel
+# Face Detectors
+from src.FaceDetectors import createDetector, calibrate
+# Motion Gate
+from src.MotionGate import MotionGate, overlap, growRegions
+# Video Reader
+from src.VideoReader import VideoReader
+# Inference Server
+from src.InferenceServer import InferenceClient
+from threading import Thread
 import cv2
 import numpy as np
+import time
+import os
+
+# Import the face recognition library (it loads its dlib models on import)
+def loadFaceRecognition():
+    import face_recognition
+    return face_recognition
+
+# Run a first face encoding on a blank image, so the next one is fast
+def warmUpFaceRecognition(face_recognition):
+    blank = np.zeros((120, 120, 3), dtype=np.uint8)
+    face_recognition.face_encodings(blank, [(10, 110, 110, 10)])
+    return
 
 # OpenFader class 
 #
@@ -24,7 +62,14 @@ import numpy as np
 class OpenFader:
 
     # Constructor
-    def __init__(self):
+    #
+    # Parameters:
+    # db_path:         the folder where the Face Recognition training dataset is saved (Default: Media/db)
+    # shareModelsWith: another OpenFader instance whose loaded models and training dataset
+    #                  are reused, e.g. one instance for every video stream (Default: None)
+    # inferenceServer: the socket path of a running InferenceServer executing the models (True: its
+    #                  default socket), so they are loaded only once for all its clients (Default: None, local models)
+    def __init__(self, db_path = "Media/db", shareModelsWith = None, inferenceServer = None):
 
         # Global variables and structure to support decisions
         self.algorithmMap = {
@@ -44,24 +89,244 @@ class OpenFader:
 
         # User could modify the following variables
         self.useCnn = True                       # boolean -> MTCNN network or OpenCV's Haar Cascade classifier
+        self.faceDetectorName = "MTCNN" if self.useCnn else "Haar"     # Face Detection backend: Haar, MTCNN, DNN or HOG
+        self.calibrateDetector = False           # boolean -> at startup, pick the fastest backend with enough recall
+        self.detectorCandidates = ["Haar", "MTCNN", "DNN", "HOG"]      # Backends compared by the calibration
+        self.recallFloor = 0.9                   # Min fraction of the MTCNN faces found by the calibrated backend
+        self.calibrationImages = ["media/_1040009.jpg", "Media/_1040009.JPG"]  # Sample images of the calibration
         self.FPS = 100                           # FramePerSecond: any number -> default is 50
-        self.RESIZE_FRAME = 1                    # Resize frame to improve speed
+        self.RESIZE_FRAME = 1                    # Initial downscale factor of the frame used by the Face Detection
+        self.latencyBudget = 0.1                 # Target analysis time of a frame (seconds): the detection resolution adapts to it
         self.width_limit = 700                   # Max image width to display it on the screen. If it's bigger, it will be resized
         self.height_limit = 444                  # Max image height to display it on the screen. If it's bigger, it will be resized
+        self.imageCacheBytes = 256 * 2**20       # Memory cap of the decoded images cache
         self.threshold = 0.6                     # Max distance (in range[0-1]) to be recognized from algorithm
+        self.detectEvery = 3                     # Run the Face Detection every N frames during the Face Recognition
+        self.topK = 1                            # Number of gallery matches computed for every face
+        self.annThreshold = None                 # Gallery size from which the faces are matched with an approximate index (None: always exact)
+        self.annStorage = "int8"                 # Storage of the approximate index encodings: float16 or int8
+        self.emotionBatchSize = 32               # Max number of faces classified in one forward pass
+        self.emotionMaxWait = 0.005              # Max time (seconds) a face waits for other faces to fill a batch
+        self.emotionBackendName = "Keras"        # Emotion classifier runtime: Keras, TFLite-float16, TFLite-int8 or OpenCV
+        self.unknownName = "Unknown"             # Name given to the faces not found in the gallery
+        self.motionGating = True                 # boolean -> skip the analysis of the video frames where nothing moved
+        self.db_path = db_path                   # Folder where the Face Recognition training dataset is saved
 
         #init some variables
-        self.fx = self.fy = 1/self.RESIZE_FRAME
+        self.resolution = ResolutionController(self.latencyBudget, 1/self.RESIZE_FRAME)
         self.result = []
+        self.GUI = None                          # no GUI until connectGUI is called (headless mode)
+        self.needToStop = False                  # set by stopAnalysis to stop an offline analysis
+        self.imageJob = 0                        # number of image analysis started (only the last one is shown)
+        self.imageCache = FrameCache(self.imageCacheBytes)
+
+        if shareModelsWith is not None:
+            # Reuse the models already loaded by the other instance: only the
+            # analysis state (frame, result, tracker...) belongs to this one
+            self.models = shareModelsWith.models
+            self.client = shareModelsWith.client
+            self.faceDetector = shareModelsWith.faceDetector
+            self.store = shareModelsWith.store
+            self.gallery = shareModelsWith.gallery
+        else:
+            # The models are loaded the first time they are needed, or in
+            # background by warmUp: creating an OpenFader instance is fast
+            if inferenceServer is None:
+                self.client = None
+            else:
+                self.client = InferenceClient(None if inferenceServer is True else inferenceServer)
+            if self.client is not None:
+                self.models = self.client.models()      # executed by the server
+            else:
+                self.models = {
+                    "FER": LazyModel("FER", self.loadFER, self.warmUpFER),
+                    "face_recognition": LazyModel("face_recognition", loadFaceRecognition, warmUpFaceRecognition)
+                }
+            self.faceDetector = self.createFaceDetector(self.faceDetectorName)
+
+            # Face Recognition Model training dataset: reload it from disk,
+            # encoding again only the images changed since the last run
+            # with an InferenceServer, the images are encoded by the server too
+            encoder = self.client.encodeImage if self.client is not None else encodeImage
+            self.store = EncodingStore(self.db_path, encoder=encoder)
+            self.store.refresh()
+            self.gallery = FaceGallery(annThreshold=self.annThreshold, annOptions={"storage": self.annStorage})
+            self.gallery.load(self.store.encodings, self.store.names, self.store.revision)
+
+        self.matches = []                        # Top-k (name, distance) gallery matches of every recognized face
+        self.track_ids = []                      # Persistent id of every recognized face
+        self.frameCount = 0                      # Frames analyzed by the Face Recognition
+        self.tracker = FaceTracker()             # Follow the faces, so only the new ones need to be recognized
+        self.motionGate = MotionGate()           # Find the video frames (or regions) that changed since the last analysis
+        self.detectorThread = None               # Background warm-up (or calibration) of the face detector
+        self.calibration = None                  # Results of the last face detector calibration
+        self.detectorError = None                # Why the last face detector warm-up or calibration failed (shown by modelReport)
+        self.emotionBackendError = None          # Why the emotion backend was not available (shown by modelReport)
+
+        return
+    
+    # Load the FER models: the face detector and the emotion classifier
+    #
+    # Return: the (detector, emotionBatcher) couple
+    def loadFER(self):
+        from fer import FER     # imported here: it loads TensorFlow
+        detector = FER(mtcnn=self.useCnn)
+        backend = self.createEmotionBackend(detector) if self.emotionBackendName != "Keras" else None
+        # Classify the emotions in batches (None if this FER version doesn't expose its classifier)
+        emotionBatcher = EmotionBatcher.fromFER(detector, self.emotionBatchSize, self.emotionMaxWait,
+                                                backend.predict if backend is not None else None)
+        return detector, emotionBatcher
+
+    # Create the emotion classifier backend (the int8 quantization is calibrated
+    # on the faces of the calibration images, found only if the model is exported)
+    #
+    # Parameters:
+    # detector: the FER instance
+    #
+    # Return: the loaded backend, or None to use the Keras model of FER
+    def createEmotionBackend(self, detector):
+        classifier = getEmotionClassifier(detector)
+        if classifier is None:
+            return None
+        paths = [path for path in self.calibrationImages if os.path.isfile(path)]
+        def samples():
+            frames = [loadImage(path, self.width_limit, self.height_limit, self.imageCache) for path in paths]
+            return sampleCrops(detector, frames, classifier.input_shape[1:3][::-1])
+        try:
+            # the calibration set is identified by what makes its crops: the images, their size and the detector
+            calibration = hashBytes(repr(([hashFile(path) for path in paths], self.width_limit,
+                                          self.height_limit, self.useCnn)).encode())[:12]
+            backend = createEmotionBackend(self.emotionBackendName, classifier, samples=samples, calibration=calibration)
+            backend.load()
+        except Exception as e:
+            self.emotionBackendError = "%s not available (%s)" % (self.emotionBackendName, e)
+            self.emotionBackendName = "Keras"
+            return None
+        return backend
+
+    # Run a first detection and classification on a blank frame, so the next ones are fast
+    def warmUpFER(self, models):
+        detector, emotionBatcher = models
+        blank = np.zeros((240, 320, 3), dtype=np.uint8)
+        detector.find_faces(blank)
+        if emotionBatcher is not None:
+            emotionBatcher.analyze(blank, [(120, 80, 80, 80)])
+        return
+
+    # The FER instance (loaded on first use, None with an InferenceServer)
+    @property
+    def detector(self):
+        return self.models["FER"].get()[0]
 
-        #init FER model
-        self.detector = FER(mtcnn=self.useCnn) 
+    # The emotion batcher (loaded on first use, None if not available)
+    @property
+    def emotionBatcher(self):
+        return self.models["FER"].get()[1]
 
-        self.db_encodings = []
-        self.db_names = []
+    # The face recognition library (loaded on first use)
+    @property
+    def face_recognition(self):
+        return self.models["face_recognition"].get()
 
+    # Load and warm up in background the models needed by some algorithms
+    #
+    # Parameters:
+    # algorithms: the algorithms that will be executed (Default: None, all of them)
+    def warmUp(self, algorithms = None):
+        if algorithms is None:
+            algorithms = list(self.algorithmMap.keys())
+        names = ["FER"]
+        if "Recognition" in algorithms:
+            names.append("face_recognition")
+        for name in names:
+            self.models[name].startWarmUp()
+        if self.detectorThread is None:
+            target = self.calibrateFaceDetector if self.calibrateDetector else self.warmUpFaceDetector
+            self.detectorThread = Thread(target=target, args=())
+            self.detectorThread.daemon = True
+            self.detectorThread.start()
         return
-    
+
+    # Check if the background warm-up is over
+    def isWarm(self):
+        detectorReady = self.detectorThread is None or not self.detectorThread.is_alive()
+        return detectorReady and all(model.isReady() for model in self.models.values())
+
+    # Report of the load and first inference times of the models
+    #
+    # Return: a list of text lines
+    def modelReport(self):
+        lines = [model.report() for model in self.models.values()]
+        lines.append("Face detector: " + self.faceDetectorName)
+        if self.detectorError is not None:
+            lines.append("  " + self.detectorError)
+        if self.models["FER"].isLoaded() and self.client is None:
+            lines.append("Emotion backend: " + self.emotionBackendName)
+            if self.emotionBackendError is not None:
+                lines.append("  " + self.emotionBackendError)
+        if self.calibration is not None:
+            for name, r in self.calibration.items():
+                if "error" in r:
+                    lines.append("  %s: not available" % name)
+                else:
+                    lines.append("  %s: %.1f ms/frame, recall %.2f" % (name, r["ms"], r["recall"]))
+        return lines
+
+    # Create a Face Detection backend
+    #
+    # Parameters:
+    # name: the name of the backend (Haar, MTCNN, DNN or HOG)
+    def createFaceDetector(self, name):
+        if self.client is not None:
+            return self.client.detector(name)       # executed by the server
+        if name == "MTCNN" and self.useCnn:
+            return createDetector(name, getFER=lambda: self.detector)     # reuse the FER network
+        return createDetector(name)
+
+    # Change the Face Detection backend
+    #
+    # Parameters:
+    # name: the name of the backend (Haar, MTCNN, DNN or HOG)
+    def setFaceDetector(self, name):
+        self.faceDetector = self.createFaceDetector(name)
+        self.faceDetectorName = name
+        return
+
+    # Load the face detector model, running a first detection on a blank frame
+    def warmUpFaceDetector(self):
+        try:
+            self.faceDetector.detect(np.zeros((240, 320, 3), dtype=np.uint8))
+            self.detectorError = None
+        except Exception as e:
+            self.detectorError = "warm-up failed (%s)" % e
+        return
+
+    # Measure the Face Detection backends on sample frames and use the fastest
+    # one finding at least recallFloor of the faces found by MTCNN
+    #
+    # Parameters:
+    # frames: the sample BGR frames (Default: None, the calibration images)
+    #
+    # Return: the (name, results) couple (see FaceDetectors.calibrate)
+    def calibrateFaceDetector(self, frames = None):
+        if frames is None:
+            frames = [loadImage(path, self.width_limit, self.height_limit, self.imageCache)
+                      for path in self.calibrationImages if os.path.isfile(path)]
+        if len(frames) == 0:
+            self.warmUpFaceDetector()
+            return self.faceDetectorName, {}
+        detectors = {name: self.createFaceDetector(name) for name in self.detectorCandidates}
+        try:
+            name, self.calibration = calibrate(detectors, frames, "MTCNN", self.recallFloor)
+        except Exception as e:
+            self.detectorError = "calibration failed (%s)" % e
+            self.warmUpFaceDetector()
+            return self.faceDetectorName, {}
+        self.faceDetector = detectors[name]
+        self.faceDetectorName = name
+        self.detectorError = None
+        return name, self.calibration
+
     # Connect the external GUI with the OpenFader class
     def connectGUI(self, gui):
         # Guest User Interface
@@ -74,12 +339,27 @@ class OpenFader:
     # path_image:   the path to the image
     # name:         the name of the individual in the image
     def addTrainImage(self, path_image, name):
-        temp = face_recognition.load_image_file(path_image)
-        temp_encoding = face_recognition.face_encodings(temp)[0]
-        self.db_encodings.append(temp_encoding)
-        self.db_names.append(name)
+        temp_encoding = self.store.add(path_image, name)       # encode it (only if new or changed) and save it on disk
+        if temp_encoding is None:
+            self.putText("FACE RECOGNITION", "No face found in " + path_image)
+            return
+        self.gallery.load(self.store.encodings, self.store.names, self.store.revision)
         return
 
+    # Add all the images of a folder (or of a .csv manifest) to the training dataset,
+    # encoding them in parallel. The images without any face are skipped.
+    #
+    # Parameters:
+    # source:   the folder or the manifest
+    # workers:  the number of worker processes (Default: None, one for each core)
+    # progress: the function called as progress(done, total, rate) (Default: None)
+    #
+    # Return: the enrollment summary
+    def enrollDirectory(self, source, workers = None, progress = None):
+        summary = enroll(source, self.store, workers, progress)
+        self.gallery.load(self.store.encodings, self.store.names, self.store.revision)
+        return summary
+
     # Update the active frame
     #
     # Parameters:
@@ -90,10 +370,19 @@ class OpenFader:
 
     # Put a text on the GUI terminal
     def putText(self, mode, text):
+        if self.GUI is None:
+            return
         self.GUI.printMode(mode)
         self.GUI.printResult(text)
         return
 
+    # Clean the GUI terminal
+    def cleanTerminal(self):
+        if self.GUI is None:
+            return
+        self.GUI.cleanTerminal()
+        return
+
     # Add a rectangle on the displayed GUI image / frame
     def printRectangle(self, frame, coordinates, fontColor = (255,255,255), lineType = 4, polaroid = False):
         (x, y, w, h) = coordinates
@@ -119,7 +408,7 @@ class OpenFader:
     # and print on GUI terminal the best found emotion
     def facialExpression(self, frame):
         self.updateFrame(frame)             # update the active frame
-        self.GUI.cleanTerminal()            # clean the GUI terminal
+        self.cleanTerminal()                # clean the GUI terminal
         for p in self.result:
             bestEmotion = self.getBestEmotion(p['emotions'])            # get best emotion
             self.printRectangle(frame, p['box'])                        # print the dection rectangle on the active frame
@@ -137,9 +426,8 @@ class OpenFader:
     # and print on GUI terminal the name of the recognized individual
     def faceRecognition(self, frame):
         self.updateFrame(frame)             # update the active frame
-        self.GUI.cleanTerminal()            # clean the GUI terminal
+        self.cleanTerminal()                # clean the GUI terminal
         for coord, name in zip(self.result, self.face_names):
-            self.peopleNotFound = False
             self.printRectangle(frame, coord)             # print the dection rectangle on the active frame
             self.putText("FACE RECOGNITION", name)        # print the name of the recognized individual on the GUI terminal
         return
@@ -162,7 +450,24 @@ class OpenFader:
     # Parameters:
     # frame: the frame to analyze
     def detectFaces(self, frame):
-        self.result = self.detector.find_faces(frame)       # Run the Face Detection Algorithm
+        start = time.time()
+        self.result = self.resolution.detect(frame, self.faceDetector.detect)     # Run the Face Detection Algorithm
+        self.resolution.report(time.time() - start)
+        return
+
+    # Detect the faces only in the changed regions of a frame,
+    # keeping the faces found before where nothing moved
+    #
+    # Parameters:
+    # frame:   the frame to analyze
+    # regions: the (x, y, w, h) changed regions
+    def detectFacesInRegions(self, frame, regions):
+        regions = growRegions(regions, self.result, frame.shape)
+        boxes = [box for box in self.result if not any(overlap(box, region) for region in regions)]
+        for (x, y, w, h) in regions:
+            found = self.resolution.detect(frame[y:y + h, x:x + w], self.faceDetector.detect)
+            boxes.extend((bx + x, by + y, bw, bh) for (bx, by, bw, bh) in found)
+        self.result = boxes
         return
 
     # Detect the expressions of the faces in a frame
@@ -170,7 +475,13 @@ class OpenFader:
     # Parameters:
     # frame: the frame to analyze
     def findExpressions(self, frame):
-        self.result = self.detector.detect_emotions(frame)  # Run the Facial Expression Algorithm
+        if self.emotionBatcher is None:
+            self.result = self.detector.detect_emotions(frame)  # Run the Facial Expression Algorithm
+            return
+        start = time.time()
+        boxes = self.resolution.detect(frame, self.faceDetector.detect)     # Run the Face Detection Algorithm
+        self.result = self.emotionBatcher.analyze(frame, boxes)             # Run the Facial Expression Algorithm (batched)
+        self.resolution.report(time.time() - start)
         return
 
     # Recognize the people in a frame
@@ -178,24 +489,29 @@ class OpenFader:
     # Parameters:
     # frame: the frame to analyze
     def recognizePeople(self, frame):
-        if self.peopleNotFound:             # only if I haven't found anybody
-            small_frame = cv2.resize(frame, (0, 0), fx=self.fx, fy=self.fy)
-            rgb_small_frame = small_frame[:, :, ::-1]
-            temp_result = self.detector.find_faces(frame)           # Run the Face Detection Algorithm
-            temp = self.convertBox(temp_result)
-            temp_names = []
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, temp)    # Run the Face Recognition Algorithm
-            for face_encoding in face_encodings:
-                face_distances = face_recognition.face_distance(self.db_encodings, face_encoding)   # Compute the Recognition Error
-                if len(face_distances) > 0 and min(face_distances) < self.threshold:
-                    best_match_index = np.argmin(face_distances)
-                    name = self.db_names[best_match_index]
-                    temp_names.append(name)     # Add the name of the found individual in the result
-
-            self.result = temp_result
-            self.face_names = temp_names
+        self.frameCount += 1
+        if (self.frameCount - 1) % self.detectEvery == 0:
+            start = time.time()
+            detections = self.resolution.detect(frame, self.faceDetector.detect)    # Run the Face Detection Algorithm (downscaled)
+            self.tracker.update(detections, frame)                  # Follow the faces across the frames
+            # Run the Face Recognition Algorithm only on the new or still unknown faces
+            pending = self.tracker.toIdentify(self.frameCount)
+            if len(pending) > 0:
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                temp = self.convertBox([t.box for t in pending])       # full resolution boxes on the full resolution frame
+                face_encodings = self.face_recognition.face_encodings(rgb_frame, temp)
+                # Score all the faces against the whole gallery at once
+                for track, faceMatches in zip(pending, self.gallery.match(face_encodings, self.topK, self.threshold)):
+                    track.identify(faceMatches, self.frameCount)
+            self.resolution.report(time.time() - start)
         else:
-            self.detectFaces(frame)           # If I've already found someone, run the Face Detection Algorithm
+            self.tracker.predict(frame)
+
+        tracks = self.tracker.visibleTracks()
+        temp_names = [t.name if t.name is not None else self.unknownName for t in tracks]
+        self.matches = [t.matches for t in tracks]
+        self.track_ids = [t.id for t in tracks]
+        self.result, self.face_names = [t.box for t in tracks], temp_names     # read by the display stage: update them together
         return
 
     # Run analisys on an image
@@ -206,15 +522,40 @@ class OpenFader:
     # target_function:          the function to print the detection rectangle on the image
     def runImageAnalysis(self, src, target_analysis_function, target_function):
 
-        # Check image
-        src = checkImage(src, self.width_limit, self.height_limit)
-        # Read image
-        frame = cv2.imread(src)
-        # Make analysis
-        target_analysis_function(frame)
-        # Print rectangle and/or texts
-        target_function(frame)
-        # Show image on GUI
+        # Read image (decoded and resized in memory, once for every content and size)
+        frame = loadImage(src, self.width_limit, self.height_limit, self.imageCache).copy()
+        if self.GUI is None:
+            target_analysis_function(frame)
+            target_function(frame)
+            return
+        # With a GUI, the analysis runs in its own thread (it may wait for the
+        # models being loaded) and the Tk thread shows the image when it's done
+        self.imageJob += 1
+        job = self.imageJob
+        def analyze():
+            try:
+                target_analysis_function(frame)     # Make analysis
+                target_function(frame)              # Print rectangle and/or texts
+            except Exception as e:
+                self.GUI.printResult("\nError: " + str(e))
+        thread = Thread(target=analyze, args=())
+        thread.daemon = True
+        thread.start()
+        self.GUI.ROOT.after(50, self.showImageAnalysis, thread, job, frame)
+        return
+
+    # Show the analyzed image on the GUI when its analysis is over (executed on the Tk thread)
+    #
+    # Parameters:
+    # thread: the thread of the analysis
+    # job:    the number of the analysis (the image is not shown if a newer one was started)
+    # frame:  the analyzed image
+    def showImageAnalysis(self, thread, job, frame):
+        if job != self.imageJob:
+            return
+        if thread.is_alive():
+            self.GUI.ROOT.after(50, self.showImageAnalysis, thread, job, frame)
+            return
         self.GUI.analyzePhoto(frame)
         return
 
@@ -224,19 +565,95 @@ class OpenFader:
         self.frame = []
         self.result = []
         self.face_names = []
+        self.matches = []
+        self.track_ids = []
+        self.frameCount = 0
+        self.tracker.reset()
+        self.motionGate.reset()
         return
 
+    # Describe the result of the last analysis with plain Python types
+    # (e.g. to save it as JSON)
+    #
+    # Parameters:
+    # selectedAlgorithm: the executed analysis (Detection, Expression or Recognition)
+    #
+    # Return: a list with a dictionary for every found face
+    def describeResult(self, selectedAlgorithm):
+        faces = []
+        for i, r in enumerate(self.result):
+            box = r['box'] if selectedAlgorithm == "Expression" else r
+            face = {"box": [int(v) for v in box]}
+            if selectedAlgorithm == "Expression":
+                face["emotions"] = {k: float(v) for k, v in r['emotions'].items()}
+                face["emotion"] = self.getBestEmotion(r['emotions'])
+            elif selectedAlgorithm == "Recognition":
+                face["name"] = self.face_names[i] if i < len(self.face_names) else self.unknownName
+                face["matches"] = self.matches[i] if i < len(self.matches) else []
+                face["track"] = self.track_ids[i] if i < len(self.track_ids) else None
+            faces.append(face)
+        return faces
+
     # Run analisys on a video
     #
     # Parameters:
     # target_analysis_function: the function with the analysis to be executed
-    def runVideoAnalysis(self, target_analysis_function):
-
-        if len(self.frame) > 0:    # only if there is an active frame
-            target_analysis_function(self.frame)     
+    # frame:                    the frame to analyze (Default: None, the active frame)
+    def runVideoAnalysis(self, target_analysis_function, frame = None):
+
+        if frame is None:
+            frame = self.frame
+        if len(frame) > 0:    # only if there is an active frame
+            if self.motionGating:
+                changed, regions = self.motionGate.check(frame)
+                if not changed:
+                    return      # nothing moved: keep the previous result
+                if regions is not None and target_analysis_function == self.detectFaces:
+                    self.detectFacesInRegions(frame, regions)
+                    return
+            target_analysis_function(frame)     
         
         return
 
+    # Run analisys on every frame of a video, as fast as possible and without
+    # displaying it, until the end of the video (or until stopAnalysis is called)
+    #
+    # Parameters:
+    # path_to_source:    the path to the video
+    # selectedAlgorithm: the analysis to be executed (Detection, Expression or Recognition)
+    # every:             analyze one frame every `every` frames, the others are skipped without decoding (Default: 1)
+    # callback:          the function called after every analyzed frame as callback(index, timestamp_ms, frame),
+    #                    e.g. to save self.describeResult(selectedAlgorithm) (Default: None)
+    # height_limit:      the max height of the analyzed frames (Default: None, the original size)
+    #
+    # Return: a summary with the read and analyzed frames, the seconds and the analyzed frames per second
+    def runOfflineAnalysis(self, path_to_source, selectedAlgorithm, every = 1, callback = None, height_limit = None):
+        self.initAgain()
+        self.needToStop = False
+        target_analysis_function = self.algorithmMap[selectedAlgorithm]["target_analysis_function"]
+        capture = VideoReader(path_to_source, height_limit)
+        if not capture.isOpened():
+            raise IOError("Cannot open the video " + path_to_source)
+
+        analyzed = 0
+        start = time.time()
+        for index, timestamp, frame in capture.frames(step=every):
+            if self.needToStop:
+                break
+            target_analysis_function(frame)
+            analyzed += 1
+            if callback is not None:
+                callback(index, timestamp, frame)
+        capture.release()
+        seconds = time.time() - start
+        return {
+            "frames": capture.index,
+            "analyzed": analyzed,
+            "seconds": seconds,
+            "fps": analyzed / seconds if seconds > 0 else 0.0,
+            "stopped": self.needToStop
+        }
+
     # Run analisys on the current media
     #
     # Parameters:
@@ -247,8 +664,6 @@ class OpenFader:
 
         self.initAgain()
 
-        self.peopleNotFound = True
-        
         # Set target analiysis function and target function
         target_analysis_function = self.algorithmMap[selectedAlgorithm]["target_analysis_function"]
         target_function = self.algorithmMap[selectedAlgorithm]["target_function"]
@@ -260,16 +675,17 @@ class OpenFader:
             self.runImageAnalysis(selectedSource, target_analysis_function, target_function)
         else:
             if source == 'video':
-                # Insert here the path to the video
-                path_to_video = resizeVideo(path_to_source)
-                selectedSource = path_to_video
+                # Insert here the path to the video (its frames are resized while decoding)
+                selectedSource = path_to_source
+                height_limit = self.height_limit
                 interval = 1000
             else:
                 # Webcam
                 selectedSource = 0
+                height_limit = None
                 interval = 200
 
             # Create the thread able to manage the video stream during the analisys
-            self.videoStreamObject = self.GUI.openSource(selectedSource, target_function)
+            self.videoStreamObject = self.GUI.openSource(selectedSource, target_function, height_limit)
             self.GUI.analyze(self.runVideoAnalysis, target_analysis_function, interval)
         return
@@ -0,0 +1,105 @@
+# -----------------------------------------------------------
+# ResolutionController Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import cv2
+import math
+
+# ResolutionController class
+#
+# This class runs the face detection on a downscaled copy of the frame,
+# maps the found boxes back to the full resolution, and adapts the scale
+# at runtime so that the analysis of a frame fits in a latency budget:
+# - too slow: the frame is downscaled more
+# - fast enough: the scale grows back, up to the full resolution
+#
+# How to use it?
+# 1) Create an instance of the class:       r = ResolutionController(budget = 0.1)
+# 2) Detect the faces:                      boxes = r.detect(frame, detector.find_faces)
+# 3) Report the time of the whole analysis: r.report(seconds)
+class ResolutionController:
+
+    # Constructor
+    #
+    # Parameters:
+    # budget:    the target analysis time of a frame, in seconds (Default: 0.1)
+    # scale:     the initial scale of the detection frame (Default: 1, full resolution)
+    # minScale:  the smallest allowed scale (Default: 0.25)
+    # maxScale:  the biggest allowed scale (Default: 1)
+    # smoothing: the weight of the last measure in the latency average (Default: 0.3)
+    # adaptive:  if False, the scale never changes (Default: True)
+    def __init__(self, budget = 0.1, scale = 1.0, minScale = 0.25, maxScale = 1.0, smoothing = 0.3, adaptive = True):
+        self.budget = budget
+        self.minScale = minScale
+        self.maxScale = maxScale
+        self.scale = min(maxScale, max(minScale, scale))
+        self.smoothing = smoothing
+        self.adaptive = adaptive
+        self.latency = None         # moving average of the analysis time
+        return
+
+    # Downscale a frame to the current scale
+    #
+    # Parameters:
+    # frame: the full resolution frame
+    #
+    # Return: the (downscaled frame, used scale) couple
+    def resize(self, frame):
+        scale = self.scale
+        if scale >= 1:
+            return frame, 1.0
+        small = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return small, scale
+
+    # Map (x, y, w, h) boxes found on a downscaled frame back to the full resolution
+    #
+    # Parameters:
+    # boxes: the boxes on the downscaled frame
+    # scale: the scale of the downscaled frame
+    # shape: the shape of the full resolution frame
+    def toFullResolution(self, boxes, scale, shape):
+        height, width = shape[:2]
+        result = []
+        for (x, y, w, h) in boxes:
+            x0 = max(0, int(round(x / scale)))
+            y0 = max(0, int(round(y / scale)))
+            x1 = min(width, int(round((x + w) / scale)))
+            y1 = min(height, int(round((y + h) / scale)))
+            result.append((x0, y0, x1 - x0, y1 - y0))
+        return result
+
+    # Detect the faces on the downscaled frame
+    #
+    # Parameters:
+    # frame:  the full resolution frame
+    # detect: the detection function, returning (x, y, w, h) boxes
+    #
+    # Return: the boxes of the faces, in full resolution coordinates
+    def detect(self, frame, detect):
+        small, scale = self.resize(frame)
+        boxes = detect(small)
+        if scale == 1.0:
+            return [tuple(int(v) for v in box) for box in boxes]
+        return self.toFullResolution(boxes, scale, frame.shape)
+
+    # Report the measured analysis time of a frame and adapt the scale
+    #
+    # Parameters:
+    # seconds: the analysis time of the last frame
+    def report(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = self.smoothing * seconds + (1 - self.smoothing) * self.latency
+        if not self.adaptive or self.latency <= 0:
+            return
+        # the detection time grows about with the pixels, i.e. with scale^2
+        factor = math.sqrt(self.budget / self.latency)
+        if 0.9 <= factor <= 1.1:
+            return                  # close enough to the budget: keep the scale stable
+        factor = min(1.25, max(0.8, factor))
+        self.scale = min(self.maxScale, max(self.minScale, self.scale * factor))
+        return
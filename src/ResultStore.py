@@ -0,0 +1,361 @@
+# -----------------------------------------------------------
+# ResultStore Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Emotion Batcher
+from src.EmotionBatcher import EMOTION_LABELS
+from threading import Lock
+import numpy as np
+import json
+import os
+import re
+
+# One row for every found face
+FACE_DTYPE = np.dtype([
+    ("source", np.int16),           # index in the sources table
+    ("frame", np.int64),
+    ("timestamp", np.float64),      # milliseconds from the start of the source
+    ("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32),
+    ("identity", np.int32),         # index in the identities table (-1: not recognized)
+    ("distance", np.float16),       # gallery distance of the identity (nan: not recognized)
+    ("track", np.int32),            # id of the face track (-1: not tracked)
+    ("emotions", np.float16, (len(EMOTION_LABELS),))     # scores in EMOTION_LABELS order (nan: not analyzed)
+])
+
+# One row for every analyzed frame (also the ones without faces)
+FRAME_DTYPE = np.dtype([
+    ("source", np.int16),
+    ("frame", np.int64),
+    ("timestamp", np.float64),
+    ("faces", np.uint16)
+])
+
+# ResultStore class
+#
+# This class records the analysis results of long videos in a compact, columnar way:
+# - the faces and the frames are appended to NumPy structured arrays
+# - every `chunkSize` faces (or frames), the arrays are sorted by frame and
+#   written as a chunk of .npy files, read back memory-mapped
+# - index.json keeps the sources and identities tables and, for every chunk,
+#   its frame and time range and the identities it contains, so a query reads
+#   only the chunks that may answer it
+#
+# How to use it?
+# 1) Create an instance of the class:       s = ResultStore("Media/results/video")
+# 2) Record the analysis of every frame:    s.addResult(fader, "Recognition", index, timestamp)
+# 3) Write the last chunk:                  s.close()
+# 4) Query it:                              s.framesWithIdentity("john_smith")
+class ResultStore:
+
+    INDEX_FILE = "index.json"
+
+    # Constructor
+    #
+    # Parameters:
+    # directory: the folder of the store (created if it doesn't exist)
+    # chunkSize: the number of faces of a chunk (Default: 65536)
+    # overwrite: if True, the results already in the folder are deleted (Default: False, new results are appended)
+    def __init__(self, directory, chunkSize = 65536, overwrite = False):
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        if overwrite:
+            self.clear()
+
+        self.sources = []
+        self.identities = []
+        self.chunks = []            # {faces, frames, sources, firstFrame, lastFrame, firstTime, lastTime, identities}
+        index_path = os.path.join(directory, self.INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            self.sources = index["sources"]
+            self.identities = index["identities"]
+            self.chunks = index["chunks"]
+        self.sourceIds = {name: i for i, name in enumerate(self.sources)}
+        self.identityIds = {name: i for i, name in enumerate(self.identities)}
+
+        self.faceBuffer = np.empty(chunkSize, dtype=FACE_DTYPE)
+        self.frameBuffer = np.empty(chunkSize, dtype=FRAME_DTYPE)
+        self.faceCount = 0
+        self.frameCount = 0
+        return
+
+    # Delete the index and the chunks in the folder
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name == self.INDEX_FILE or re.match(r"(faces|frames)-\d{6}\.npy$", name):
+                os.remove(os.path.join(self.directory, name))
+        return
+
+    # Id of a name in a table, added if new
+    def tableId(self, table, ids, name):
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(table)
+            table.append(name)
+        return i
+
+    # Add the results of an analyzed frame
+    #
+    # Parameters:
+    # frame:      the frame number
+    # timestamp:  the frame time in milliseconds
+    # boxes:      the (x, y, w, h) boxes of the faces
+    # identities: the names of the faces, None for the not recognized ones (Default: None)
+    # distances:  the gallery distances of the names (Default: None)
+    # tracks:     the track ids of the faces (Default: None)
+    # emotions:   the {label: score} emotions of the faces (Default: None)
+    # source:     the name of the source, e.g. the video path (Default: "")
+    def add(self, frame, timestamp, boxes, identities = None, distances = None, tracks = None, emotions = None, source = ""):
+        with self.lock:
+            sourceId = self.tableId(self.sources, self.sourceIds, source)
+            if self.frameCount == self.chunkSize or self.faceCount + len(boxes) > self.chunkSize:
+                self.writeChunk()       # the faces of a frame are kept in the chunk of the frame
+            self.frameBuffer[self.frameCount] = (sourceId, frame, timestamp, len(boxes))
+            self.frameCount += 1
+
+            for i, box in enumerate(boxes):
+                if self.faceCount == self.chunkSize:
+                    self.writeChunk()   # only if a frame has more than chunkSize faces
+                name = identities[i] if identities is not None else None
+                identity = -1 if name is None else self.tableId(self.identities, self.identityIds, name)
+                distance = distances[i] if distances is not None and distances[i] is not None else np.nan
+                track = tracks[i] if tracks is not None and tracks[i] is not None else -1
+                scores = [emotions[i].get(label, np.nan) for label in EMOTION_LABELS] if emotions is not None else np.nan
+                row = self.faceBuffer[self.faceCount]
+                row["source"], row["frame"], row["timestamp"] = sourceId, frame, timestamp
+                row["x"], row["y"], row["w"], row["h"] = box
+                row["identity"], row["distance"], row["track"] = identity, distance, track
+                row["emotions"] = scores
+                self.faceCount += 1
+        return
+
+    # Add the result of the last analysis of an OpenFader instance
+    #
+    # Parameters:
+    # fader:     the OpenFader instance
+    # algorithm: the executed analysis (Detection, Expression or Recognition)
+    # frame:     the frame number
+    # timestamp: the frame time in milliseconds
+    # source:    the name of the source (Default: "")
+    def addResult(self, fader, algorithm, frame, timestamp, source = ""):
+        if algorithm == "Expression":
+            result = list(fader.result)
+            self.add(frame, timestamp, [r['box'] for r in result], emotions=[r['emotions'] for r in result], source=source)
+        elif algorithm == "Recognition":
+            boxes, names = fader.result, fader.face_names
+            matches = fader.matches if len(fader.matches) == len(boxes) else [[]] * len(boxes)
+            tracks = fader.track_ids if len(fader.track_ids) == len(boxes) else None
+            identities = [None if name == fader.unknownName else name for name in names]
+            distances = [m[0][1] if len(m) > 0 else None for m in matches]
+            self.add(frame, timestamp, boxes, identities, distances, tracks, source=source)
+        else:
+            self.add(frame, timestamp, fader.result, source=source)
+        return
+
+    # Add a record of the HeadlessRunner (a dictionary of plain Python types)
+    #
+    # Parameters:
+    # record:      the record
+    # unknownName: the name given to the faces not found in the gallery, by the
+    #              OpenFader instance that made the record (Default: "Unknown")
+    def addRecord(self, record, unknownName = "Unknown"):
+        if "error" in record:
+            return
+        faces = record["faces"]
+        identities = [f["name"] if f.get("name") not in (None, unknownName) else None for f in faces]
+        distances = [f["matches"][0][1] if len(f.get("matches", [])) > 0 else None for f in faces]
+        emotions = [f["emotions"] for f in faces] if record["algorithm"] == "Expression" else None
+        frame = record["frame"] if record["frame"] is not None else 0
+        timestamp = record["timestamp"] if record["timestamp"] is not None else 0.0
+        self.add(frame, timestamp, [f["box"] for f in faces], identities, distances,
+                 [f.get("track") for f in faces], emotions, record["source"])
+        return
+
+    # Write the buffered rows as a new chunk
+    def writeChunk(self):
+        if self.faceCount == 0 and self.frameCount == 0:
+            return
+        faces = self.faceBuffer[:self.faceCount]
+        faces = faces[np.lexsort((faces["frame"], faces["source"]))]        # sorted by (source, frame)
+        frames = self.frameBuffer[:self.frameCount]
+        frames = frames[np.lexsort((frames["frame"], frames["source"]))]
+        number = len(self.chunks)
+        # the ranges cover the rows of both the arrays
+        frameNumbers = np.concatenate([frames["frame"], faces["frame"]])
+        times = np.concatenate([frames["timestamp"], faces["timestamp"]])
+        chunk = {
+            "faces": "faces-%06d.npy" % number,
+            "frames": "frames-%06d.npy" % number,
+            "sources": sorted(set(int(s) for s in frames["source"]) | set(int(s) for s in faces["source"])),
+            "firstFrame": int(frameNumbers.min()),
+            "lastFrame": int(frameNumbers.max()),
+            "firstTime": float(times.min()),
+            "lastTime": float(times.max()),
+            "identities": sorted(set(int(i) for i in np.unique(faces["identity"]) if i >= 0))
+        }
+        np.save(os.path.join(self.directory, chunk["faces"]), faces)
+        np.save(os.path.join(self.directory, chunk["frames"]), frames)
+        self.chunks.append(chunk)
+        self.faceCount = 0
+        self.frameCount = 0
+        self.writeIndex()
+        return
+
+    # Write the index on disk (atomically)
+    def writeIndex(self):
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"sources": self.sources, "identities": self.identities, "chunks": self.chunks}, f)
+        os.replace(index_path + ".tmp", index_path)
+        return
+
+    # Write the buffered rows on disk
+    def flush(self):
+        with self.lock:
+            self.writeChunk()
+        return
+
+    # Write the buffered rows on disk (the store can still be queried)
+    def close(self):
+        self.flush()
+        return
+
+    # Read a chunk file (memory-mapped)
+    def load(self, name):
+        return np.load(os.path.join(self.directory, name), mmap_mode='r')
+
+    # Copy of the faces and frames not yet written on disk
+    def buffered(self):
+        with self.lock:
+            return self.faceBuffer[:self.faceCount].copy(), self.frameBuffer[:self.frameCount].copy()
+
+    # Join the parts of a query result
+    def join(self, parts, dtype):
+        return np.concatenate(parts) if len(parts) > 0 else np.empty(0, dtype=dtype)
+
+    # The chunks that may contain some frames, times or identities
+    def selectChunks(self, source = None, firstFrame = None, lastFrame = None, firstTime = None, lastTime = None, identity = None):
+        sourceId = None if source is None else self.sourceIds.get(source, -2)
+        for chunk in self.chunks:
+            if chunk["firstFrame"] is None:
+                continue
+            if sourceId is not None and sourceId not in chunk["sources"]:
+                continue
+            if identity is not None and identity not in chunk["identities"]:
+                continue
+            if firstFrame is not None and chunk["lastFrame"] < firstFrame or lastFrame is not None and chunk["firstFrame"] > lastFrame:
+                continue
+            if firstTime is not None and chunk["lastTime"] < firstTime or lastTime is not None and chunk["firstTime"] > lastTime:
+                continue
+            yield chunk
+        return
+
+    # Frames where an individual was recognized
+    #
+    # Parameters:
+    # name:   the name of the individual
+    # source: the name of the source (Default: None, all the sources)
+    #
+    # Return: the sorted array of the frame numbers
+    def framesWithIdentity(self, name, source = None):
+        faces = self.facesOf(name, source)
+        return np.unique(faces["frame"])
+
+    # Faces of an individual
+    #
+    # Parameters:
+    # name:   the name of the individual
+    # source: the name of the source (Default: None, all the sources)
+    #
+    # Return: a structured array (FACE_DTYPE) of the faces
+    def facesOf(self, name, source = None):
+        identity = self.identityIds.get(name)
+        if identity is None or (source is not None and source not in self.sourceIds):
+            return np.empty(0, dtype=FACE_DTYPE)
+        files = [self.load(chunk["faces"]) for chunk in self.selectChunks(source, identity=identity)]
+        parts = []
+        for faces in files + [self.buffered()[0]]:
+            mask = faces["identity"] == identity
+            if source is not None:
+                mask &= faces["source"] == self.sourceIds[source]
+            parts.append(faces[mask])
+        return self.join(parts, FACE_DTYPE)
+
+    # Faces found in a range of frames
+    #
+    # Parameters:
+    # firstFrame: the first frame of the range
+    # lastFrame:  the last frame of the range (included)
+    # source:     the name of the source (Default: None, all the sources)
+    #
+    # Return: a structured array (FACE_DTYPE) of the faces
+    def facesInFrames(self, firstFrame, lastFrame, source = None):
+        if source is not None and source not in self.sourceIds:
+            return np.empty(0, dtype=FACE_DTYPE)
+        parts = []
+        for chunk in self.selectChunks(source, firstFrame, lastFrame):
+            faces = self.load(chunk["faces"])
+            for sourceId in chunk["sources"]:
+                if source is not None and sourceId != self.sourceIds[source]:
+                    continue
+                # rows are sorted by (source, frame): two binary searches per source
+                start, end = np.searchsorted(faces["source"], [sourceId, sourceId + 1])
+                frames = faces["frame"][start:end]
+                a, b = np.searchsorted(frames, [firstFrame, lastFrame + 1])
+                parts.append(faces[start + a:start + b])
+        faces = self.buffered()[0]
+        mask = (faces["frame"] >= firstFrame) & (faces["frame"] <= lastFrame)
+        if source is not None:
+            mask &= faces["source"] == self.sourceIds[source]
+        parts.append(faces[mask])
+        return self.join(parts, FACE_DTYPE)
+
+    # Faces found in a time range
+    #
+    # Parameters:
+    # firstTime: the start of the range, in milliseconds
+    # lastTime:  the end of the range (included), in milliseconds
+    # source:    the name of the source (Default: None, all the sources)
+    #
+    # Return: a structured array (FACE_DTYPE) of the faces
+    def facesInTime(self, firstTime, lastTime, source = None):
+        if source is not None and source not in self.sourceIds:
+            return np.empty(0, dtype=FACE_DTYPE)
+        files = [self.load(chunk["faces"]) for chunk in self.selectChunks(source, firstTime=firstTime, lastTime=lastTime)]
+        parts = []
+        for faces in files + [self.buffered()[0]]:
+            mask = (faces["timestamp"] >= firstTime) & (faces["timestamp"] <= lastTime)
+            if source is not None:
+                mask &= faces["source"] == self.sourceIds[source]
+            parts.append(faces[mask])
+        return self.join(parts, FACE_DTYPE)
+
+    # The analyzed frames (also the ones without faces)
+    #
+    # Parameters:
+    # source: the name of the source (Default: None, all the sources)
+    #
+    # Return: a structured array (FRAME_DTYPE) of the frames
+    def frames(self, source = None):
+        if source is not None and source not in self.sourceIds:
+            return np.empty(0, dtype=FRAME_DTYPE)
+        files = [self.load(chunk["frames"]) for chunk in self.selectChunks(source)]
+        parts = []
+        for frames in files + [self.buffered()[1]]:
+            if source is not None:
+                frames = frames[frames["source"] == self.sourceIds[source]]
+            parts.append(frames)
+        return self.join(parts, FRAME_DTYPE)
+
+    # Names of the identities of some faces
+    #
+    # Parameters:
+    # faces: a structured array (FACE_DTYPE) of faces
+    def namesOf(self, faces):
+        return [self.identities[i] if i >= 0 else None for i in faces["identity"]]
@@ -0,0 +1,415 @@
+# -----------------------------------------------------------
+# SharedFrameRing Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Video Reader
+from src.VideoReader import VideoReader
+# Encoding Store
+from src.EncodingStore import EncodingStore
+from multiprocessing import shared_memory
+import multiprocessing
+import argparse
+import queue
+import time
+import traceback
+import cv2
+import numpy as np
+
+# This code aim to spread the video analysis over several processes (and cores):
+# - a capture process decodes the frames and writes them in a ring of slots
+#   in shared memory, every one with its sequence number
+# - one or more inference processes (each with its own OpenFader instance)
+#   claim a frame, analyze it in place (no copy, no pickling) and send back
+#   only the faces found
+# Live sources drop frames: the readers claim the most recent frame, and the
+# capture overwrites the frames nobody claimed, skipping the slots whose frame
+# is being analyzed (so a slow analysis never loses its frame). Video files are
+# analyzed frame by frame: the readers claim the frames in order and the
+# capture waits for a free slot.
+#
+# How to use it?
+# 1) Create the pipeline:                   p = MultiProcessPipeline("Media/video.mp4", "Detection", workers = 3)
+# 2) Start it:                              p.start()
+# 3) Read the results:                      for seq, index, timestamp, faces in p.results(): ...
+# 4) Stop it:                               p.stop()
+# python -m src.SharedFrameRing Media/video.mp4 --workers 3 --algorithm Detection
+
+# SharedFrameRing class
+#
+# A ring of frame slots in shared memory. Layout of the shared block:
+# - header:  int64 [last written sequence, last claimed sequence, closed flag, written frames]
+# - slotSeq: int64, the sequence of the frame in every slot (-1 while it's written)
+# - slotClaim: int64, the sequence of the last frame claimed in every slot
+# - slotDone: int64, the sequence of the last frame analyzed in every slot
+# When frames are dropped, the sequence numbers of the skipped slots are not used.
+# - meta:    float64 (frame index, timestamp in ms) of every slot
+# - frames:  uint8 (slots x height x width x 3)
+class SharedFrameRing:
+
+    # Constructor
+    #
+    # Parameters:
+    # shape:  the (height, width, 3) shape of the frames
+    # slots:  the number of frames in the ring (Default: 8)
+    # name:   the name of an existing ring to attach to (Default: None, a new ring is created)
+    def __init__(self, shape, slots = 8, name = None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frameBytes = int(np.prod(self.shape))
+        size = 8 * 4 + 24 * slots + 16 * slots + frameBytes * slots
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False              # only the creator unlinks the block
+        buf = self.memory.buf
+        offset = 0
+        self.header = np.ndarray((4,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * 4
+        self.slotSeq = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.slotClaim = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.slotDone = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.meta = np.ndarray((slots, 2), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 16 * slots
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=offset)
+        if self.owner:
+            self.header[:] = (-1, -1, 0, 0)
+            self.slotSeq[:] = -1
+            self.slotClaim[:] = -1
+            self.slotDone[:] = -1
+        return
+
+    # The name of the shared block (to attach to it from another process)
+    @property
+    def name(self):
+        return self.memory.name
+
+    # Write a frame in the next slot (only one writer)
+    #
+    # Parameters:
+    # frame:     the BGR frame (resized to the ring shape if needed)
+    # index:     the frame index in the source
+    # timestamp: the frame time in ms
+    # wait:      if True, wait until the frame in the slot has been analyzed (Default: False, overwrite
+    #            it if not claimed, else write in the next slot)
+    # stop:      the multiprocessing.Event interrupting the wait (Default: None)
+    #
+    # Return: the sequence number of the frame, or None if the wait was interrupted
+    def write(self, frame, index, timestamp, wait = False, stop = None):
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_AREA)
+        seq = int(self.header[0]) + 1
+        slot = seq % self.slots
+        while wait and self.slotSeq[slot] >= 0 and self.slotDone[slot] != self.slotSeq[slot]:
+            if stop is not None and stop.is_set():
+                return None
+            time.sleep(0.001)
+        skipped = 0
+        while True:
+            old = int(self.slotSeq[slot])
+            self.slotSeq[slot] = -1         # the slot is being written (a reader claiming it now gives up)
+            if wait or old < 0 or self.slotClaim[slot] != old or self.slotDone[slot] == old:
+                break
+            self.slotSeq[slot] = old        # its frame is being analyzed: try the next slot
+            seq += 1
+            slot = seq % self.slots
+            skipped += 1
+            if skipped % self.slots == 0:   # every frame is being analyzed
+                if stop is not None and stop.is_set():
+                    return None
+                time.sleep(0.001)
+        self.frames[slot] = frame
+        self.meta[slot] = (index, timestamp)
+        self.slotSeq[slot] = seq
+        self.header[0] = seq
+        self.header[3] += 1
+        return seq
+
+    # Claim a frame not yet claimed by any reader
+    #
+    # Parameters:
+    # lock:   the multiprocessing.Lock shared by the readers
+    # newest: if True, claim the most recent frame (the older ones are dropped),
+    #         otherwise the oldest not claimed one (Default: True)
+    #
+    # Return: the (seq, index, timestamp, frame) of the frame, or None if there is no new frame.
+    #         The frame is a view on the shared memory: it's valid until isValid(seq) is False.
+    #         Call release(seq) once the frame has been analyzed.
+    def claim(self, lock, newest = True):
+        with lock:
+            last = int(self.header[0])
+            if last < 0 or last <= self.header[1]:
+                return None
+            seq = last if newest else int(self.header[1]) + 1
+            self.header[1] = seq
+            slot = seq % self.slots
+            if self.slotSeq[slot] != seq:
+                return None                 # already overwritten (or a skipped sequence)
+            self.slotClaim[slot] = seq      # from now on the capture doesn't overwrite it
+        if self.slotSeq[slot] != seq:
+            self.slotDone[slot] = seq       # overwritten while it was claimed: give it back
+            return None
+        index, timestamp = self.meta[slot]
+        return seq, int(index), float(timestamp), self.frames[slot]
+
+    # Check if the frame of a sequence number is still in its slot
+    def isValid(self, seq):
+        return self.slotSeq[seq % self.slots] == seq
+
+    # Mark a claimed frame as analyzed (its slot can be written again)
+    def release(self, seq):
+        self.slotDone[seq % self.slots] = seq
+        return
+
+    # Number of frames written so far
+    def written(self):
+        return int(self.header[3])
+
+    # Mark the end of the stream
+    def closeStream(self):
+        self.header[2] = 1
+        return
+
+    # Check if the stream ended
+    def isClosed(self):
+        return self.header[2] == 1
+
+    # Release the shared memory (and destroy it, if this process created it)
+    def close(self):
+        self.header = self.slotSeq = self.slotClaim = self.slotDone = self.meta = self.frames = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass                            # a frame view is still referenced: released at the process exit
+        if self.owner:
+            self.memory.unlink()
+        return
+
+# Body of the capture process
+#
+# Parameters:
+# name:         the name of the ring
+# shape:        the frame shape of the ring
+# slots:        the number of slots of the ring
+# source:       the camera index or the video path
+# height_limit: the max height of the frames
+# realTime:     if True, a video file is read at its own FPS (as a camera), otherwise as fast as possible
+# dropFrames:   if True, the frames not yet analyzed are overwritten, otherwise the capture waits for them
+# stop:         the multiprocessing.Event stopping the process
+def captureProcess(name, shape, slots, source, height_limit, realTime, dropFrames, stop):
+    ring = SharedFrameRing(shape, slots, name)
+    capture = VideoReader(source, height_limit)
+    fps = capture.get(cv2.CAP_PROP_FPS) if realTime and not isinstance(source, int) else 0
+    index = 0
+    try:
+        while not stop.is_set():
+            start = time.time()
+            status, frame = capture.read()
+            if not status:
+                break
+            if ring.write(frame, index, capture.get(cv2.CAP_PROP_POS_MSEC), not dropFrames, stop) is None:
+                break
+            index += 1
+            if fps > 0:
+                time.sleep(max(0.0, 1.0 / fps - (time.time() - start)))
+    finally:
+        ring.closeStream()
+        capture.release()
+        ring.close()
+    return
+
+# Body of an inference process
+#
+# Parameters:
+# name:      the name of the ring
+# shape:     the frame shape of the ring
+# slots:     the number of slots of the ring
+# lock:      the lock shared by the readers
+# algorithm: the analysis to execute (Detection, Expression or Recognition)
+# db_path:   the folder of the Face Recognition training dataset
+# newest:    if True, the most recent frame is claimed, otherwise the oldest not claimed one
+# results:   the multiprocessing.Queue where the results are sent
+# stop:      the multiprocessing.Event stopping the process
+def inferenceProcess(name, shape, slots, lock, algorithm, db_path, newest, results, stop):
+    from src.OpenFader import OpenFader        # imported here: the capture process doesn't need it
+    ring = SharedFrameRing(shape, slots, name)
+    fader = OpenFader(db_path)
+    analyze = fader.algorithmMap[algorithm]["target_analysis_function"]
+    try:
+        while not stop.is_set():
+            item = ring.claim(lock, newest)
+            if item is None:
+                if ring.isClosed():
+                    break
+                time.sleep(0.002)
+                continue
+            seq, index, timestamp, frame = item
+            start = time.time()
+            try:
+                analyze(frame)
+                faces = fader.describeResult(algorithm)
+                if not ring.isValid(seq):
+                    faces = None        # the frame was overwritten during the analysis
+            except Exception:
+                traceback.print_exc()
+                faces = None
+            frame = item = None
+            ring.release(seq)
+            results.put((seq, index, timestamp, faces, time.time() - start))
+    finally:
+        results.put(None)               # this worker is done
+        ring.close()
+    return
+
+# MultiProcessPipeline class
+#
+# This class runs a capture process and N inference processes around a SharedFrameRing
+class MultiProcessPipeline:
+
+    # Constructor
+    #
+    # Parameters:
+    # source:       the camera index or the video path
+    # algorithm:    the analysis to execute (Default: Detection)
+    # workers:      the number of inference processes (Default: 2)
+    # slots:        the number of frames of the ring (Default: 4 for every worker)
+    # height_limit: the max height of the frames (Default: None, no limit)
+    # realTime:     if True, a video file is read at its own FPS (Default: False, as fast as possible)
+    # db_path:      the folder of the Face Recognition training dataset (Default: Media/db)
+    # dropFrames:   if True, the inference skips to the most recent frame (Default: None, True only
+    #               for cameras and real time videos: every frame of a video file is analyzed)
+    def __init__(self, source, algorithm = "Detection", workers = 2, slots = None, height_limit = None, realTime = False,
+                 db_path = "Media/db", dropFrames = None):
+        self.source = source
+        self.algorithm = algorithm
+        self.workers = workers
+        self.slots = slots or max(4, 4 * workers)
+        self.height_limit = height_limit
+        self.realTime = realTime
+        self.db_path = db_path
+        self.dropFrames = (isinstance(source, int) or realTime) if dropFrames is None else dropFrames
+        self.processes = []
+        self.ring = None
+        # Statistics
+        self.analyzed = 0
+        self.discarded = 0              # results of frames overwritten during their analysis
+        self.analysisTime = 0.0
+        self.started = None
+        return
+
+    # Start the processes
+    def start(self):
+        # The shape of the ring is the shape of the first frame
+        capture = VideoReader(self.source, self.height_limit)
+        status, frame = capture.read()
+        capture.release()
+        if not status:
+            raise IOError("Cannot read from the source %s" % (self.source,))
+        # Bring the training dataset up to date once, before the workers read it
+        EncodingStore(self.db_path).refresh()
+        self.ring = SharedFrameRing(frame.shape, self.slots)
+        context = multiprocessing.get_context("spawn")      # no TensorFlow state inherited by fork
+        self.stopEvent = context.Event()
+        self.lock = context.Lock()
+        self.queue = context.Queue()
+        self.processes = [context.Process(target=captureProcess, daemon=True,
+                                          args=(self.ring.name, frame.shape, self.slots, self.source,
+                                                self.height_limit, self.realTime, self.dropFrames, self.stopEvent))]
+        for _ in range(self.workers):
+            self.processes.append(context.Process(target=inferenceProcess, daemon=True,
+                                                  args=(self.ring.name, frame.shape, self.slots, self.lock, self.algorithm,
+                                                        self.db_path, self.dropFrames, self.queue, self.stopEvent)))
+        self.started = time.time()
+        for process in self.processes:
+            process.start()
+        return
+
+    # Iterate over the results, until all the inference processes are done
+    # (with more than one worker, the results may come out of order)
+    #
+    # Return: (seq, frame index, timestamp, faces) for every analyzed frame
+    def results(self):
+        running = self.workers
+        while running > 0:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self.processes[1:]):
+                    break               # the workers died without saying goodbye
+                continue
+            if item is None:
+                running -= 1
+                continue
+            seq, index, timestamp, faces, seconds = item
+            self.analysisTime += seconds
+            if faces is None:
+                self.discarded += 1
+                continue
+            self.analyzed += 1
+            yield seq, index, timestamp, faces
+        return
+
+    # Stop the processes and release the ring
+    def stop(self):
+        if self.ring is None:
+            return
+        self.stopEvent.set()
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+        self.ring = None
+        return
+
+    # Throughput statistics
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9) if self.started else 1e-9
+        written = self.ring.written() if self.ring is not None else None
+        return {
+            "captured": written,
+            "analyzed": self.analyzed,
+            "discarded": self.discarded,
+            "analysis_fps": self.analyzed / elapsed,
+            "mean_analysis_ms": 1000 * self.analysisTime / max(1, self.analyzed + self.discarded)
+        }
+
+# Command line entry point: analyze a source with N processes and print the throughput
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a video with a capture process and N inference processes")
+    parser.add_argument("source", help="the video path or the camera index")
+    parser.add_argument("--algorithm", choices=["Detection", "Expression", "Recognition"], default="Detection")
+    parser.add_argument("--workers", type=int, default=2, help="number of inference processes (default: 2)")
+    parser.add_argument("--height", type=int, default=None, help="max frame height (default: no limit)")
+    parser.add_argument("--realtime", action="store_true", help="read a video file at its own FPS")
+    parser.add_argument("--db", default="Media/db", help="the folder of the encoding store (default: Media/db)")
+    parser.add_argument("--drop", action="store_true", help="skip to the most recent frame (default: only for cameras and --realtime)")
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    pipeline = MultiProcessPipeline(source, args.algorithm, args.workers, height_limit=args.height,
+                                    realTime=args.realtime, db_path=args.db, dropFrames=True if args.drop else None)
+    pipeline.start()
+    try:
+        last = time.time()
+        for seq, index, timestamp, faces in pipeline.results():
+            if time.time() - last >= 1:
+                last = time.time()
+                print(pipeline.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = pipeline.stats()
+        pipeline.stop()
+    print(stats)
+    return
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# -----------------------------------------------------------
+# StreamManager Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# OpenFader
+from src.OpenFader import OpenFader
+# Frame Pipeline
+from src.FramePipeline import LatestFrameSlot
+# Video Reader
+from src.VideoReader import VideoReader
+# Thread library
+from threading import Thread, Condition, Lock
+import argparse
+import time
+import traceback
+import cv2
+
+# Stream class
+#
+# A video source (camera or file) registered in a StreamManager,
+# with its own capture thread, analysis state and statistics
+class Stream:
+
+    # Constructor
+    #
+    # Parameters:
+    # id:           the id of the stream
+    # source:       the camera index or the video path
+    # fader:        the OpenFader instance holding the analysis state of the stream
+    # algorithm:    the analysis to execute (Detection, Expression or Recognition)
+    # height_limit: the max height of the frames (Default: None, no limit)
+    # loop:         if True, a video file restarts at its end (Default: False)
+    # onResult:     the function called as onResult(stream, frame index, faces) (Default: None)
+    def __init__(self, id, source, fader, algorithm, height_limit = None, loop = False, onResult = None):
+        self.id = id
+        self.source = source
+        self.fader = fader
+        self.algorithm = algorithm
+        self.loop = loop
+        self.onResult = onResult
+        self.capture = VideoReader(source, height_limit)
+        self.isFile = not isinstance(source, int)
+        self.slot = LatestFrameSlot()
+        self.busy = Lock()                  # one analysis at a time for every stream
+        self.close = False
+        self.finished = False
+        # Statistics
+        self.started = time.time()
+        self.captured = 0
+        self.analyzed = 0
+        self.analysisTime = 0.0
+        self.frameIndex = -1                # index of the last captured frame
+        self.lastResult = []                # faces found in the last analyzed frame
+        return
+
+    # Throughput statistics of the stream
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "source": self.source,
+            "algorithm": self.algorithm,
+            "captured": self.captured,
+            "analyzed": self.analyzed,
+            "dropped": self.slot.dropped,
+            "capture_fps": self.captured / elapsed,
+            "analysis_fps": self.analyzed / elapsed,
+            "mean_analysis_ms": 1000 * self.analysisTime / max(self.analyzed, 1),
+            "finished": self.finished
+        }
+
+# StreamManager class
+#
+# This class analyzes N video sources at the same time in one process:
+# - all the streams share one set of loaded models
+# - every stream has its own capture thread and its own analysis state
+# - a pool of inference workers serves the streams with a fresh frame in
+#   round-robin order, so every stream gets a fair share of inference time
+#
+# How to use it?
+# 1) Create an instance of the class:       m = StreamManager()
+# 2) Register the sources:                  m.addStream(0); m.addStream("Media/video.mp4", "Expression")
+# 3) Start the analysis:                    m.start()
+# 4) Read the per-stream statistics:        m.stats()
+# 5) Stop everything:                       m.stop()
+class StreamManager:
+
+    # Constructor
+    #
+    # Parameters:
+    # algorithm: the default analysis of the streams (Default: Detection)
+    # workers:   the number of inference threads (Default: 1)
+    # db_path:   the folder of the Face Recognition training dataset (Default: Media/db)
+    def __init__(self, algorithm = "Detection", workers = 1, db_path = "Media/db"):
+        self.algorithm = algorithm
+        self.workers = workers
+        self.models = OpenFader(db_path)        # the models are loaded only once
+        self.streams = []
+        self.condition = Condition()            # signaled when a stream has a new frame
+        self.cursor = 0                         # next stream to serve (round-robin)
+        self.threads = []
+        self.close = False
+        return
+
+    # Register a new source
+    #
+    # Parameters:
+    # source:       the camera index or the video path
+    # algorithm:    the analysis to execute (Default: None, the manager default)
+    # height_limit: the max height of the frames (Default: None, no limit)
+    # loop:         if True, a video file restarts at its end (Default: False)
+    # onResult:     the function called as onResult(stream, frame index, faces) (Default: None)
+    #
+    # Return: the new Stream
+    def addStream(self, source, algorithm = None, height_limit = None, loop = False, onResult = None):
+        fader = OpenFader(self.models.db_path, shareModelsWith=self.models)
+        fader.initAgain()
+        stream = Stream(len(self.streams), source, fader, algorithm or self.algorithm, height_limit, loop, onResult)
+        with self.condition:
+            self.streams.append(stream)
+        thread = Thread(target=self.captureLoop, args=(stream,))
+        thread.daemon = True
+        thread.start()
+        return stream
+
+    # Start the inference workers
+    def start(self):
+        for _ in range(self.workers):
+            thread = Thread(target=self.inferenceLoop, args=())
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return
+
+    # Stop all the streams and the workers
+    def stop(self):
+        self.close = True
+        for stream in self.streams:
+            stream.close = True
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        return
+
+    # Check if all the streams reached their end
+    def finished(self):
+        return all(stream.finished for stream in self.streams)
+
+    # Capture loop of a stream (one thread for every stream)
+    def captureLoop(self, stream):
+        fps = stream.capture.get(cv2.CAP_PROP_FPS) if stream.isFile else 0
+        interval = 1 / fps if fps and fps > 0 else 0      # a file is read at its own speed, like a live feed
+        while not stream.close and not self.close:
+            start = time.time()
+            status, frame = stream.capture.read()
+            if not status:
+                if stream.isFile and stream.loop:
+                    stream.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+            stream.frameIndex += 1
+            stream.captured += 1
+            stream.slot.put((stream.frameIndex, frame))
+            with self.condition:
+                self.condition.notify()
+            wait = interval - (time.time() - start)
+            if wait > 0:
+                time.sleep(wait)
+        stream.capture.release()
+        stream.finished = True
+        with self.condition:
+            self.condition.notify_all()
+        return
+
+    # Take the next stream with a fresh frame, in round-robin order
+    #
+    # Return: the (stream, frame index, frame), or None when stopping
+    def nextJob(self):
+        with self.condition:
+            while not self.close:
+                n = len(self.streams)
+                for i in range(n):
+                    stream = self.streams[(self.cursor + i) % n]
+                    if not stream.busy.acquire(blocking=False):
+                        continue
+                    item = stream.slot.poll()
+                    if item is None:
+                        stream.busy.release()
+                        continue
+                    self.cursor = (self.cursor + i + 1) % n     # the next search starts after this stream
+                    return (stream,) + item
+                self.condition.wait(0.1)
+        return None
+
+    # Inference loop (one thread for every worker)
+    def inferenceLoop(self):
+        while not self.close:
+            job = self.nextJob()
+            if job is None:
+                return
+            stream, index, frame = job
+            try:
+                start = time.time()
+                stream.fader.runVideoAnalysis(stream.fader.algorithmMap[stream.algorithm]["target_analysis_function"], frame)
+                stream.analysisTime += time.time() - start
+                stream.analyzed += 1
+                stream.lastResult = stream.fader.describeResult(stream.algorithm)
+                if stream.onResult:
+                    stream.onResult(stream, index, stream.lastResult)
+            except Exception:
+                traceback.print_exc()       # an error on a stream must not stop the others
+            finally:
+                stream.busy.release()
+        return
+
+    # Throughput statistics of every stream
+    def stats(self):
+        return [stream.stats() for stream in self.streams]
+
+# Command line entry point: analyze some sources together and print their throughput
+def main():
+    parser = argparse.ArgumentParser(description="Analyze several cameras or videos at once with shared models")
+    parser.add_argument("sources", nargs="+", help="camera indexes or video paths")
+    parser.add_argument("--algorithm", choices=["Detection", "Expression", "Recognition"], default="Detection", help="the analysis to execute (default: Detection)")
+    parser.add_argument("--workers", type=int, default=1, help="number of inference threads (default: 1)")
+    parser.add_argument("--db", default="Media/db", help="the folder of the encoding store (default: Media/db)")
+    args = parser.parse_args()
+
+    manager = StreamManager(args.algorithm, args.workers, args.db)
+    for source in args.sources:
+        manager.addStream(int(source) if source.isdigit() else source)
+    manager.start()
+    try:
+        while not manager.finished():
+            time.sleep(2)
+            for s in manager.stats():
+                print("[%s] captured %.1f fps, analyzed %.1f fps, dropped %d, %.1f ms/frame" %
+                      (s["source"], s["capture_fps"], s["analysis_fps"], s["dropped"], s["mean_analysis_ms"]))
+    except KeyboardInterrupt:
+        pass
+    manager.stop()
+    return
+
+if __name__ == "__main__":
+    main()
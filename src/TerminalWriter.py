@@ -0,0 +1,106 @@
+# -----------------------------------------------------------
+# TerminalWriter Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# TKinter - the Python GUI Library
+import tkinter as tk
+from tkinter import END
+from threading import Lock
+
+# TerminalWriter class
+#
+# This class writes on the GUI terminal (a Tk Text widget) for any thread:
+# - write and clean only queue the text, so they can be called by any thread
+# - the Tk thread drains the queue at a capped rate (every `interval` ms)
+# - the widget is touched only when its content actually changes: e.g. the
+#   same names cleaned and written again at every frame cost nothing
+# - only the last `maxLines` lines are kept
+#
+# How to use it?
+# 1) Create an instance of the class:       t = TerminalWriter(root, textWidget)
+# 2) Write a text (from any thread):        t.write("\nHello")
+# 3) Clean the terminal (from any thread):  t.clean()
+class TerminalWriter:
+
+    # Constructor
+    #
+    # Parameters:
+    # root:     the Tk root, whose thread updates the widget
+    # widget:   the Text widget
+    # interval: the min time between two updates of the widget, in ms (Default: 100)
+    # maxLines: the max number of kept lines (Default: 500)
+    def __init__(self, root, widget, interval = 100, maxLines = 500):
+        self.root = root
+        self.widget = widget
+        self.interval = interval
+        self.maxLines = maxLines
+        self.lock = Lock()
+        self.queue = []             # texts written since the last drain (or since the last clean)
+        self.cleaned = False        # True if clean was called since the last drain
+        self.content = ""           # text currently in the widget
+        self.root.after(self.interval, self.drain)
+        return
+
+    # Queue a text to be appended
+    def write(self, text):
+        with self.lock:
+            self.queue.append(text)
+            if len(self.queue) > 4 * self.maxLines:     # the Tk thread is late: keep only the newest texts
+                del self.queue[:len(self.queue) - self.maxLines]
+        return
+
+    # Queue a clean of the terminal
+    def clean(self):
+        with self.lock:
+            self.queue = []         # the texts written before a clean would never be visible
+            self.cleaned = True
+        return
+
+    # Apply the queued writes to the widget (executed on the Tk thread)
+    def drain(self):
+        with self.lock:
+            texts, self.queue = self.queue, []
+            cleaned, self.cleaned = self.cleaned, False
+        try:
+            self.update(cleaned, "".join(texts))
+            self.root.after(self.interval, self.drain)
+        except tk.TclError:
+            pass                    # the GUI has been destroyed
+        return
+
+    # Update the widget with as few changes as possible
+    #
+    # Parameters:
+    # cleaned: True if the terminal was cleaned before the text
+    # text:    the text to be appended
+    def update(self, cleaned, text):
+        if cleaned:
+            text = self.lastLines(text)
+            if text == self.content:
+                return              # same content as before: nothing to redraw
+            self.widget.delete("1.0", END)
+            self.widget.insert(END, text)
+            self.content = text
+            return
+        if text == "":
+            return
+        self.widget.insert(END, text)
+        self.content += text
+        extra = self.content.count("\n") - self.maxLines
+        if extra > 0:
+            cut = 0
+            for _ in range(extra):
+                cut = self.content.index("\n", cut) + 1
+            self.widget.delete("1.0", "%d.0" % (extra + 1))       # drop the oldest lines
+            self.content = self.content[cut:]
+        return
+
+    # The last maxLines lines of a text
+    def lastLines(self, text):
+        lines = text.split("\n")
+        if len(lines) <= self.maxLines + 1:
+            return text
+        return "\n".join(lines[-(self.maxLines + 1):])
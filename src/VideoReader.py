@@ -0,0 +1,94 @@
+# -----------------------------------------------------------
+# VideoReader Class included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+import cv2
+
+# VideoReader class
+#
+# This class reads a video stream like cv2.VideoCapture, but resizes every
+# frame while decoding it (keeping the aspect ratio), so a big video can be
+# analyzed from its first frame without writing a resized copy on disk
+#
+# How to use it?
+# 1) Create an instance of the class:       v = VideoReader("Media/video.mp4", height_limit = 444)
+# 2) Read the frames:                       status, frame = v.read()
+#    or walk a range of them:               for index, timestamp, frame in v.frames(start, end, step): ...
+class VideoReader:
+
+    # Constructor
+    #
+    # Parameters:
+    # src:          the video path or the webcam index
+    # height_limit: the max height of the frames. If they're bigger, they're resized (Default: None, no limit)
+    def __init__(self, src, height_limit = None):
+        self.capture = cv2.VideoCapture(src)
+        self.height_limit = height_limit
+        self.size = None            # (width, height) of the resized frames, computed at the first frame
+        self.index = 0              # index of the next frame walked by frames
+        return
+
+    # Read the next frame, resized if needed
+    #
+    # Return: the (status, frame) couple, as cv2.VideoCapture.read
+    def read(self):
+        status, frame = self.capture.read()
+        if not status or self.height_limit is None:
+            return status, frame
+        if self.size is None:
+            height, width = frame.shape[:2]
+            if height > self.height_limit:
+                self.size = (int(round(width * self.height_limit / height)), self.height_limit)
+            else:
+                self.size = (width, height)
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return status, frame
+
+    # Walk the frames of a range, decoding only one frame every step
+    # (the skipped frames are grabbed, not decoded)
+    #
+    # Parameters:
+    # start: the index of the first frame (Default: 0)
+    # end:   the index after the last frame (Default: None, the end of the video)
+    # step:  decode one frame every step (Default: 1, all of them)
+    #
+    # Return: a generator of the (index, timestamp in ms, frame) of the decoded frames
+    def frames(self, start = 0, end = None, step = 1):
+        if start > 0:
+            self.set(cv2.CAP_PROP_POS_FRAMES, start)
+        self.index = start
+        while end is None or self.index < end:
+            if (self.index - start) % step == 0:
+                status, frame = self.read()
+                if not status:
+                    break
+                yield self.index, self.get(cv2.CAP_PROP_POS_MSEC), frame
+            elif not self.grab():
+                break
+            self.index += 1
+        return
+
+    # Skip the next frame without decoding it
+    def grab(self):
+        return self.capture.grab()
+
+    # Check if the stream is open
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    # Set a property of the stream (as cv2.VideoCapture.set)
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    # Get a property of the stream (as cv2.VideoCapture.get)
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    # Close the stream
+    def release(self):
+        self.capture.release()
+        return
@@ -9,19 +9,32 @@
 from threading import Thread
 import cv2
 import time
-# PIL Library
-from PIL import Image, ImageTk
+# Frame Renderer
+from src.FrameRenderer import FrameRenderer
+# Frame Pipeline
+from src.FramePipeline import LatestFrameSlot
+# Video Reader
+from src.VideoReader import VideoReader
+# Frame Metrics
+from src.FrameMetrics import FrameMetrics
 
 # VideoStreamWidget class 
 #
 # This class create a a thread that continuously reads from the video stream
-# and updates the active frame on the GUI Monitor
+# and hands the frames to the other stages of the pipeline:
+# - the most recent frame is offered to the analysis (self.analysisSlot)
+# - the GUI Monitor shows the most recent frame from the Tk thread
 class VideoStreamWidget(object):
 
     # Constructor
-    def __init__(self, webcam, src=0, target = None, fps = 50, FRAME_WIDTH = 850, FRAME_HEIGHT = 500):
+    def __init__(self, webcam, src=0, target = None, fps = 50, FRAME_WIDTH = 850, FRAME_HEIGHT = 500, displayInterval = 15, height_limit = None, metrics = None, renderer = None):
         self.webcam = webcam
-        self.capture = cv2.VideoCapture(src)
+        # Per-stage timing of the frame path
+        self.metrics = metrics if metrics is not None else FrameMetrics()
+        # Display the frames on the GUI Monitor reusing the same image buffer
+        self.renderer = renderer if renderer is not None else FrameRenderer(webcam, FRAME_WIDTH, FRAME_HEIGHT, metrics=self.metrics)
+        # Frames are resized while decoding them (no resized copy of the video on disk)
+        self.capture = VideoReader(src, height_limit)
         # Set dimensions
         self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
         self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
@@ -30,39 +43,53 @@ class VideoStreamWidget(object):
         # FPS: frame per second
         self.fps = fps
         self.close = False
+        # Single-slot queues between the stages (latest frame wins)
+        self.analysisSlot = LatestFrameSlot()
+        self.displaySlot = LatestFrameSlot()
+        self.displayInterval = displayInterval      # ms between two checks for a new frame to display
+        self.metrics.addDropSource("analysis", lambda: self.analysisSlot.dropped)
+        self.metrics.addDropSource("display", lambda: self.displaySlot.dropped)
         # Start the thread to read frames from the video stream
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
         self.thread.start()
+        # Start the display stage on the Tk thread
+        self.webcam.after(self.displayInterval, self.show_frame)
 
-    # Main loop. It continuously updates the active frame on the GUI Monitor
+    # Main loop. It continuously reads the frames and hands them to the other stages
     def update(self):
         while not self.close:
             if self.capture.isOpened():
                 # Read the next frame from the stream in a different thread
-                (self.status, self.frame) = self.capture.read()
+                with self.metrics.measure("capture"):
+                    (self.status, self.frame) = self.capture.read()
                 if self.status:
-                    # Execute the function able to show the stream
-                    self.show_frame()
+                    self.metrics.tick("capture")
+                    with self.metrics.measure("flip"):
+                        frame = cv2.flip(self.frame, 1)
+                    self.analysisSlot.put(frame)
+                    self.displaySlot.put(frame)
                 else:
                     # Replay
                     self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
             # Execute this loop every 1/FPS seconds
             interval = 1/self.fps
             time.sleep(interval)
+        self.analysisSlot.close()
 
-    # Display the active frame on the GUI Monitor
+    # Display the active frame on the GUI Monitor (executed on the Tk thread)
     def show_frame(self):
-        
-        # Display frame in main program
-        frame = cv2.flip(self.frame, 1)
-        frame_to_analize = frame
-        # Execute the main function
-        if self.target:
-            self.target(frame_to_analize)
-        # Adapt the frame to the GUI Monitor        
-        cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
-        img = Image.fromarray(cv2image)
-        imgtk = ImageTk.PhotoImage(image=img)
-        self.webcam.imgtk = imgtk
-        self.webcam.configure(image=self.webcam.imgtk)
\ No newline at end of file
+        if self.close:
+            return
+        # Take a frame only when a redraw is due: the others are dropped in the slot
+        frame = self.displaySlot.poll() if self.renderer.due() else None
+        if frame is not None:
+            # the analysis may be reading the same frame: draw on a copy
+            frame = frame.copy()
+            # Execute the main function
+            if self.target:
+                with self.metrics.measure("draw"):
+                    self.target(frame)
+            # Adapt the frame to the GUI Monitor        
+            self.renderer.render(frame, True)
+        self.webcam.after(self.displayInterval, self.show_frame)
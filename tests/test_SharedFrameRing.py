@@ -0,0 +1,89 @@
+# -----------------------------------------------------------
+# SharedFrameRing tests included in the OpenFader Library
+#
+# (C) 2021 G.Boleto & G.Sommariva, Genoa, Italy
+# Università di Genova, DIBRIS
+# -----------------------------------------------------------
+
+# Shared Frame Ring
+from src.SharedFrameRing import SharedFrameRing
+from threading import Thread, Lock, Event
+import time
+import unittest
+import numpy as np
+
+# The capture and the readers run in threads of this process: the ring is the
+# same shared block the processes of MultiProcessPipeline use
+#
+# How to use it?
+# python -m pytest tests
+
+SHAPE = (24, 32, 3)
+
+# Write a frame every 1/fps seconds, until stop is set
+def capture(ring, fps, wait, stop):
+    index = 0
+    while not stop.is_set():
+        frame = np.full(SHAPE, index % 256, dtype=np.uint8)
+        if ring.write(frame, index, index * 1000.0 / fps, wait, stop) is None:
+            break
+        index += 1
+        time.sleep(1.0 / fps)
+    return
+
+# Claim frames and analyze them in `seconds`, recording (seq, index, valid, pixel)
+def reader(ring, lock, seconds, newest, stop, results):
+    while not stop.is_set():
+        item = ring.claim(lock, newest)
+        if item is None:
+            time.sleep(0.001)
+            continue
+        seq, index, timestamp, frame = item
+        time.sleep(seconds)
+        results.append((seq, index, ring.isValid(seq), int(frame[0, 0, 0])))
+        frame = item = None
+        ring.release(seq)
+    return
+
+class SharedFrameRingTest(unittest.TestCase):
+
+    def run_ring(self, slots, workers, fps, seconds, duration, wait):
+        ring = SharedFrameRing(SHAPE, slots)
+        lock, stop = Lock(), Event()
+        results = []
+        threads = [Thread(target=capture, args=(ring, fps, wait, stop))]
+        threads += [Thread(target=reader, args=(ring, lock, seconds, not wait, stop, results)) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        written = ring.written()
+        ring.close()
+        return results, written
+
+    # A camera analyzed slower than the ring turns over: no frame under analysis is overwritten
+    def test_drop_slow_analysis(self):
+        results, written = self.run_ring(slots=4, workers=1, fps=30, seconds=0.2, duration=1.5, wait=False)
+        self.assertGreater(written, 4 * len(results))          # the capture didn't wait for the analysis
+        self.assertGreaterEqual(len(results), 5)
+        for seq, index, valid, pixel in results:
+            self.assertTrue(valid)
+            self.assertEqual(pixel, index % 256)                # the analyzed pixels are the claimed frame
+
+    def test_drop_slow_analysis_workers(self):
+        results, written = self.run_ring(slots=8, workers=2, fps=60, seconds=0.1, duration=1.0, wait=False)
+        self.assertGreaterEqual(len(results), 10)
+        self.assertTrue(all(valid and pixel == index % 256 for seq, index, valid, pixel in results))
+
+    # A video file: every frame is analyzed, in order
+    def test_wait_every_frame(self):
+        results, written = self.run_ring(slots=4, workers=1, fps=200, seconds=0.01, duration=0.5, wait=True)
+        indices = [index for seq, index, valid, pixel in results]
+        self.assertEqual(indices, list(range(len(indices))))
+        self.assertGreaterEqual(len(indices), written - 4)
+        self.assertTrue(all(valid for seq, index, valid, pixel in results))
+
+if __name__ == "__main__":
+    unittest.main()